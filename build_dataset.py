@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+
+from train_model import list_image_files, split_files, augment_batch, rescale_batch
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_sha256(path: str) -> str:
+    """Content hash of a file, read in 1 MB chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(shard_dir: str) -> Optional[Dict]:
+    manifest_path = os.path.join(shard_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_shard_dir(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+
+def decode_files(paths: List[str], img_size=(224, 224)):
+    """Decode and resize files in parallel, yielding uint8 arrays in input order."""
+    def load(path):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        image = tf.image.resize(image, img_size)
+        return tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8)
+
+    ds = tf.data.Dataset.from_tensor_slices(paths)
+    ds = ds.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    for image in ds.prefetch(tf.data.AUTOTUNE):
+        yield image.numpy()
+
+
+def build_dataset(data_dir: str, shard_dir: str, img_size=(224, 224), shard_size: int = 1024,
+                  compact: bool = False) -> Dict:
+    """
+    Decode and resize every image under data_dir/<class>/ once into fixed-size uint8
+    .npy shards in shard_dir, with a manifest holding the label index and content hashes.
+    Rebuilds are incremental: unchanged files keep their existing shard rows and only
+    new or modified files are decoded into new shards. compact=True rewrites all shards.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    files, class_names = list_image_files(data_dir)
+
+    manifest = load_manifest(shard_dir)
+    if manifest is None or compact or manifest.get("img_size") != list(img_size) \
+            or manifest.get("class_names") != class_names:
+        for name in (manifest or {}).get("shards", []):
+            if os.path.isfile(os.path.join(shard_dir, name)):
+                os.remove(os.path.join(shard_dir, name))
+        previous = {}
+        shards: List[str] = []
+    else:
+        previous = {e["path"]: e for e in manifest["entries"]}
+        shards = list(manifest["shards"])
+
+    entries = []
+    pending = []
+    for path, label in files:
+        rel_path = os.path.relpath(path, data_dir)
+        stat = os.stat(path)
+        entry = {
+            "path": rel_path,
+            "label": label,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
+        old = previous.get(rel_path)
+        if old is not None and old["label"] == label:
+            if old["size"] == stat.st_size and old["mtime"] == stat.st_mtime:
+                entries.append(old)
+                continue
+            sha256 = file_sha256(path)
+            if sha256 == old["sha256"]:
+                entries.append({**old, "mtime": stat.st_mtime})
+                continue
+        else:
+            sha256 = file_sha256(path)
+        entry["sha256"] = sha256
+        entries.append(entry)
+        pending.append(entry)
+
+    print(f"🔄 {len(files)} images found, {len(files) - len(pending)} unchanged, {len(pending)} to decode")
+
+    # Decode pending files into new shards
+    for start in range(0, len(pending), shard_size):
+        chunk = pending[start:start + shard_size]
+        shard_name = f"shard-{len(shards):05d}.npy"
+        shard = np.lib.format.open_memmap(
+            os.path.join(shard_dir, shard_name), mode="w+", dtype=np.uint8,
+            shape=(len(chunk),) + tuple(img_size) + (3,)
+        )
+        paths = [os.path.join(data_dir, e["path"]) for e in chunk]
+        for i, image in enumerate(decode_files(paths, img_size)):
+            shard[i] = image
+            chunk[i]["shard"] = len(shards)
+            chunk[i]["index"] = i
+        shard.flush()
+        del shard
+        shards.append(shard_name)
+        print(f"✅ Wrote {shard_name} ({len(chunk)} images)")
+
+    # Drop shards no longer referenced by any entry
+    used = {e["shard"] for e in entries}
+    for shard_id, shard_name in enumerate(shards):
+        if shard_id not in used and os.path.isfile(os.path.join(shard_dir, shard_name)):
+            os.remove(os.path.join(shard_dir, shard_name))
+
+    manifest = {
+        "img_size": list(img_size),
+        "class_names": class_names,
+        "shards": shards,
+        "entries": entries,
+    }
+    with open(os.path.join(shard_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    print(f"✅ Manifest written with {len(entries)} entries across {len(used)} shards")
+    return manifest
+
+
+class ShardedDataset:
+    """Read-only view over built shards. Shards are memory-mapped so processes share the page cache."""
+
+    def __init__(self, shard_dir: str):
+        manifest = load_manifest(shard_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"No {MANIFEST_NAME} in {shard_dir}. Run build_dataset.py first.")
+        self.shard_dir = shard_dir
+        self.img_size = tuple(manifest["img_size"])
+        self.class_names = manifest["class_names"]
+        self.entries = sorted(manifest["entries"], key=lambda e: e["path"])
+        self.shards = {
+            shard_id: np.load(os.path.join(shard_dir, name), mmap_mode="r")
+            for shard_id, name in enumerate(manifest["shards"])
+            if os.path.isfile(os.path.join(shard_dir, name))
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def gather(self, entries) -> np.ndarray:
+        """Copy the images for the given entries out of the memory-mapped shards."""
+        out = np.empty((len(entries),) + self.img_size + (3,), dtype=np.uint8)
+        for i, e in enumerate(entries):
+            out[i] = self.shards[e["shard"]][e["index"]]
+        return out
+
+    def split(self, validation_split=0.2):
+        files = [(e, e["label"]) for e in self.entries]
+        train, val = split_files(files, len(self.class_names), validation_split)
+        return [f[0] for f in train], [f[0] for f in val]
+
+    def iter_batches(self, entries, batch_size=32):
+        """Yield (uint8 images, int labels) batches in order."""
+        for start in range(0, len(entries), batch_size):
+            chunk = entries[start:start + batch_size]
+            yield self.gather(chunk), np.array([e["label"] for e in chunk], dtype=np.int32)
+
+    def to_tf_dataset(self, entries, batch_size=32, training=False, seed=123):
+        """Batched tf.data pipeline over shard entries, with the same augmentation as prepare_tf_datasets."""
+        num_classes = len(self.class_names)
+        order = np.arange(len(entries))
+        rng = np.random.default_rng(seed)
+
+        def generator():
+            if training:
+                rng.shuffle(order)
+            shuffled = [entries[i] for i in order]
+            for images, labels in self.iter_batches(shuffled, batch_size):
+                yield images, np.eye(num_classes, dtype=np.float32)[labels]
+
+        ds = tf.data.Dataset.from_generator(
+            generator,
+            output_signature=(
+                tf.TensorSpec(shape=(None,) + self.img_size + (3,), dtype=tf.uint8),
+                tf.TensorSpec(shape=(None, num_classes), dtype=tf.float32),
+            )
+        )
+        ds = ds.map(augment_batch if training else rescale_batch, num_parallel_calls=tf.data.AUTOTUNE)
+        return ds.prefetch(tf.data.AUTOTUNE)
+
+
+def prepare_shard_datasets(shard_dir, batch_size=32, validation_split=0.2, seed=123):
+    """
+    Training and validation datasets read from prebuilt shards.
+    Returns (train_ds, val_ds, class_names, num_train, num_val) like prepare_tf_datasets.
+    """
+    dataset = ShardedDataset(shard_dir)
+    train_entries, val_entries = dataset.split(validation_split)
+    print(f"Found {len(train_entries)} training and {len(val_entries)} validation images "
+          f"belonging to {len(dataset.class_names)} classes (shards in {shard_dir}).")
+    return (
+        dataset.to_tf_dataset(train_entries, batch_size, training=True, seed=seed),
+        dataset.to_tf_dataset(val_entries, batch_size),
+        dataset.class_names,
+        len(train_entries),
+        len(val_entries),
+    )
+
+
+if __name__ == "__main__":
+    """
+    Usage:
+      python build_dataset.py [data_dir] [shard_dir] [--img-size 224] [--shard-size 1024] [--compact]
+
+    Defaults:
+      - data_dir defaults to backend/ml/data/images
+      - shard_dir defaults to backend/ml/data/shards
+    """
+    this_dir = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Decode the image corpus once into memory-mapped uint8 shards.")
+    parser.add_argument("data_dir", nargs="?", default=os.path.join(this_dir, "data", "images"))
+    parser.add_argument("shard_dir", nargs="?", default=os.path.join(this_dir, "data", "shards"))
+    parser.add_argument("--img-size", type=int, default=224)
+    parser.add_argument("--shard-size", type=int, default=1024)
+    parser.add_argument("--compact", action="store_true", help="Rewrite all shards from scratch")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        print(f"❌ Data directory not found: {args.data_dir}")
+        sys.exit(1)
+
+    build_dataset(args.data_dir, args.shard_dir, img_size=(args.img_size, args.img_size),
+                  shard_size=args.shard_size, compact=args.compact)
+    print("🎉 Dataset build completed.")
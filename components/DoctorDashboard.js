@@ -301,7 +301,7 @@ const DoctorDashboard = () => {
               <input
                 id="image-upload"
                 type="file"
-                accept="image/*"
+                accept="image/*,.dcm,.dicom,application/dicom"
                 onChange={handleImageUpload}
                 style={{ display: 'none' }}
               />
@@ -605,7 +605,7 @@ const PatientDashboard = () => {
               <input
                 id="patient-image-upload"
                 type="file"
-                accept="image/*"
+                accept="image/*,.dcm,.dicom,application/dicom"
                 onChange={handleImageUpload}
                 style={{ display: 'none' }}
               />
@@ -5,6 +5,120 @@ from typing import Optional, List
 
 import tensorflow as tf
 
+# Batch sizes that get their own XLA-compiled serving signature (serve_b<N>).
+# The API pads each batch up to the nearest bucket so shapes never retrace.
+BATCH_BUCKETS = (1, 4, 8, 16, 32)
+
+
+def last_conv_layer(model):
+    """Last Conv2D/SeparableConv2D layer of the model, or None."""
+    for layer in reversed(model.layers):
+        if isinstance(layer, (tf.keras.layers.Conv2D, tf.keras.layers.SeparableConv2D)):
+            return layer
+    return None
+
+
+def gradcam_signature(model):
+    """
+    `explain` signature: Grad-CAM over the last conv layer for the top predicted class.
+    Returns {"heatmap": [N, h, w] scaled to [0, 1], "probabilities": [N, classes]},
+    or None if the model has no conv layer.
+    """
+    layer = last_conv_layer(model)
+    if layer is None:
+        return None
+    grad_model = tf.keras.Model(model.inputs, [layer.output, model.output])
+    input_shape = tuple(model.input_shape[1:])
+
+    @tf.function(input_signature=[tf.TensorSpec((None,) + input_shape, tf.float32, name="inputs")])
+    def explain(inputs):
+        with tf.GradientTape() as tape:
+            activations, probabilities = grad_model(inputs, training=False)
+            top = tf.argmax(probabilities, axis=-1)
+            score = tf.gather(probabilities, top, axis=1, batch_dims=1)
+        # Samples are independent, so one gradient call covers the whole batch
+        grads = tape.gradient(score, activations)
+        weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+        cam = tf.nn.relu(tf.reduce_sum(weights * activations, axis=-1))
+        cam = cam / (tf.reduce_max(cam, axis=(1, 2), keepdims=True) + 1e-8)
+        return {"heatmap": cam, "probabilities": probabilities}
+    return explain
+
+
+def penultimate_layer(model):
+    """Last layer before the classifier that is not Dropout (the Dense(128) of build_model), or None."""
+    for layer in reversed(model.layers[:-1]):
+        if not isinstance(layer, tf.keras.layers.Dropout):
+            return layer
+    return None
+
+
+def embedding_signature(model, batch_size=None, jit_compile=False):
+    """
+    `embed` signature: one forward pass returning {"embedding": L2-normalized penultimate
+    activations [N, d], "probabilities": [N, classes]}, or None for a single-layer model.
+    """
+    layer = penultimate_layer(model)
+    if layer is None:
+        return None
+    embed_model = tf.keras.Model(model.inputs, [layer.output, model.output])
+    input_shape = tuple(model.input_shape[1:])
+
+    @tf.function(
+        input_signature=[tf.TensorSpec((batch_size,) + input_shape, tf.float32, name="inputs")],
+        jit_compile=jit_compile
+    )
+    def embed(inputs):
+        embedding, probabilities = embed_model(inputs, training=False)
+        return {"embedding": tf.math.l2_normalize(embedding, axis=-1), "probabilities": probabilities}
+    return embed
+
+
+def serving_signatures(model, buckets=BATCH_BUCKETS) -> dict:
+    """
+    Build the default dynamic-batch `serve` signature plus one jit_compile=True
+    signature per fixed batch-size bucket, the Grad-CAM `explain` signature and the
+    `embed` / `embed_b<N>` signatures used for similar-case retrieval.
+    """
+    input_shape = tuple(model.input_shape[1:])
+
+    def make_fn(batch_size, jit_compile):
+        @tf.function(
+            input_signature=[tf.TensorSpec((batch_size,) + input_shape, tf.float32, name="inputs")],
+            jit_compile=jit_compile
+        )
+        def serve(inputs):
+            return {"output_0": model(inputs, training=False)}
+        return serve
+
+    default = make_fn(None, False)
+    signatures = {"serve": default, "serving_default": default}
+    for batch_size in buckets:
+        signatures[f"serve_b{batch_size}"] = make_fn(batch_size, True)
+    explain = gradcam_signature(model)
+    if explain is not None:
+        signatures["explain"] = explain
+    if penultimate_layer(model) is not None:
+        signatures["embed"] = embedding_signature(model)
+        for batch_size in buckets:
+            signatures[f"embed_b{batch_size}"] = embedding_signature(model, batch_size, True)
+    return signatures
+
+
+def export_serving_model(model, saved_model_dir: str, buckets=BATCH_BUCKETS) -> None:
+    """
+    Save model as a SavedModel with every serving signature (serve, serve_b<N>, explain,
+    embed). Every export (train_model.py, finetune.py, conversion) goes through here so a
+    deployed model never silently loses the fast paths. Keras metadata is kept where the
+    Keras version allows, so finetune.py can reload the model.
+    """
+    signatures = serving_signatures(model, buckets)
+    try:
+        model.save(saved_model_dir, save_format='tf', signatures=signatures)
+    except (TypeError, ValueError):
+        # Keras 3 model.save only writes .keras files
+        tf.saved_model.save(model, saved_model_dir, signatures=signatures)
+
 
 def find_h5_model() -> Optional[str]:
     """
@@ -47,21 +161,18 @@ def convert(h5_path: str, saved_model_dir: str, class_labels: Optional[List[str]
     print("✅ .h5 model loaded.")
 
     print(f"💾 Saving SavedModel to: {saved_model_dir}")
-    # SavedModel directory (TensorFlow format)
-    # Keras 3 requires model.export() for SavedModel format
+    # SavedModel directory (TensorFlow format) with a default `serve` signature,
+    # XLA-compiled `serve_b<N>` signatures for each batch bucket, Grad-CAM `explain` and `embed`
     try:
-        # Keras 3 way: use model.export() for SavedModel
-        model.export(saved_model_dir)
-    except AttributeError:
-        # Fallback for older Keras/TF versions
+        export_serving_model(model, saved_model_dir)
+    except Exception as e:
+        print(f"⚠️  Bucketed export failed ({e}), falling back to default signature only")
         try:
+            # Keras 3 way: use model.export() for SavedModel
+            model.export(saved_model_dir)
+        except AttributeError:
+            # Fallback for older Keras/TF versions
             tf.saved_model.save(model, saved_model_dir)
-        except Exception as e:
-            print(f"⚠️  tf.saved_model.save failed: {e}")
-            raise
-    except Exception as e:
-        print(f"⚠️  model.export() failed: {e}")
-        raise
     print("✅ SavedModel exported.")
 
     # If class labels not provided, use default known labels
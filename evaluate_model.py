@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+from sklearn.metrics import precision_recall_fscore_support, confusion_matrix
+
+from train_model import list_image_files
+from build_dataset import is_shard_dir, ShardedDataset, decode_files
+from utils.model_version import model_version
+
+
+def load_predict_fn(model_dir: str) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Load a SavedModel (or Keras model) the same way the API does and return a
+    function mapping a float32 batch to class probabilities.
+    """
+    try:
+        loaded = tf.saved_model.load(model_dir)
+        if hasattr(loaded, 'signatures') and 'serve' in loaded.signatures:
+            fn = loaded.signatures['serve']
+        elif hasattr(loaded, 'signatures') and 'serving_default' in loaded.signatures:
+            fn = loaded.signatures['serving_default']
+        else:
+            fn = loaded.serve
+
+        def predict(batch):
+            result = fn(tf.constant(batch, dtype=tf.float32))
+            if isinstance(result, dict):
+                result = list(result.values())[0]
+            return result.numpy()
+        return predict
+    except Exception:
+        model = tf.keras.models.load_model(model_dir)
+        return lambda batch: model.predict(batch, verbose=0)
+
+
+def load_test_set(test_dir: str, img_size=(224, 224)) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Decode the whole test set into one uint8 array (or read it from shards)."""
+    if is_shard_dir(test_dir):
+        dataset = ShardedDataset(test_dir)
+        images = dataset.gather(dataset.entries)
+        labels = np.array([e['label'] for e in dataset.entries], dtype=np.int32)
+        return images, labels, dataset.class_names
+
+    files, class_names = list_image_files(test_dir)
+    images = np.empty((len(files),) + tuple(img_size) + (3,), dtype=np.uint8)
+    for i, image in enumerate(decode_files([f[0] for f in files], img_size)):
+        images[i] = image
+    labels = np.array([f[1] for f in files], dtype=np.int32)
+    return images, labels, class_names
+
+
+def run_inference(predict: Callable, images: np.ndarray, num_classes: int,
+                  batch_size: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batched inference over the whole set into a preallocated probability matrix.
+    Returns (probabilities, per-image time in ms amortised over its batch). The
+    amortised time measures throughput, not the latency of a single request.
+    """
+    n = len(images)
+    probs = np.empty((n, num_classes), dtype=np.float32)
+    latency_ms = np.empty(n, dtype=np.float64)
+    # Warm up once so graph tracing is not counted as latency
+    predict(images[:1].astype(np.float32) / 255.0)
+    for start in range(0, n, batch_size):
+        end = min(start + batch_size, n)
+        batch = images[start:end].astype(np.float32) / 255.0
+        t0 = time.perf_counter()
+        probs[start:end] = predict(batch)
+        elapsed = (time.perf_counter() - t0) * 1000.0
+        latency_ms[start:end] = elapsed / (end - start)
+    return probs, latency_ms
+
+
+def measure_single_latency(predict: Callable, images: np.ndarray, samples: int = 200) -> np.ndarray:
+    """Latency in ms of batch=1 calls on up to `samples` images, as a single API request sees it."""
+    indices = np.linspace(0, len(images) - 1, min(samples, len(images))).astype(np.int64)
+    latency_ms = np.empty(len(indices), dtype=np.float64)
+    predict(images[:1].astype(np.float32) / 255.0)
+    for i, index in enumerate(indices):
+        image = images[index:index + 1].astype(np.float32) / 255.0
+        t0 = time.perf_counter()
+        predict(image)
+        latency_ms[i] = (time.perf_counter() - t0) * 1000.0
+    return latency_ms
+
+
+def latency_summary(latency_ms: np.ndarray) -> Dict:
+    return {
+        'mean': float(latency_ms.mean()),
+        'p50': float(np.percentile(latency_ms, 50)),
+        'p90': float(np.percentile(latency_ms, 90)),
+        'p95': float(np.percentile(latency_ms, 95)),
+        'p99': float(np.percentile(latency_ms, 99)),
+        'max': float(latency_ms.max()),
+    }
+
+
+def expected_calibration_error(probs: np.ndarray, labels: np.ndarray, n_bins: int = 15) -> float:
+    """Top-label ECE with equal-width confidence bins."""
+    confidences = probs.max(axis=1)
+    correct = (probs.argmax(axis=1) == labels).astype(np.float64)
+    bins = np.minimum((confidences * n_bins).astype(np.int64), n_bins - 1)
+    conf_sum = np.bincount(bins, weights=confidences, minlength=n_bins)
+    acc_sum = np.bincount(bins, weights=correct, minlength=n_bins)
+    return float(np.abs(acc_sum - conf_sum).sum() / max(len(labels), 1))
+
+
+def build_report(probs: np.ndarray, labels: np.ndarray, amortized_ms: np.ndarray, single_ms: np.ndarray,
+                 class_names: List[str], batch_size: int, threads: Optional[int]) -> Dict:
+    y_pred = probs.argmax(axis=1)
+    class_ids = list(range(len(class_names)))
+    precision, recall, f1, support = precision_recall_fscore_support(
+        labels, y_pred, labels=class_ids, zero_division=0
+    )
+    return {
+        'evaluated_at': datetime.now().isoformat(),
+        'num_images': int(len(labels)),
+        'batch_size': batch_size,
+        'threads': threads,
+        'accuracy': float((y_pred == labels).mean()) if len(labels) else 0.0,
+        'macro_f1': float(f1.mean()) if len(f1) else 0.0,
+        'expected_calibration_error': expected_calibration_error(probs, labels),
+        'per_class': {
+            name: {
+                'precision': float(precision[i]),
+                'recall': float(recall[i]),
+                'f1': float(f1[i]),
+                'support': int(support[i]),
+            }
+            for i, name in enumerate(class_names)
+        },
+        'confusion_matrix': {
+            'labels': class_names,
+            'matrix': confusion_matrix(labels, y_pred, labels=class_ids).tolist(),
+        },
+        # batch=1 calls: what one predict_image request waits for
+        'latency_ms_single_image': dict(latency_summary(single_ms), samples=int(len(single_ms))),
+        # Batch time divided by batch size: cost per image at batch_size, not a request latency
+        'amortized_ms_per_image': latency_summary(amortized_ms),
+        'throughput_images_per_sec': float(1000.0 / amortized_ms.mean()) if amortized_ms.mean() > 0 else 0.0,
+    }
+
+
+def evaluate(model_dir: str, test_dir: str, report_path: str, batch_size: int = 32,
+             threads: Optional[int] = None, version: Optional[str] = None, latency_samples: int = 200) -> Dict:
+    """
+    Evaluate model_dir on test_dir and merge the result into the JSON report at
+    report_path, keyed by model version.
+    """
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+
+    version = version or model_version(model_dir)
+    predict = load_predict_fn(model_dir)
+    images, labels, class_names = load_test_set(test_dir)
+    if len(images) == 0:
+        raise ValueError(f"No test images found in {test_dir}")
+
+    probs, amortized_ms = run_inference(predict, images, len(class_names), batch_size)
+    single_ms = measure_single_latency(predict, images, latency_samples)
+    report = build_report(probs, labels, amortized_ms, single_ms, class_names, batch_size, threads)
+    report['model_dir'] = os.path.abspath(model_dir)
+
+    reports = {}
+    if os.path.isfile(report_path):
+        with open(report_path, 'r', encoding='utf-8') as f:
+            reports = json.load(f)
+    reports[version] = report
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(reports, f, indent=2)
+
+    print(f"✅ Model {version}: accuracy={report['accuracy']:.4f} macro_f1={report['macro_f1']:.4f} "
+          f"ECE={report['expected_calibration_error']:.4f} "
+          f"single-image p50={report['latency_ms_single_image']['p50']:.2f}ms "
+          f"p99={report['latency_ms_single_image']['p99']:.2f}ms, "
+          f"{report['throughput_images_per_sec']:.1f} images/s at batch {batch_size}")
+    print(f"✅ Report written to: {report_path}")
+    return report
+
+
+if __name__ == '__main__':
+    """
+    Usage:
+      python evaluate_model.py [model_dir] [test_dir] [--report evaluation_report.json]
+                               [--batch-size 32] [--threads N] [--model-version V]
+                               [--latency-samples 200] [--min-accuracy 0.9] [--max-p99-ms 50]
+
+    Exits with status 2 when a --min-accuracy or --max-p99-ms gate fails; the latency
+    gate applies to single-image (batch=1) calls.
+    """
+    this_dir = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Batched evaluation with quality and latency report.")
+    parser.add_argument('model_dir', nargs='?', default=os.path.join(this_dir, 'model', 'image_model'))
+    parser.add_argument('test_dir', nargs='?', default=os.path.join(this_dir, 'data', 'images', 'test'))
+    parser.add_argument('--report', default=os.path.join(this_dir, 'model', 'evaluation_report.json'))
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--model-version', default=None)
+    parser.add_argument('--latency-samples', type=int, default=200, help="Images timed one at a time")
+    parser.add_argument('--min-accuracy', type=float, default=None)
+    parser.add_argument('--max-p99-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.model_dir) or not os.path.isdir(args.test_dir):
+        print(f"❌ Model or test directory not found: {args.model_dir}, {args.test_dir}")
+        sys.exit(1)
+
+    result = evaluate(args.model_dir, args.test_dir, args.report, batch_size=args.batch_size,
+                      threads=args.threads, version=args.model_version, latency_samples=args.latency_samples)
+
+    failures = []
+    if args.min_accuracy is not None and result['accuracy'] < args.min_accuracy:
+        failures.append(f"accuracy {result['accuracy']:.4f} < {args.min_accuracy}")
+    if args.max_p99_ms is not None and result['latency_ms_single_image']['p99'] > args.max_p99_ms:
+        failures.append(f"p99 single-image latency {result['latency_ms_single_image']['p99']:.2f}ms > {args.max_p99_ms}ms")
+    if failures:
+        print(f"❌ Gate failed: {'; '.join(failures)}")
+        sys.exit(2)
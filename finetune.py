@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+from train_model import list_image_files, augment_batch, rescale_batch, ThroughputLogger
+from convert_h5_to_savedmodel import export_serving_model
+
+load_dotenv()
+
+STATE_NAME = 'finetune_state.json'
+META_NAME = 'training_meta.json'
+# Reviewed images downloaded from GridFS
+IMAGE_CACHE_DIR = os.path.join(os.path.dirname(__file__), 'data', 'reviewed_images')
+
+
+def read_json(path: str, default=None):
+    if not os.path.isfile(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def resolve_image(db, image_ref: str, cache_dir: str) -> Optional[str]:
+    """
+    Local path of a stored upload. The API's content-addressed store keeps blobs under
+    IMAGE_STORE_DIR/<aa>/<bb>/<ref> (local backend) or in the `images` GridFS bucket,
+    in which case the blob is downloaded once into cache_dir.
+    """
+    store_dir = os.getenv('IMAGE_STORE_DIR', os.path.join(os.path.dirname(__file__), 'data', 'image_store'))
+    local_path = os.path.join(store_dir, image_ref[:2], image_ref[2:4], image_ref)
+    if os.path.isfile(local_path):
+        return local_path
+
+    cached_path = os.path.join(cache_dir, image_ref)
+    if os.path.isfile(cached_path):
+        return cached_path
+    import gridfs
+    try:
+        data = gridfs.GridFSBucket(db, bucket_name='images').open_download_stream_by_name(image_ref).read()
+    except gridfs.errors.NoFile:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cached_path, 'wb') as f:
+        f.write(data)
+    return cached_path
+
+
+def fetch_reviewed_examples(class_names: List[str], since: Optional[datetime],
+                            cache_dir: str = IMAGE_CACHE_DIR) -> Tuple[List[Tuple[str, int]], Optional[datetime]]:
+    """
+    (image_path, class_index) pairs for predictions a doctor confirmed or corrected
+    after `since`, plus the newest reviewed_at seen.
+    """
+    client = MongoClient(os.getenv('MONGO_URL', 'mongodb://localhost:27017/'))
+    db = client[os.getenv('DATABASE_NAME', 'amniotic_fluid_db')]
+    query = {'confirmed_class': {'$in': class_names}, 'image_ref': {'$exists': True}}
+    if since is not None:
+        query['reviewed_at'] = {'$gt': since}
+
+    examples = []
+    watermark = since
+    cursor = db.predictions.find(query, {'image_ref': 1, 'confirmed_class': 1, 'reviewed_at': 1})
+    for doc in cursor.sort('reviewed_at', 1):
+        image_path = resolve_image(db, doc['image_ref'], cache_dir)
+        if image_path is None:
+            continue
+        examples.append((image_path, class_names.index(doc['confirmed_class'])))
+        watermark = doc['reviewed_at']
+    client.close()
+    return examples, watermark
+
+
+def sample_replay(data_dir: str, class_names: List[str], size: int, seed: int = 123) -> List[Tuple[str, int]]:
+    """Random sample of the original training corpus, balanced across classes."""
+    if size <= 0 or not os.path.isdir(data_dir):
+        return []
+    files, dir_classes = list_image_files(data_dir)
+    by_class: Dict[int, List[str]] = {}
+    for path, idx in files:
+        name = dir_classes[idx]
+        if name in class_names:
+            by_class.setdefault(class_names.index(name), []).append(path)
+
+    rng = random.Random(seed)
+    per_class = max(1, size // max(len(by_class), 1))
+    replay = []
+    for idx, paths in by_class.items():
+        for path in rng.sample(paths, min(per_class, len(paths))):
+            replay.append((path, idx))
+    return replay
+
+
+def make_dataset(examples: List[Tuple[str, int]], num_classes: int, img_size=(224, 224),
+                 batch_size: int = 32, training: bool = True, seed: int = 123):
+    def load(path, label):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        image = tf.image.resize(image, img_size)
+        image = tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8)
+        return image, tf.one_hot(label, num_classes)
+
+    ds = tf.data.Dataset.from_tensor_slices(([e[0] for e in examples], [e[1] for e in examples]))
+    ds = ds.map(load, num_parallel_calls=tf.data.AUTOTUNE).cache()
+    if training:
+        ds = ds.shuffle(len(examples), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size).map(augment_batch if training else rescale_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+def split_holdout(examples: List[Tuple[str, int]], fraction: float,
+                  seed: int = 123) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+    """(train, holdout): a random `fraction` of the examples (at least one) kept out of training."""
+    shuffled = list(examples)
+    random.Random(seed).shuffle(shuffled)
+    size = max(1, int(round(len(shuffled) * fraction)))
+    return shuffled[size:], shuffled[:size]
+
+
+def finetune(model_dir: str, data_dir: str, output_dir: Optional[str] = None, checkpoint: Optional[str] = None,
+             replay_ratio: float = 1.0, epochs: int = 3, learning_rate: float = 1e-4,
+             batch_size: int = 32, min_examples: int = 16, img_size=(224, 224),
+             holdout: float = 0.2, max_accuracy_drop: float = 0.02) -> Optional[Dict]:
+    """
+    Resume from the current SavedModel (or a checkpoint) and train only on predictions
+    reviewed since the last run, mixed with a replay sample of the original corpus.
+    A held-out share of the new examples is used for validation only; the fine-tuned
+    model is saved only if its held-out accuracy is within max_accuracy_drop of the
+    starting model's. Held-out examples of an accepted run are kept with the watermark
+    and trained on in the next run, since the watermark has moved past them. The state
+    is kept in model_dir whatever output_dir is.
+    """
+    output_dir = output_dir or model_dir
+    class_names = read_json(os.path.join(model_dir, 'labels.json'))
+    if not class_names:
+        raise FileNotFoundError(f"labels.json not found in {model_dir}")
+
+    state_path = os.path.join(model_dir, STATE_NAME)
+    state = read_json(state_path, {})
+    since = datetime.fromisoformat(state['watermark']) if state.get('watermark') else None
+
+    new_examples, watermark = fetch_reviewed_examples(class_names, since)
+    print(f"🔄 {len(new_examples)} newly reviewed examples since {since or 'the beginning'}")
+    if len(new_examples) < min_examples:
+        print(f"⚠️  Fewer than {min_examples} new examples, skipping fine-tuning")
+        return None
+
+    train_examples, holdout_examples = split_holdout(new_examples, holdout)
+    # Last accepted run's held-out examples, past the watermark and never trained on
+    carried = [(path, label) for path, label in state.get('pending_holdout', []) if os.path.isfile(path)]
+    replay = sample_replay(data_dir, class_names, int((len(train_examples) + len(carried)) * replay_ratio))
+    examples = train_examples + carried + replay
+    print(f"🔄 Fine-tuning on {len(train_examples)} new + {len(carried)} previously held-out + "
+          f"{len(replay)} replay examples, validating on {len(holdout_examples)} held-out new examples")
+
+    model = tf.keras.models.load_model(checkpoint or model_dir)
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    holdout_data = make_dataset(holdout_examples, len(class_names), img_size, batch_size, training=False)
+    before = model.evaluate(holdout_data, return_dict=True, verbose=0)
+
+    start = time.perf_counter()
+    history = model.fit(
+        make_dataset(examples, len(class_names), img_size, batch_size),
+        validation_data=holdout_data,
+        epochs=epochs,
+        callbacks=[ThroughputLogger(len(examples), 'finetune')]
+    )
+    fit_seconds = time.perf_counter() - start
+    after = model.evaluate(holdout_data, return_dict=True, verbose=0)
+    accepted = after['accuracy'] >= before['accuracy'] - max_accuracy_drop
+    print(f"📊 Held-out accuracy {before['accuracy']:.4f} -> {after['accuracy']:.4f}")
+
+    if accepted:
+        os.makedirs(output_dir, exist_ok=True)
+        export_serving_model(model, output_dir)
+        with open(os.path.join(output_dir, 'labels.json'), 'w') as f:
+            json.dump(class_names, f)
+        print(f"✅ Fine-tuned model saved to: {output_dir}")
+    else:
+        print(f"❌ Held-out accuracy dropped by more than {max_accuracy_drop}; keeping the current model. "
+              f"These examples will be included again in the next run.")
+
+    # Estimate what a full retrain would have cost from the last full run, scaled by corpus size
+    report = {
+        'mode': 'incremental',
+        'accepted': accepted,
+        'new_examples': len(train_examples),
+        'holdout_examples': len(holdout_examples),
+        'carried_holdout_examples': len(carried),
+        'replay_examples': len(replay),
+        'epochs_run': len(history.history.get('loss', [])),
+        'holdout_accuracy_before': float(before['accuracy']),
+        'holdout_accuracy': float(after['accuracy']),
+        'holdout_loss': float(after['loss']),
+        'fit_seconds': fit_seconds,
+        'finished_at': datetime.now().isoformat(),
+    }
+    meta = read_json(os.path.join(model_dir, META_NAME))
+    if meta and meta.get('mode') == 'full' and meta.get('num_train'):
+        corpus_size = len(list_image_files(data_dir)[0]) if os.path.isdir(data_dir) else meta['num_train']
+        full_estimate = meta['fit_seconds'] * (corpus_size + len(new_examples)) / meta['num_train']
+        report['full_retrain_estimate_seconds'] = full_estimate
+        report['seconds_saved'] = full_estimate - fit_seconds
+        print(f"⏱️  Fine-tuning took {fit_seconds:.1f}s vs ~{full_estimate:.1f}s for a full retrain "
+              f"({full_estimate - fit_seconds:.1f}s saved)")
+    else:
+        print(f"⏱️  Fine-tuning took {fit_seconds:.1f}s (no full training record to compare against)")
+
+    # A rejected run leaves the watermark (and the pending held-out examples) where it was
+    if accepted:
+        state['watermark'] = watermark.isoformat() if watermark else None
+        state['pending_holdout'] = [[path, label] for path, label in holdout_examples]
+    state['runs'] = state.get('runs', []) + [report]
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    if accepted and meta is not None and output_dir != model_dir:
+        with open(os.path.join(output_dir, META_NAME), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    """
+    Usage:
+      python finetune.py [--model-dir model/image_model] [--data-dir data/images]
+                         [--output-dir DIR] [--checkpoint PATH] [--replay-ratio 1.0]
+                         [--epochs 3] [--learning-rate 1e-4] [--holdout 0.2]
+                         [--max-accuracy-drop 0.02]
+
+    Reviewed predictions are those with `confirmed_class` set via
+    PUT /api/history/predictions/{id}/review and a stored `image_ref`.
+    """
+    this_dir = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Incrementally fine-tune the model on doctor-reviewed predictions.")
+    parser.add_argument('--model-dir', default=os.path.join(this_dir, 'model', 'image_model'))
+    parser.add_argument('--data-dir', default=os.path.join(this_dir, 'data', 'images'))
+    parser.add_argument('--output-dir', default=None)
+    parser.add_argument('--checkpoint', default=None)
+    parser.add_argument('--replay-ratio', type=float, default=1.0)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--min-examples', type=int, default=16)
+    parser.add_argument('--holdout', type=float, default=0.2, help="Share of new examples used only for validation")
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.02,
+                        help="Keep the current model if held-out accuracy falls by more than this")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.model_dir):
+        print(f"❌ Model directory not found: {args.model_dir}. Train the model first.")
+        sys.exit(1)
+
+    finetune(args.model_dir, args.data_dir, output_dir=args.output_dir, checkpoint=args.checkpoint,
+             replay_ratio=args.replay_ratio, epochs=args.epochs, learning_rate=args.learning_rate,
+             min_examples=args.min_examples, holdout=args.holdout, max_accuracy_drop=args.max_accuracy_drop)
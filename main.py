@@ -1,9 +1,30 @@
+import asyncio
+import os
+from importlib import import_module
 from fastapi import FastAPI # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
+from fastapi.responses import PlainTextResponse # type: ignore
 from contextlib import asynccontextmanager
-from app.routers import auth, prediction, history, patients
-from app.utils.database import connect_to_mongo, close_mongo_connection
-from app.routers import chat
+from app.utils.archive import ARCHIVE_INTERVAL_HOURS, run_scheduled as run_scheduled_archival
+from app.utils.database import connect_to_mongo, close_mongo_connection, get_database
+from app.utils.metrics import TimingMiddleware, render_prometheus
+from app.utils.profiling import ProfilingMiddleware
+from app.utils.uploads import MAX_JOB_UPLOAD_BYTES, UploadLimitMiddleware
+from app.utils.serialization import FastJSONResponse
+
+# Router module -> URL prefix. Routers are imported only when enabled, so e.g. a
+# chat-only deployment (ENABLED_ROUTERS=chat) never loads the prediction stack.
+ROUTERS = {
+    "auth": "/api",
+    "prediction": "/api",
+    "history": "/api",
+    "patients": "/api",
+    "chat": "",
+    "admin": "/api",
+}
+ENABLED_ROUTERS = [
+    name.strip() for name in os.getenv("ENABLED_ROUTERS", ",".join(ROUTERS)).split(",") if name.strip()
+]
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -11,24 +32,57 @@ async def lifespan(app: FastAPI):
         await connect_to_mongo()
     except Exception as e:
         print(f"⚠️  Starting without database: {e}")
+    if "patients" in ENABLED_ROUTERS:
+        await import_module("app.routers.patients").ensure_indexes()
+    archive_task = None
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        # Retention: chat TTL index and archival of old predictions (enable on one node only)
+        archive_task = asyncio.create_task(run_scheduled_archival(get_database))
+    if "prediction" in ENABLED_ROUTERS:
+        # Background workers for /api/prediction/jobs (JOB_WORKERS=0 for submit-only nodes)
+        await import_module("app.routers.prediction").start_job_workers()
+    if "history" in ENABLED_ROUTERS:
+        # Load the similar-case index and index predictions written since it was saved
+        await import_module("app.routers.history").start_similarity_index()
     yield
+    if archive_task is not None:
+        archive_task.cancel()
+    if "prediction" in ENABLED_ROUTERS:
+        await import_module("app.routers.prediction").stop_job_workers()
+    if "history" in ENABLED_ROUTERS:
+        await import_module("app.routers.history").stop_similarity_index()
     await close_mongo_connection()
 
-app = FastAPI(title="Amniotic Fluid Analysis API", lifespan=lifespan)
+app = FastAPI(
+    title="Amniotic Fluid Analysis API",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
+)
 
+# Innermost, so 413 responses still carry CORS headers
+app.add_middleware(
+    UploadLimitMiddleware,
+    path_limits={"/api/prediction/jobs": MAX_JOB_UPLOAD_BYTES}
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:3001", "http://localhost:3002"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Opt-in profiling, enabled at runtime via /api/admin/profiling
+app.add_middleware(ProfilingMiddleware)
+# Outermost so request timing covers CORS and every router
+app.add_middleware(TimingMiddleware)
 
-app.include_router(auth.router, prefix="/api")
-app.include_router(prediction.router, prefix="/api")
-app.include_router(history.router, prefix="/api")
-app.include_router(patients.router, prefix="/api")
-app.include_router(chat.router)
+for router_name in ENABLED_ROUTERS:
+    if router_name not in ROUTERS:
+        raise RuntimeError(f"Unknown router in ENABLED_ROUTERS: {router_name}. Choose from {list(ROUTERS)}")
+    # __import__ rather than import_module so `-X importtime` (utils/startup_report.py) sees router imports
+    module = __import__(f"app.routers.{router_name}", fromlist=["router"])
+    app.include_router(module.router, prefix=ROUTERS[router_name])
 
 @app.get("/")
 async def root():
@@ -39,7 +93,11 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "Amniotic Fluid Analysis API",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "routers": ENABLED_ROUTERS
     }
 
-
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Request and per-stage latency histograms in Prometheus text format"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
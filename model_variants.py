@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from train_model import train_model, ARCHITECTURES
+from evaluate_model import load_predict_fn
+
+DEFAULT_VARIANTS = [
+    ('flatten', 1.0),
+    ('gap', 1.0),
+    ('gap', 0.5),
+    ('separable', 1.0),
+    ('separable', 0.5),
+]
+LATENCY_BATCH_SIZES = (1, 16)
+
+
+def variant_name(architecture: str, width_multiplier: float) -> str:
+    return f"{architecture}_w{width_multiplier:g}"
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        if 'checkpoints' in os.path.relpath(root, path).split(os.sep):
+            continue
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+    return total
+
+
+def measure_latency(model_dir: str, img_size=(224, 224), batch_sizes=LATENCY_BATCH_SIZES,
+                    runs: int = 30) -> Dict[str, Dict[str, float]]:
+    """CPU latency of the exported model at each batch size, in ms per call."""
+    predict = load_predict_fn(model_dir)
+    results = {}
+    for batch_size in batch_sizes:
+        batch = np.random.rand(batch_size, *img_size, 3).astype(np.float32)
+        predict(batch)  # warm up / trace
+        timings = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            predict(batch)
+            timings.append((time.perf_counter() - t0) * 1000.0)
+        results[str(batch_size)] = {
+            'p50_ms': float(np.percentile(timings, 50)),
+            'p90_ms': float(np.percentile(timings, 90)),
+        }
+    return results
+
+
+def train_variants(train_dir: str, output_dir: str, variants: List[tuple], epochs: int = 25,
+                   pipeline: str = 'generator', img_size=(224, 224)) -> Dict:
+    """
+    Train each (architecture, width_multiplier) variant into output_dir/<name>/ and
+    record parameter count, model size, validation accuracy and CPU latency in
+    output_dir/variants.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index_path = os.path.join(output_dir, 'variants.json')
+    index = {}
+    if os.path.isfile(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+
+    for architecture, width_multiplier in variants:
+        name = variant_name(architecture, width_multiplier)
+        model_dir = os.path.join(output_dir, name)
+        print(f"🔄 Training variant {name}")
+        model, _, history = train_model(
+            train_dir, model_dir=model_dir, img_size=img_size, epochs=epochs, pipeline=pipeline,
+            architecture=architecture, width_multiplier=width_multiplier
+        )
+        val_accuracy = history.history.get('val_accuracy') or [0.0]
+        index[name] = {
+            'architecture': architecture,
+            'width_multiplier': width_multiplier,
+            'model_dir': os.path.abspath(model_dir),
+            'params': int(model.count_params()),
+            'size_bytes': directory_size(model_dir),
+            'val_accuracy': float(max(val_accuracy)),
+            'latency': measure_latency(model_dir, img_size),
+        }
+        print(f"✅ {name}: params={index[name]['params']:,} size={index[name]['size_bytes'] / 1e6:.1f}MB "
+              f"val_accuracy={index[name]['val_accuracy']:.4f} "
+              f"latency(b1)={index[name]['latency']['1']['p50_ms']:.2f}ms")
+
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2)
+    return index
+
+
+def select_variant(index: Dict, budget_ms: float, batch_size: int = 1) -> Optional[str]:
+    """Most accurate variant whose p50 latency at batch_size fits budget_ms (smallest model on ties)."""
+    candidates = [
+        (info['val_accuracy'], -info['size_bytes'], name)
+        for name, info in index.items()
+        if info['latency'].get(str(batch_size), {}).get('p50_ms', float('inf')) <= budget_ms
+    ]
+    if not candidates:
+        return None
+    return max(candidates)[2]
+
+
+def parse_variant(spec: str) -> tuple:
+    """'gap:0.5' -> ('gap', 0.5)"""
+    architecture, _, width = spec.partition(':')
+    if architecture not in ARCHITECTURES:
+        raise argparse.ArgumentTypeError(f"Unknown architecture {architecture}")
+    return architecture, float(width or 1.0)
+
+
+if __name__ == '__main__':
+    """
+    Usage:
+      python model_variants.py train [--variants gap:1.0 separable:0.5 ...] [--epochs 25]
+      python model_variants.py select --budget-ms 15 [--batch-size 1] [--install]
+
+    `select --install` copies the chosen variant to model/image_model for the API.
+    """
+    this_dir = os.path.dirname(__file__)
+    default_output = os.path.join(this_dir, 'model', 'variants')
+
+    parser = argparse.ArgumentParser(description="Train and select latency-budgeted model variants.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = sub.add_parser('train')
+    train_parser.add_argument('--data-dir', default=os.path.join(this_dir, 'data', 'images'))
+    train_parser.add_argument('--output-dir', default=default_output)
+    train_parser.add_argument('--variants', nargs='+', type=parse_variant, default=DEFAULT_VARIANTS)
+    train_parser.add_argument('--epochs', type=int, default=25)
+    train_parser.add_argument('--pipeline', default=os.getenv('TRAIN_PIPELINE', 'generator'))
+
+    select_parser = sub.add_parser('select')
+    select_parser.add_argument('--output-dir', default=default_output)
+    select_parser.add_argument('--budget-ms', type=float, required=True)
+    select_parser.add_argument('--batch-size', type=int, choices=LATENCY_BATCH_SIZES, default=1)
+    select_parser.add_argument('--install', action='store_true')
+
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        train_variants(args.data_dir, args.output_dir, args.variants, epochs=args.epochs, pipeline=args.pipeline)
+        print("🎉 Variant training completed.")
+        sys.exit(0)
+
+    index_path = os.path.join(args.output_dir, 'variants.json')
+    if not os.path.isfile(index_path):
+        print(f"❌ No variants.json in {args.output_dir}. Run `python model_variants.py train` first.")
+        sys.exit(1)
+    with open(index_path, 'r', encoding='utf-8') as f:
+        variants_index = json.load(f)
+
+    chosen = select_variant(variants_index, args.budget_ms, args.batch_size)
+    if chosen is None:
+        print(f"❌ No variant fits a {args.budget_ms}ms budget at batch size {args.batch_size}")
+        sys.exit(2)
+
+    info = variants_index[chosen]
+    print(f"✅ Selected {chosen}: val_accuracy={info['val_accuracy']:.4f} "
+          f"p50={info['latency'][str(args.batch_size)]['p50_ms']:.2f}ms params={info['params']:,}")
+    if args.install:
+        target = os.path.join(this_dir, 'model', 'image_model')
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        shutil.copytree(info['model_dir'], target, ignore=shutil.ignore_patterns('checkpoints'))
+        print(f"✅ Installed {chosen} to: {target}")
@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+class PatientRecord(BaseModel):
+    id: str
+    name: str
+    email: str
+    last_analysis: datetime
+    total_analyses: int
+    latest_result: str
+
+
+class PatientSearchResult(BaseModel):
+    id: str
+    name: str
+    email: str
+
+class PatientSearchPage(BaseModel):
+    results: List[PatientSearchResult]
+    next_cursor: Optional[str] = None
@@ -17,6 +17,7 @@ class PredictionResponse(BaseModel):
     created_at: datetime
     
 class PredictionHistory(BaseModel):
+    """Prediction as returned to clients. Build from Mongo documents with from_mongo."""
     id: str
     class_prediction: str
     confidence: float
@@ -25,4 +26,26 @@ class PredictionHistory(BaseModel):
     doctor_id: str
     image_filename: str
     created_at: datetime
-    notes: Optional[str] = None
\ No newline at end of file
+    notes: Optional[str] = None
+    confirmed_class: Optional[str] = None
+    reviewed_at: Optional[datetime] = None
+    image_ref: Optional[str] = None
+    # Set for DICOM scans
+    study_uid: Optional[str] = None
+    gestational_age_days: Optional[int] = None
+
+    @classmethod
+    def from_mongo(cls, doc: dict) -> "PredictionHistory":
+        """Build from a projected document without re-validating trusted DB data."""
+        doc["id"] = str(doc.pop("_id"))
+        return cls.model_construct(**doc)
+
+class PredictionReview(BaseModel):
+    confirmed_class: str
+    notes: Optional[str] = None
+
+
+class SimilarCase(BaseModel):
+    """A past prediction whose scan resembles the query scan (cosine similarity of CNN embeddings)."""
+    prediction: PredictionHistory
+    similarity: float
@@ -0,0 +1,67 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from app.utils.auth import get_admin_user
+from app.models.user import UserInDB
+from app.utils import profiling
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+class ProfilingSettings(BaseModel):
+    enabled: bool
+    mode: str = "cprofile"
+    sample_rate: float = Field(0.0, ge=0.0, le=1.0)
+    routes: List[str] = ["/api/prediction/predict_image"]
+    # X-Profile: 1 is honoured only when allowed here, and only on admins' requests
+    allow_header: bool = False
+    sampling_interval: float = Field(0.005, gt=0.0, le=1.0)
+    capacity: Optional[int] = Field(None, ge=1, le=500)
+
+@router.get("/profiling")
+async def get_profiling(current_user: UserInDB = Depends(get_admin_user)):
+    """Current profiling settings and the profiles held in the ring"""
+    return {
+        "config": profiling.config.as_dict(),
+        "profiles": [
+            {k: v for k, v in entry.items() if k != "data"} for entry in profiling.profiles
+        ]
+    }
+
+@router.put("/profiling")
+async def update_profiling(settings: ProfilingSettings, current_user: UserInDB = Depends(get_admin_user)):
+    """Enable, disable or reconfigure request profiling at runtime"""
+    if settings.mode not in profiling.MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {profiling.MODES}")
+    if settings.capacity is not None:
+        profiling.set_capacity(settings.capacity)
+    config = profiling.config
+    config.mode = settings.mode
+    config.sample_rate = settings.sample_rate
+    config.routes = settings.routes
+    config.allow_header = settings.allow_header
+    config.sampling_interval = settings.sampling_interval
+    # Flip enabled last so the middleware never sees a half-updated config
+    config.enabled = settings.enabled
+    return config.as_dict()
+
+@router.delete("/profiling/profiles")
+async def clear_profiles(current_user: UserInDB = Depends(get_admin_user)):
+    profiling.profiles.clear()
+    return {"cleared": True}
+
+@router.get("/profiling/profiles/{profile_id}")
+async def download_profile(profile_id: str, current_user: UserInDB = Depends(get_admin_user)):
+    """Download a profile: .pstats for cProfile mode, collapsed stacks (.folded) for sampling mode"""
+    entry = profiling.get_profile(profile_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if entry["mode"] == "cprofile":
+        filename, media_type = f"{profile_id}.pstats", "application/octet-stream"
+    else:
+        filename, media_type = f"{profile_id}.folded", "text/plain"
+    return Response(
+        content=entry["data"],
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -10,6 +10,7 @@ from app.utils.auth import (
 )
 from app.models.user import UserCreate, User, Token, UserInDB
 from app.utils.database import get_database
+from app.utils.search import search_terms
 from bson import ObjectId
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
@@ -35,6 +36,7 @@ async def register(user_data: UserCreate):
     user_dict.pop("password")
     user_dict["hashed_password"] = hashed_password
     user_dict["created_at"] = datetime.now()
+    user_dict["search_terms"] = search_terms(user_dict["full_name"], user_dict["email"])
     
     result = await db.users.insert_one(user_dict)
     user_dict["id"] = str(result.inserted_id)
@@ -1,8 +1,8 @@
+from datetime import datetime
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel
-from motor.motor_asyncio import AsyncIOMotorDatabase
 from app.utils.database import get_database
-from langdetect import detect
+from app.utils.metrics import timed_stage
 
 # 🚨 Disable transformer-based model (too heavy for your laptop)
 # Instead use Rule-based + lightweight fallback
@@ -144,13 +144,16 @@ def rule_based_reply(text: str) -> str:
 # -------------------------
 @router.post("/", response_model=ChatResponse)
 async def chat_endpoint(
-    payload: ChatRequest, db: AsyncIOMotorDatabase = Depends(get_database)
+    payload: ChatRequest, db=Depends(get_database)
 ):
     user_msg = payload.message.strip()
 
     # Language detection
     try:
-        lang = detect(user_msg)
+        with timed_stage("lang_detect"):
+            # Imported here so chat-less deployments and cold starts skip langdetect
+            from langdetect import detect
+            lang = detect(user_msg)
     except:
         lang = "en"
 
@@ -158,16 +161,19 @@ async def chat_endpoint(
     detected_lang = lang_map.get(lang, "en-IN")
 
     # Save user message in DB
-    await db["chat_history"].insert_one(
-        {"sender": "user", "text": user_msg, "session": payload.session_id}
-    )
+    with timed_stage("db_insert_user"):
+        await db["chat_history"].insert_one(
+            {"sender": "user", "text": user_msg, "session": payload.session_id, "created_at": datetime.now()}
+        )
 
     # Generate reply using rule-based logic
-    reply = rule_based_reply(user_msg)
+    with timed_stage("reply"):
+        reply = rule_based_reply(user_msg)
 
     # Save bot reply
-    await db["chat_history"].insert_one(
-        {"sender": "bot", "text": reply, "session": payload.session_id}
-    )
+    with timed_stage("db_insert_bot"):
+        await db["chat_history"].insert_one(
+            {"sender": "bot", "text": reply, "session": payload.session_id, "created_at": datetime.now()}
+        )
 
     return ChatResponse(reply=reply, lang=detected_lang)
\ No newline at end of file
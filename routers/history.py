@@ -1,36 +1,90 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import List, Optional
 from app.utils.auth import get_current_user
 from app.models.user import UserInDB
-from app.models.prediction import PredictionHistory
+from app.models.prediction import PredictionHistory, PredictionReview, SimilarCase
+from app.utils.archive import find_archived, hot_cutoff, query_archive
 from app.utils.database import get_database
+from app.utils.conditional import bump_versions, cached_listing
+from app.utils.image_store import (
+    DEFAULT_THUMBNAIL_SIZE, THUMBNAIL_SIZES, ensure_thumbnail, get_image_store, parse_range
+)
+from app.utils.metrics import timed_stage
+from app.utils.serialization import FastJSONResponse, projection
+from app.utils.similarity import decode_embedding, ensure_similarity_indexes, similarity_index
 from bson import ObjectId
+from datetime import datetime
+import asyncio
+import json
+import os
 
 router = APIRouter(prefix="/history", tags=["History"])
 
+# Background load and catch-up of the similar-case index at startup
+_similarity_warmup: Optional[asyncio.Task] = None
+
+async def _find_prediction(db, prediction_id: str, fields: dict, current_user: UserInDB) -> Optional[dict]:
+    """Prediction from the hot collection, falling back to the user's part of the cold archive."""
+    with timed_stage("db_query"):
+        prediction = await db.predictions.find_one({"_id": ObjectId(prediction_id)}, fields)
+    if prediction is None:
+        owner = {"doctor_id": current_user.id} if current_user.role == "doctor" else {"patient_id": current_user.id}
+        with timed_stage("archive_query"):
+            archived = await asyncio.to_thread(find_archived, prediction_id, full=True, **owner)
+        if archived is not None:
+            archived["_id"] = ObjectId(archived.pop("id"))
+            prediction = archived
+    return prediction
+
 @router.get("/predictions", response_model=List[PredictionHistory])
-async def get_prediction_history(current_user: UserInDB = Depends(get_current_user)):
-    """Get prediction history for current user"""
+async def get_prediction_history(
+    request: Request,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """
+    Get prediction history for current user, optionally limited to [start, end).
+    Predictions older than the hot window are read from the archive when start reaches back that far.
+    """
     db = get_database()
     if db is None:
         raise HTTPException(status_code=503, detail="Database connection unavailable")
     
     if current_user.role == "doctor":
         # Doctors see their own predictions
-        cursor = db.predictions.find({"doctor_id": current_user.id}).sort("created_at", -1)
+        query = {"doctor_id": current_user.id}
+        owner = {"doctor_id": current_user.id}
     else:
         # Patients see predictions made for them
-        cursor = db.predictions.find({"patient_id": current_user.id}).sort("created_at", -1)
-    
-    predictions = []
-    async for prediction in cursor:
-        prediction["id"] = str(prediction["_id"])
-        prediction.pop("_id", None)
-        predictions.append(prediction)
+        query = {"patient_id": current_user.id}
+        owner = {"patient_id": current_user.id}
+    if start is not None or end is not None:
+        query["created_at"] = {
+            **({"$gte": start} if start is not None else {}),
+            **({"$lt": end} if end is not None else {}),
+        }
+    cutoff = hot_cutoff()
+
+    async def build():
+        cursor = db.predictions.find(query, projection(PredictionHistory)).sort("created_at", -1)
+        with timed_stage("db_query"):
+            predictions = [PredictionHistory.from_mongo(prediction) async for prediction in cursor]
+        if start is None or cutoff is None or start >= cutoff:
+            return predictions
+        with timed_stage("archive_query"):
+            archived = await asyncio.to_thread(query_archive, start, end, **owner)
+        # A prediction can be in both tiers briefly while an archival run is deleting it
+        hot_ids = {p.id for p in predictions}
+        predictions.extend(PredictionHistory.model_construct(**row) for row in archived if row["id"] not in hot_ids)
+        predictions.sort(key=lambda p: p.created_at, reverse=True)
+        return predictions
     
-    return predictions
+    # 304 / cached body while no prediction was written for this user
+    listing = "history" if start is None and end is None else f"history:{start}:{end}"
+    return await cached_listing(request, db, listing, current_user.id, build)
 
-@router.get("/predictions/{prediction_id}")
+@router.get("/predictions/{prediction_id}", response_model=PredictionHistory)
 async def get_prediction_details(prediction_id: str, current_user: UserInDB = Depends(get_current_user)):
     """Get specific prediction details"""
     db = get_database()
@@ -38,7 +92,7 @@ async def get_prediction_details(prediction_id: str, current_user: UserInDB = De
         raise HTTPException(status_code=503, detail="Database connection unavailable")
     
     try:
-        prediction = await db.predictions.find_one({"_id": ObjectId(prediction_id)})
+        prediction = await _find_prediction(db, prediction_id, projection(PredictionHistory), current_user)
         if not prediction:
             raise HTTPException(status_code=404, detail="Prediction not found")
         
@@ -48,9 +102,221 @@ async def get_prediction_details(prediction_id: str, current_user: UserInDB = De
         elif current_user.role == "patient" and prediction.get("patient_id") != current_user.id:
             raise HTTPException(status_code=403, detail="Access denied")
         
-        prediction["id"] = str(prediction["_id"])
-        prediction.pop("_id", None)
-        return prediction
+        return FastJSONResponse(PredictionHistory.from_mongo(prediction))
         
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.put("/predictions/{prediction_id}/review")
+async def review_prediction(prediction_id: str, review: PredictionReview, current_user: UserInDB = Depends(get_current_user)):
+    """Confirm or correct the predicted class. Reviewed predictions feed incremental fine-tuning."""
+    if current_user.role != "doctor":
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    db = get_database()
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
+
+    if not ObjectId.is_valid(prediction_id):
+        raise HTTPException(status_code=400, detail="Invalid prediction id")
+
+    from app.routers.prediction import labels_path
+    if os.path.isfile(labels_path):
+        with open(labels_path, 'r') as f:
+            class_names = json.load(f)
+        if review.confirmed_class not in class_names:
+            raise HTTPException(status_code=400, detail=f"Unknown class. Expected one of {class_names}")
+
+    prediction = await db.predictions.find_one(
+        {"_id": ObjectId(prediction_id)}, {"doctor_id": 1, "patient_id": 1, "class_prediction": 1}
+    )
+    if not prediction:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+    if prediction["doctor_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    update = {
+        "confirmed_class": review.confirmed_class,
+        "corrected": review.confirmed_class != prediction.get("class_prediction"),
+        "reviewed_by": current_user.id,
+        "reviewed_at": datetime.now()
+    }
+    if review.notes is not None:
+        update["notes"] = review.notes
+    await db.predictions.update_one({"_id": ObjectId(prediction_id)}, {"$set": update})
+    await bump_versions(db, prediction["doctor_id"], prediction.get("patient_id"))
+
+    return {"id": prediction_id, **update}
+
+async def _accessible_image_ref(prediction_id: str, current_user: UserInDB) -> str:
+    """image_ref of a prediction the current user may view."""
+    db = get_database()
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
+    if not ObjectId.is_valid(prediction_id):
+        raise HTTPException(status_code=400, detail="Invalid prediction id")
+
+    prediction = await _find_prediction(db, prediction_id, {"doctor_id": 1, "patient_id": 1, "image_ref": 1}, current_user)
+    if not prediction:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+    if current_user.role == "doctor" and prediction["doctor_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    elif current_user.role == "patient" and prediction.get("patient_id") != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not prediction.get("image_ref"):
+        raise HTTPException(status_code=404, detail="No image stored for this prediction")
+    return prediction["image_ref"]
+
+async def _blob_response(request: Request, key: str, media_type: str) -> Response:
+    """
+    Serve a stored blob. Keys are content hashes, so the key doubles as a strong
+    ETag and the response is immutable; Range requests return 206 partial content.
+    """
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    store = get_image_store()
+    with timed_stage("image_store"):
+        size = await store.size(key)
+        if size is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is None:
+            return Response(await store.read(key), media_type=media_type, headers=headers)
+        start, end = byte_range
+        body = await store.read(key, start, end)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(body, status_code=206, media_type=media_type, headers=headers)
+
+@router.get("/predictions/{prediction_id}/image")
+async def get_prediction_image(prediction_id: str, request: Request, current_user: UserInDB = Depends(get_current_user)):
+    """Original uploaded scan"""
+    image_ref = await _accessible_image_ref(prediction_id, current_user)
+    return await _blob_response(request, image_ref, "application/octet-stream")
+
+@router.get("/predictions/{prediction_id}/thumbnail")
+async def get_prediction_thumbnail(
+    prediction_id: str,
+    request: Request,
+    size: int = DEFAULT_THUMBNAIL_SIZE,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """JPEG thumbnail of the uploaded scan, generated on first request"""
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {list(THUMBNAIL_SIZES)}")
+    image_ref = await _accessible_image_ref(prediction_id, current_user)
+    try:
+        with timed_stage("thumbnail"):
+            key = await ensure_thumbnail(image_ref, size)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return await _blob_response(request, key, "image/jpeg")
+
+@router.get("/predictions/{prediction_id}/explanation")
+async def get_prediction_explanation(prediction_id: str, request: Request, current_user: UserInDB = Depends(get_current_user)):
+    """
+    Grad-CAM heatmap for the predicted class as a transparent PNG at model input
+    resolution, to be scaled over the scan. Computed on first view, then cached.
+    """
+    image_ref = await _accessible_image_ref(prediction_id, current_user)
+    from app.routers.prediction import explanation_key
+    try:
+        key = await explanation_key(image_ref)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return await _blob_response(request, key, "image/png")
+
+@router.get("/similar/{prediction_id}", response_model=List[SimilarCase])
+async def get_similar_cases(
+    prediction_id: str,
+    k: int = Query(10, ge=1, le=50),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """
+    The doctor's k past predictions whose scans are closest to this one in the model's
+    embedding space, most similar first. Only predictions embedded by the current model are searched.
+    """
+    if current_user.role != "doctor":
+        raise HTTPException(status_code=403, detail="Access denied")
+    db = get_database()
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
+    if not ObjectId.is_valid(prediction_id):
+        raise HTTPException(status_code=400, detail="Invalid prediction id")
+
+    prediction = await _find_prediction(
+        db, prediction_id, {"doctor_id": 1, "embedding": 1, "embedding_model": 1, "image_ref": 1}, current_user
+    )
+    if not prediction:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+    if prediction["doctor_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    from app.routers.prediction import current_model_version, embed_stored_image
+    model_version = current_model_version()
+    with timed_stage("similarity_sync"):
+        await similarity_index.refresh(db, model_version)
+    if prediction.get("embedding") and prediction.get("embedding_model") == model_version:
+        query = decode_embedding(prediction["embedding"])
+    elif prediction.get("image_ref"):
+        try:
+            query = await embed_stored_image(prediction["image_ref"])
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Image not found")
+    else:
+        raise HTTPException(status_code=409, detail="Prediction has no embedding and no stored image to compute one")
+
+    with timed_stage("ann_search"):
+        hits = await asyncio.to_thread(similarity_index.search, current_user.id, query, k, ObjectId(prediction_id))
+    if not hits:
+        return FastJSONResponse([])
+
+    ids = [oid for oid, _ in hits]
+    with timed_stage("db_query"):
+        found = {doc["_id"]: doc async for doc in db.predictions.find({"_id": {"$in": ids}}, projection(PredictionHistory))}
+    for oid in ids:
+        if oid not in found:
+            # Archived since it was indexed
+            with timed_stage("archive_query"):
+                archived = await asyncio.to_thread(find_archived, str(oid), current_user.id)
+            if archived is not None:
+                archived["_id"] = ObjectId(archived.pop("id"))
+                found[oid] = archived
+    return FastJSONResponse([
+        SimilarCase.model_construct(prediction=PredictionHistory.from_mongo(found[oid]), similarity=similarity)
+        for oid, similarity in hits if oid in found
+    ])
+
+async def start_similarity_index():
+    """Load the similar-case index and catch up with Mongo in the background."""
+    global _similarity_warmup
+    db = get_database()
+    if db is None:
+        return
+
+    async def warm():
+        from app.routers.prediction import current_model_version
+        try:
+            await ensure_similarity_indexes(db)
+            added = await similarity_index.sync(db, current_model_version())
+            print(f"🔎 Similarity index ready: {similarity_index.count} embeddings ({added} new)")
+        except Exception as e:
+            print(f"⚠️  Similarity index warm-up failed: {e}")
+
+    _similarity_warmup = asyncio.create_task(warm())
+
+async def stop_similarity_index():
+    if _similarity_warmup is not None:
+        _similarity_warmup.cancel()
+        await asyncio.gather(_similarity_warmup, return_exceptions=True)
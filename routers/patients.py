@@ -1,15 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from typing import Dict, List, Optional, Tuple
 from app.utils.auth import get_current_user
 from app.models.user import UserInDB
 from app.utils.database import get_database
+from app.utils.metrics import timed_stage
+from app.utils.conditional import cached_listing, get_version
+from app.utils.search import ensure_search_indexes, prefix_query
+from app.utils.serialization import FastJSONResponse
+from app.models.patient import PatientRecord, PatientSearchPage, PatientSearchResult
 from bson import ObjectId
 from datetime import datetime
 
 router = APIRouter(prefix="/patients", tags=["Patients"])
 
-@router.get("/records")
-async def get_patient_records(current_user: UserInDB = Depends(get_current_user)):
+# doctor_id -> (change version, ids of patients with predictions by that doctor)
+_patient_ids_cache: Dict[str, Tuple[int, List[ObjectId]]] = {}
+
+async def ensure_indexes():
+    db = get_database()
+    if db is None:
+        return
+    try:
+        backfilled = await ensure_search_indexes(db)
+        if backfilled:
+            print(f"✅ Added search terms to {backfilled} users")
+    except Exception as e:
+        print(f"⚠️  Failed to create patient search indexes: {e}")
+
+async def doctor_patient_ids(db, doctor_id: str) -> List[ObjectId]:
+    """Patients the doctor has predictions for; recomputed only after the doctor's change version moves."""
+    version, _ = await get_version(db, doctor_id)
+    cached = _patient_ids_cache.get(doctor_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    patient_ids = await db.predictions.distinct("patient_id", {"doctor_id": doctor_id})
+    object_ids = [ObjectId(p) for p in patient_ids if isinstance(p, str) and ObjectId.is_valid(p)]
+    _patient_ids_cache[doctor_id] = (version, object_ids)
+    return object_ids
+
+@router.get("/records", response_model=List[PatientRecord])
+async def get_patient_records(request: Request, current_user: UserInDB = Depends(get_current_user)):
     """Get patient records for doctors"""
     if current_user.role != "doctor":
         raise HTTPException(status_code=403, detail="Access denied")
@@ -18,35 +48,46 @@ async def get_patient_records(current_user: UserInDB = Depends(get_current_user)
     if db is None:
         raise HTTPException(status_code=503, detail="Database connection unavailable")
     
-    # Get predictions made by this doctor
-    cursor = db.predictions.find({"doctor_id": current_user.id}).sort("created_at", -1)
+    async def build():
+        # One row per patient of this doctor: newest analysis, its result and the count
+        pipeline = [
+            {"$match": {"doctor_id": current_user.id}},
+            {"$sort": {"created_at": -1}},
+            {"$group": {
+                "_id": "$patient_id",
+                "last_analysis": {"$first": "$created_at"},
+                "latest_result": {"$first": "$class_prediction"},
+                "total_analyses": {"$sum": 1},
+            }},
+            {"$sort": {"last_analysis": -1}},
+        ]
+        with timed_stage("db_aggregate"):
+            groups = await db.predictions.aggregate(pipeline).to_list(None)
+        
+        # Patient names and emails in one query
+        patient_ids = [ObjectId(g["_id"]) for g in groups if isinstance(g["_id"], str) and ObjectId.is_valid(g["_id"])]
+        with timed_stage("db_query"):
+            patients = {
+                str(u["_id"]): u
+                async for u in db.users.find({"_id": {"$in": patient_ids}}, {"full_name": 1, "email": 1})
+            }
+        
+        patient_records = []
+        for group in groups:
+            patient_id = group["_id"] or "Anonymous"
+            patient_info = patients.get(patient_id)
+            patient_records.append(PatientRecord.model_construct(
+                id=patient_id,
+                name=patient_info.get("full_name", "Anonymous Patient") if patient_info else "Anonymous Patient",
+                email=patient_info.get("email", "N/A") if patient_info else "N/A",
+                last_analysis=group["last_analysis"],
+                total_analyses=group["total_analyses"],
+                latest_result=group.get("latest_result") or "N/A"
+            ))
+        return patient_records
     
-    patient_records = []
-    patient_ids = set()
-    
-    async for prediction in cursor:
-        patient_id = prediction.get("patient_id", "Anonymous")
-        if patient_id not in patient_ids:
-            patient_ids.add(patient_id)
-            
-            # Get patient info if available
-            patient_info = None
-            if patient_id != "Anonymous":
-                patient_info = await db.users.find_one({"_id": ObjectId(patient_id)})
-            
-            patient_records.append({
-                "id": patient_id,
-                "name": patient_info.get("full_name", "Anonymous Patient") if patient_info else "Anonymous Patient",
-                "email": patient_info.get("email", "N/A") if patient_info else "N/A",
-                "last_analysis": prediction["created_at"],
-                "total_analyses": await db.predictions.count_documents({
-                    "doctor_id": current_user.id,
-                    "patient_id": patient_id
-                }),
-                "latest_result": prediction.get("class_prediction", "N/A")
-            })
-    
-    return patient_records
+    # 304 / cached body while no prediction was written for this doctor
+    return await cached_listing(request, db, "patient_records", current_user.id, build)
 
 @router.get("/analytics")
 async def get_analytics(current_user: UserInDB = Depends(get_current_user)):
@@ -59,7 +100,8 @@ async def get_analytics(current_user: UserInDB = Depends(get_current_user)):
         raise HTTPException(status_code=503, detail="Database connection unavailable")
     
     # Get total analyses
-    total_analyses = await db.predictions.count_documents({"doctor_id": current_user.id})
+    with timed_stage("db_count"):
+        total_analyses = await db.predictions.count_documents({"doctor_id": current_user.id})
     
     # Get this month's analyses
     from datetime import datetime, timedelta
@@ -75,7 +117,8 @@ async def get_analytics(current_user: UserInDB = Depends(get_current_user)):
         {"$group": {"_id": "$patient_id"}},
         {"$count": "unique_patients"}
     ]
-    unique_patients_result = await db.predictions.aggregate(pipeline).to_list(1)
+    with timed_stage("db_aggregate"):
+        unique_patients_result = await db.predictions.aggregate(pipeline).to_list(1)
     unique_patients = unique_patients_result[0]["unique_patients"] if unique_patients_result else 0
     
     return {
@@ -83,4 +126,42 @@ async def get_analytics(current_user: UserInDB = Depends(get_current_user)):
         "this_month": this_month,
         "unique_patients": unique_patients,
         "accuracy_rate": 94.2  # Mock data
-    }
\ No newline at end of file
+    }
+
+@router.get("/search", response_model=PatientSearchPage)
+async def search_patients(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    cursor: Optional[str] = None,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Typeahead search (name/email prefix) over the doctor's patients"""
+    if current_user.role != "doctor":
+        raise HTTPException(status_code=403, detail="Access denied")
+    if cursor is not None and not ObjectId.is_valid(cursor):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not q.strip():
+        raise HTTPException(status_code=422, detail="Search text must not be blank")
+    
+    db = get_database()
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
+    
+    with timed_stage("patient_ids"):
+        patient_ids = await doctor_patient_ids(db, current_user.id)
+    
+    id_filter = {"$in": patient_ids}
+    if cursor is not None:
+        id_filter["$gt"] = ObjectId(cursor)
+    query = {**prefix_query(q), "_id": id_filter}
+    with timed_stage("db_query"):
+        users = await db.users.find(query, {"full_name": 1, "email": 1}).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+    
+    page = users[:limit]
+    return FastJSONResponse(PatientSearchPage.model_construct(
+        results=[
+            PatientSearchResult.model_construct(id=str(u["_id"]), name=u.get("full_name", ""), email=u.get("email", ""))
+            for u in page
+        ],
+        next_cursor=str(page[-1]["_id"]) if len(users) > limit else None
+    ))
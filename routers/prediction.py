@@ -1,19 +1,36 @@
+from __future__ import annotations
+
 import os
 import sys
 import json
-from typing import List
-import numpy as np
-from fastapi import APIRouter, HTTPException, Request, File, UploadFile, Depends
-from fastapi.responses import JSONResponse
-from PIL import Image
+from typing import Dict, List, Optional, TYPE_CHECKING
+import asyncio
+from fastapi import APIRouter, HTTPException, Request, File, UploadFile, Depends, WebSocket
+from fastapi.responses import StreamingResponse
+from app.utils.serialization import FastJSONResponse, dumps
 from importlib import import_module
 import io
 from datetime import datetime
+from time import perf_counter
 from app.utils.auth import get_current_user
 from app.models.user import UserInDB
 from app.utils.database import get_database
+from app.utils.metrics import counter, gauge, timed_stage
+from app.utils.uploads import SNIFF_BYTES, read_upload, sniff_format
+from app.utils import dicom
+from app.utils.admission import prediction_admission
+from app.utils.batching import MicroBatcher
+from app.utils.conditional import bump_versions
+from app.utils import jobs
+from app.utils.image_store import get_image_store, store_image
+from app.utils.similarity import encode_embedding
+from app.utils.model_version import model_version
 from bson import ObjectId
 
+# numpy and PIL are imported on first use so app startup does not pay for them
+if TYPE_CHECKING:
+    import numpy as np
+
 router = APIRouter(prefix="/prediction")
 
 base_router_dir = os.path.dirname(__file__)
@@ -24,9 +41,33 @@ labels_path = os.path.join(model_dir, "image_model", "labels.json")
 _model = None
 _model_error = None
 _class_names = None
+# XLA-compiled fixed-shape signatures keyed by batch size (see convert_h5_to_savedmodel.BATCH_BUCKETS)
+_bucket_fns = {}
+# Grad-CAM signature (see convert_h5_to_savedmodel.gradcam_signature) and a short hash of
+# the loaded SavedModel, so cached explanations are tied to the model that produced them
+_explain_fn = None
+_model_version = None
+# Penultimate-layer embedding signatures (see convert_h5_to_savedmodel.embedding_signature):
+# the dynamic `embed` one and XLA-compiled ones keyed by batch size
+_embed_fn = None
+_embed_bucket_fns = {}
+
+def _saved_model_version() -> str:
+    # Whole directory (graph, variables, labels), as recorded by evaluate_model.py
+    if not os.path.isfile(os.path.join(model_path, "saved_model.pb")):
+        return "unversioned"
+    return model_version(model_path)
+
+def current_model_version() -> str:
+    """Version of the model on disk, without loading TensorFlow."""
+    global _model_version
+    if _model_version is None:
+        _model_version = _saved_model_version()
+    return _model_version
 
 def ensure_model():
-    global _model, _model_error, _class_names
+    global _model, _model_error, _class_names, _bucket_fns, _explain_fn, _model_version
+    global _embed_fn, _embed_bucket_fns
     if _model is not None:
         return _model, _class_names
 
@@ -44,6 +85,22 @@ def ensure_model():
         try:
             # Try loading as SavedModel (Keras 3 compatible)
             _model = tf.saved_model.load(model_path)
+            if hasattr(_model, 'signatures'):
+                _bucket_fns = {
+                    int(name[len('serve_b'):]): fn
+                    for name, fn in _model.signatures.items()
+                    if name.startswith('serve_b') and name[len('serve_b'):].isdigit()
+                }
+                if _bucket_fns:
+                    print(f"✅ XLA batch buckets available: {sorted(_bucket_fns)}")
+                _explain_fn = _model.signatures.get('explain')
+                _embed_fn = _model.signatures.get('embed')
+                _embed_bucket_fns = {
+                    int(name[len('embed_b'):]): fn
+                    for name, fn in _model.signatures.items()
+                    if name.startswith('embed_b') and name[len('embed_b'):].isdigit()
+                }
+                _model_version = _saved_model_version()
             # Get the serving function (usually 'serve' endpoint)
             if hasattr(_model, 'signatures') and 'serve' in _model.signatures:
                 _model = _model.signatures['serve']
@@ -74,11 +131,85 @@ def ensure_model():
         print(f"❌ {_model_error}")
         return None, None
 
-def preprocess_image(image_data: bytes) -> np.ndarray:
-    """Preprocess image bytes into model input format."""
+def _signature_output(result) -> np.ndarray:
+    # Extract predictions from result (could be dict or tensor)
+    if isinstance(result, dict):
+        # Get first output value
+        return list(result.values())[0].numpy()
+    return result.numpy()
+
+def _bucketed_calls(fns: dict, batch: np.ndarray):
+    """
+    Yield (outputs, rows) per chunk of batch: chunks of the largest bucket, each zero-padded
+    up to the nearest bucket so every call hits a compiled shape. Only the first `rows`
+    outputs of a chunk are real.
+    """
+    import numpy as np
+    tf = import_module('tensorflow')
+    buckets = sorted(fns)
+    for start in range(0, len(batch), buckets[-1]):
+        chunk = batch[start:start + buckets[-1]]
+        bucket = next(b for b in buckets if b >= len(chunk))
+        if bucket > len(chunk):
+            padding = np.zeros((bucket - len(chunk),) + chunk.shape[1:], dtype=np.float32)
+            chunk_input = np.concatenate([chunk, padding])
+        else:
+            chunk_input = chunk
+        yield fns[bucket](tf.constant(chunk_input)), len(chunk)
+
+def predict_batch(model, batch: np.ndarray) -> np.ndarray:
+    """
+    Run inference on a [N, 224, 224, 3] batch and return [N, num_classes] probabilities.
+    With bucketed signatures, the batch is split into chunks of the largest bucket and
+    each chunk is zero-padded up to the nearest bucket so every call hits a compiled shape.
+    """
+    import numpy as np
+    batch = np.asarray(batch, dtype=np.float32)
+
+    if _bucket_fns:
+        return np.concatenate([
+            _signature_output(outputs)[:rows] for outputs, rows in _bucketed_calls(_bucket_fns, batch)
+        ])
+
+    # Check if model is a SavedModel signature function or Keras model
+    if callable(model) and not hasattr(model, 'predict'):
+        # SavedModel signature function (the only path that needs TensorFlow)
+        tf = import_module('tensorflow')
+        predictions = _signature_output(model(tf.constant(batch, dtype=tf.float32)))
+    else:
+        # Keras model
+        predictions = model.predict(batch, verbose=0)
+
+    # Ensure predictions is 2D array
+    if len(predictions.shape) == 1:
+        predictions = predictions.reshape(1, -1)
+    return predictions
+
+def predict_with_embeddings(model, batch: np.ndarray):
+    """
+    Probabilities [N, num_classes] and L2-normalized penultimate-layer embeddings [N, d]
+    from one forward pass. Embeddings are None for models exported without `embed`.
+    """
+    import numpy as np
+    if _embed_fn is None:
+        return predict_batch(model, batch), None
+    tf = import_module('tensorflow')
+    batch = np.asarray(batch, dtype=np.float32)
+    if _embed_bucket_fns:
+        calls = list(_bucketed_calls(_embed_bucket_fns, batch))
+    else:
+        calls = [(_embed_fn(tf.constant(batch)), len(batch))]
+    probabilities = np.concatenate([outputs["probabilities"].numpy()[:rows] for outputs, rows in calls])
+    embeddings = np.concatenate([outputs["embedding"].numpy()[:rows] for outputs, rows in calls])
+    return probabilities, embeddings
+
+def decode_image(image_data) -> np.ndarray:
+    """Decode image bytes (or a binary file-like object) into a [224, 224, 3] uint8 array."""
+    import numpy as np
+    from PIL import Image
     try:
-        # Open image from bytes
-        img = Image.open(io.BytesIO(image_data))
+        # Open image from bytes, or directly from the upload buffer to avoid a copy
+        img = Image.open(image_data if hasattr(image_data, 'read') else io.BytesIO(image_data))
         
         # Convert to RGB if needed
         if img.mode != 'RGB':
@@ -87,14 +218,76 @@ def preprocess_image(image_data: bytes) -> np.ndarray:
         # Resize to model input size
         img = img.resize((224, 224))
         
-        # Convert to numpy array and normalize
-        img_array = np.array(img) / 255.0
-        
-        # Add batch dimension
-        return np.expand_dims(img_array, axis=0)
+        return np.asarray(img, dtype=np.uint8)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to process image: {str(e)}")
 
+def scale_images(pixels: np.ndarray) -> np.ndarray:
+    """Normalize uint8 pixels to the model's [0, 1] input range."""
+    return pixels / 255.0
+
+def preprocess_image(image_data) -> np.ndarray:
+    """Preprocess image bytes (or a binary file-like object) into model input format."""
+    import numpy as np
+    # Add batch dimension
+    return np.expand_dims(scale_images(decode_image(image_data)), axis=0)
+
+def decode_scan(data, fmt: Optional[str] = None, preview: bool = False):
+    """
+    Decode a scan (path, bytes or binary file-like object) into uint8 frames [n, 224, 224, 3]:
+    one frame for JPEG/PNG, the sampled frames of a DICOM cine loop. Returns
+    (frames, DICOM metadata or None, PNG of the best DICOM frame or None).
+    """
+    import numpy as np
+    if isinstance(data, (str, os.PathLike)):
+        with open(data, "rb") as f:
+            fmt = fmt or sniff_format(f.read(SNIFF_BYTES))
+            if fmt != "dicom":
+                f.seek(0)
+                return decode_image(f)[np.newaxis], None, None
+    elif fmt is None:
+        head = data.getbuffer()[:SNIFF_BYTES].tobytes() if hasattr(data, "getbuffer") else bytes(data[:SNIFF_BYTES])
+        fmt = sniff_format(head)
+    if fmt == "dicom":
+        # Paths are memory-mapped; only the sampled frames are read
+        return dicom.load_frames(data, preview=preview)
+    return decode_image(data)[np.newaxis], None, None
+
+def scan_document(frame_probabilities: np.ndarray, class_names, doctor_id: str, filename: str,
+                  dicom_metadata: Optional[dict] = None, frame_embeddings: Optional[np.ndarray] = None) -> dict:
+    """
+    Prediction document for one scan. A cine loop is classified by the mean of its sampled
+    frames' probabilities; its study UID and gestational age are stored alongside.
+    The (mean) embedding is stored as float16 for similar-case retrieval.
+    """
+    doc = prediction_document(frame_probabilities.mean(axis=0), class_names, doctor_id, filename)
+    if frame_embeddings is not None:
+        doc["embedding"] = encode_embedding(frame_embeddings.mean(axis=0))
+        doc["embedding_model"] = _model_version
+    if dicom_metadata is not None:
+        metadata = dict(dicom_metadata)
+        for field in ("study_uid", "gestational_age_days"):
+            if field in metadata:
+                doc[field] = metadata.pop(field)
+        # Share of sampled frames that agree with the loop-level class
+        metadata["frame_agreement"] = float((frame_probabilities.argmax(axis=1) == class_names.index(doc["class_prediction"])).mean())
+        doc["dicom"] = metadata
+    return doc
+
+def prediction_document(probabilities_row, class_names, doctor_id: str, filename: str) -> dict:
+    """Prediction document for one image, with a pre-assigned _id."""
+    probabilities = dict(zip(class_names, probabilities_row.tolist()))
+    predicted_class_idx = int(probabilities_row.argmax())
+    return {
+        "_id": ObjectId(),
+        "class_prediction": class_names[predicted_class_idx],
+        "confidence": float(probabilities_row[predicted_class_idx]),
+        "probabilities": probabilities,
+        "doctor_id": doctor_id,
+        "image_filename": filename,
+        "created_at": datetime.now()
+    }
+
 @router.post("/predict_image")
 async def predict_image(file: UploadFile = File(...), current_user: UserInDB = Depends(get_current_user)):
     """Predict AFI class from uploaded image."""
@@ -105,76 +298,63 @@ async def predict_image(file: UploadFile = File(...), current_user: UserInDB = D
             detail={"error": "Model not available", "reason": _model_error}
         )
     
-    # Validate file type
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(
-            status_code=400,
-            detail="File must be an image"
-        )
-    
     try:
-        # Read and preprocess image
-        image_data = await file.read()
-        processed_image = preprocess_image(image_data)
-        
-        # Make prediction - handle both SavedModel and Keras model formats
-        tf = import_module('tensorflow')
-        
-        # Convert numpy array to TensorFlow tensor
-        input_tensor = tf.constant(processed_image, dtype=tf.float32)
-        
-        # Check if model is a SavedModel signature function or Keras model
-        if callable(model) and not hasattr(model, 'predict'):
-            # SavedModel signature function
-            result = model(input_tensor)
-            # Extract predictions from result (could be dict or tensor)
-            if isinstance(result, dict):
-                # Get first output value
-                predictions = list(result.values())[0].numpy()
-            else:
-                predictions = result.numpy()
-        else:
-            # Keras model
-            predictions = model.predict(processed_image, verbose=0)
-        
-        # Ensure predictions is 2D array
-        if len(predictions.shape) == 1:
-            predictions = predictions.reshape(1, -1)
-        
-        predicted_class_idx = int(np.argmax(predictions[0]))
-        confidence = float(predictions[0][predicted_class_idx])
+        # Bounded, per-doctor fair admission: excess requests get 429 instead of piling up in TensorFlow
+        async with prediction_admission.slot(current_user.id):
+            # Read in bounded chunks; the type is sniffed from magic bytes rather than content_type
+            with timed_stage("upload_read"):
+                upload, fmt = await read_upload(file)
+
+            # Decode and inference run off the event loop; admission bounds how many run at once.
+            # A DICOM cine loop yields its sampled frames, classified together in one call.
+            with timed_stage("decode"):
+                frames, dicom_metadata, preview = await asyncio.to_thread(decode_scan, upload, fmt, True)
+
+            # Make prediction - handle both SavedModel and Keras model formats
+            with timed_stage("inference"):
+                predictions, embeddings = await asyncio.to_thread(predict_with_embeddings, model, scale_images(frames))
+
+        prediction_data = scan_document(
+            predictions, class_names, current_user.id, file.filename, dicom_metadata, embeddings
+        )
         
         # Save prediction to database (if available)
         db = get_database()
         prediction_id = None
         if db is not None:
             try:
-                prediction_data = {
-                    "class_prediction": class_names[predicted_class_idx],
-                    "confidence": confidence,
-                    "probabilities": {
-                        class_name: float(prob) 
-                        for class_name, prob in zip(class_names, predictions[0].tolist())
-                    },
-                    "doctor_id": current_user.id,
-                    "image_filename": file.filename,
-                    "created_at": datetime.now()
-                }
-                result = await db.predictions.insert_one(prediction_data)
+                # Uploaded scans are kept (deduplicated by content hash) for viewing and fine-tuning
+                try:
+                    with timed_stage("image_store"):
+                        if preview is not None:
+                            # DICOM: the best frame is what viewers, thumbnails and Grad-CAM use
+                            prediction_data["image_ref"] = await store_image(preview)
+                            prediction_data["dicom"]["source_ref"] = await store_image(upload.getbuffer())
+                        else:
+                            prediction_data["image_ref"] = await store_image(upload.getbuffer())
+                except Exception as store_error:
+                    print(f"⚠️  Failed to store uploaded image: {store_error}")
+                with timed_stage("db_insert"):
+                    result = await db.predictions.insert_one(prediction_data)
                 prediction_id = str(result.inserted_id)
+                await bump_versions(db, current_user.id)
             except Exception as db_error:
                 print(f"⚠️  Failed to save prediction to database: {db_error}")
         
-        return JSONResponse({
-            "class": class_names[predicted_class_idx],
-            "confidence": confidence,
-            "probabilities": {
-                class_name: float(prob) 
-                for class_name, prob in zip(class_names, predictions[0].tolist())
-            },
+        response = {
+            "class": prediction_data["class_prediction"],
+            "confidence": prediction_data["confidence"],
+            "probabilities": prediction_data["probabilities"],
             "prediction_id": prediction_id
-        })
+        }
+        if dicom_metadata is not None:
+            response["frames_analyzed"] = len(frames)
+            response["study_uid"] = prediction_data.get("study_uid")
+            response["gestational_age_days"] = prediction_data.get("gestational_age_days")
+        return FastJSONResponse(response)
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -182,4 +362,480 @@ async def predict_image(file: UploadFile = File(...), current_user: UserInDB = D
         raise HTTPException(
             status_code=500,
             detail=f"Prediction failed: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+# -------------------------
+# GRAD-CAM EXPLANATIONS
+# -------------------------
+# Explanations are computed on first view only. Concurrent requests are collected for
+# up to EXPLAIN_BATCH_WINDOW_MS into one `explain` call of at most EXPLAIN_MAX_BATCH images.
+EXPLAIN_MAX_BATCH = int(os.getenv("EXPLAIN_MAX_BATCH", "8"))
+EXPLAIN_BATCH_WINDOW = float(os.getenv("EXPLAIN_BATCH_WINDOW_MS", "20")) / 1000.0
+
+# Cache key -> task computing it, so simultaneous views of one prediction share the work
+_explain_pending: Dict[str, asyncio.Task] = {}
+
+def run_gradcam(batch: np.ndarray) -> np.ndarray:
+    """[N, h, w] Grad-CAM heatmaps in [0, 1] for a preprocessed batch."""
+    tf = import_module('tensorflow')
+    result = _explain_fn(inputs=tf.constant(batch, dtype=tf.float32))
+    return result["heatmap"].numpy()
+
+def render_overlay(heatmap: np.ndarray, size=(224, 224)) -> bytes:
+    """Heatmap as a transparent colour-mapped PNG (alpha follows intensity) to lay over the scan."""
+    import numpy as np
+    from PIL import Image
+    h = np.asarray(Image.fromarray((heatmap * 255).astype(np.uint8)).resize(size, Image.BILINEAR)) / 255.0
+    # Jet-like colour ramp: blue -> green -> red
+    rgb = np.stack([np.clip(1.5 - np.abs(4 * h - c), 0, 1) for c in (3, 2, 1)], axis=-1)
+    rgba = np.concatenate([rgb, (h * 0.6)[..., None]], axis=-1)
+    out = io.BytesIO()
+    Image.fromarray((rgba * 255).astype(np.uint8), mode="RGBA").save(out, format="PNG", optimize=True)
+    return out.getvalue()
+
+def _gradcam_batch(images: List[np.ndarray]) -> np.ndarray:
+    import numpy as np
+    return run_gradcam(np.concatenate(images))
+
+explain_batcher = MicroBatcher(_gradcam_batch, EXPLAIN_MAX_BATCH, EXPLAIN_BATCH_WINDOW)
+
+async def _compute_explanation(image_ref: str, key: str) -> str:
+    store = get_image_store()
+    image = await asyncio.to_thread(preprocess_image, await store.read(image_ref))
+    with timed_stage("gradcam"):
+        heatmap = await explain_batcher.submit(image)
+    await store.put(key, await asyncio.to_thread(render_overlay, heatmap))
+    return key
+
+async def explanation_key(image_ref: str) -> str:
+    """Image-store key of the Grad-CAM overlay for image_ref, computing it on first use."""
+    model, _ = ensure_model()
+    if model is None:
+        raise HTTPException(status_code=503, detail={"error": "Model not available", "reason": _model_error})
+    if _explain_fn is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Model has no explain signature; re-export it with convert_h5_to_savedmodel.py"
+        )
+
+    key = f"{image_ref}.gradcam.{_model_version}"
+    if await get_image_store().exists(key):
+        return key
+    task = _explain_pending.get(key)
+    if task is None:
+        task = _explain_pending[key] = asyncio.create_task(_compute_explanation(image_ref, key))
+        task.add_done_callback(lambda _: _explain_pending.pop(key, None))
+    # Shielded: a client disconnecting does not cancel work other viewers are waiting on
+    return await asyncio.shield(task)
+
+async def embed_stored_image(image_ref: str) -> np.ndarray:
+    """Embedding of a stored scan under the current model, for predictions stored without one."""
+    model, _ = ensure_model()
+    if model is None:
+        raise HTTPException(status_code=503, detail={"error": "Model not available", "reason": _model_error})
+    if _embed_fn is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Model has no embed signature; re-export it with convert_h5_to_savedmodel.py"
+        )
+    image = await asyncio.to_thread(preprocess_image, await get_image_store().read(image_ref))
+    with timed_stage("embed"):
+        _, embeddings = await asyncio.to_thread(predict_with_embeddings, model, image)
+    return embeddings[0]
+
+
+# -------------------------
+# ASYNC PREDICTION JOBS
+# -------------------------
+job_queue = jobs.create_queue(get_database)
+job_workers = None
+JOB_INFERENCE_CHUNK = 32
+
+async def process_prediction_jobs(claimed: List[dict], queue: jobs.JobQueue):
+    """Decode every image of the claimed jobs in parallel, then run batched inference across jobs."""
+    import numpy as np
+    model, class_names = ensure_model()
+    if model is None:
+        for job in claimed:
+            await queue.update(job["_id"], status=jobs.FAILED, error=f"Model not available: {_model_error}")
+            jobs.JOBS_TOTAL.inc(jobs.FAILED)
+        return
+
+    loop = asyncio.get_running_loop()
+
+    def decode(item):
+        try:
+            return decode_scan(bytes(item["image"]), preview=True)
+        except Exception as e:
+            return e
+
+    # (job, item) pairs in order, decoded off the event loop
+    pairs = [(job, item) for job in claimed for item in job["items"]]
+    decoded = await asyncio.gather(*(loop.run_in_executor(None, decode, item) for _, item in pairs))
+
+    results = {str(job["_id"]): [] for job in claimed}
+    documents = []
+    ok = []
+    for (job, item), scan in zip(pairs, decoded):
+        if isinstance(scan, Exception):
+            results[str(job["_id"])].append({"filename": item["filename"], "error": str(getattr(scan, "detail", scan))})
+        else:
+            ok.append(((job, item), scan))
+
+    # Chunks of whole scans holding about JOB_INFERENCE_CHUNK frames (a cine loop counts its sampled frames)
+    chunks, current, current_frames = [], [], 0
+    for entry in ok:
+        if current and current_frames + len(entry[1][0]) > JOB_INFERENCE_CHUNK:
+            chunks.append(current)
+            current, current_frames = [], 0
+        current.append(entry)
+        current_frames += len(entry[1][0])
+    if current:
+        chunks.append(current)
+
+    for chunk in chunks:
+        batch = scale_images(np.concatenate([frames for _, (frames, _, _) in chunk]))
+        predictions, embeddings = await loop.run_in_executor(None, predict_with_embeddings, model, batch)
+        offset = 0
+        for (job, item), (frames, dicom_metadata, preview) in chunk:
+            rows = slice(offset, offset + len(frames))
+            offset += len(frames)
+            doc = scan_document(
+                predictions[rows], class_names, job["doctor_id"], item["filename"], dicom_metadata,
+                embeddings[rows] if embeddings is not None else None
+            )
+            try:
+                if preview is not None:
+                    doc["image_ref"] = await store_image(preview)
+                    doc["dicom"]["source_ref"] = await store_image(item["image"])
+                else:
+                    doc["image_ref"] = await store_image(item["image"])
+            except Exception as store_error:
+                print(f"⚠️  Failed to store uploaded image: {store_error}")
+            result = {
+                "filename": item["filename"],
+                "class": doc["class_prediction"],
+                "confidence": doc["confidence"],
+                "probabilities": doc["probabilities"],
+            }
+            documents.append((doc, result))
+            results[str(job["_id"])].append(result)
+        # Progress update for every job touched by this chunk
+        for job in {str(job["_id"]): job for (job, _), _ in chunk}.values():
+            await queue.update(job["_id"], processed=len(results[str(job["_id"])]))
+
+    # prediction_id is only reported for predictions that were actually saved
+    db = get_database()
+    if db is not None and documents:
+        from pymongo.errors import BulkWriteError
+        saved = documents
+        try:
+            await db.predictions.insert_many([doc for doc, _ in documents], ordered=False)
+        except BulkWriteError as db_error:
+            failed = {error["index"] for error in db_error.details.get("writeErrors", [])}
+            saved = [entry for i, entry in enumerate(documents) if i not in failed]
+            print(f"⚠️  Failed to save {len(failed)} job predictions to database: {db_error}")
+        except Exception as db_error:
+            saved = []
+            print(f"⚠️  Failed to save job predictions to database: {db_error}")
+        for doc, result in saved:
+            result["prediction_id"] = str(doc["_id"])
+        if saved:
+            try:
+                await bump_versions(db, *(doc["doctor_id"] for doc, _ in saved))
+            except Exception as db_error:
+                print(f"⚠️  Failed to bump listing versions: {db_error}")
+
+    for job in claimed:
+        job_results = results[str(job["_id"])]
+        failed = bool(job_results) and all("error" in r for r in job_results)
+        status = jobs.FAILED if failed else jobs.DONE
+        await queue.update(job["_id"], status=status, processed=len(job_results), results=job_results)
+        jobs.JOBS_TOTAL.inc(status)
+
+async def start_job_workers():
+    global job_workers
+    if isinstance(job_queue, jobs.MongoJobQueue) and get_database() is not None:
+        await job_queue.ensure_indexes()
+    if jobs.JOB_WORKERS > 0:
+        job_workers = jobs.JobWorkers(job_queue, process_prediction_jobs)
+        job_workers.start()
+
+async def stop_job_workers():
+    if job_workers is not None:
+        await job_workers.stop()
+
+async def _get_own_job(job_id: str, current_user: UserInDB) -> dict:
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["doctor_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return job
+
+@router.post("/jobs", status_code=202)
+async def submit_prediction_job(files: List[UploadFile] = File(...), current_user: UserInDB = Depends(get_current_user)):
+    """Queue one or more images for prediction and return a job id immediately."""
+    items = []
+    total_bytes = 0
+    for file in files:
+        upload, _ = await read_upload(file)
+        total_bytes += upload.getbuffer().nbytes
+        items.append({"filename": file.filename, "image": upload.getvalue()})
+    if isinstance(job_queue, jobs.MongoJobQueue) and total_bytes > jobs.MAX_JOB_BYTES:
+        raise HTTPException(status_code=413, detail="Job exceeds 15 MB; split it into smaller jobs")
+
+    try:
+        job_id = await job_queue.submit(jobs.new_job(current_user.id, items))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "job_id": job_id,
+        "status": jobs.QUEUED,
+        "total": len(items),
+        "status_url": f"/api/prediction/jobs/{job_id}",
+        "events_url": f"/api/prediction/jobs/{job_id}/events"
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_prediction_job(job_id: str, current_user: UserInDB = Depends(get_current_user)):
+    """Poll job status, progress and per-image results."""
+    return jobs.public_view(await _get_own_job(job_id, current_user))
+
+@router.get("/jobs/{job_id}/events")
+async def stream_prediction_job(job_id: str, request: Request, current_user: UserInDB = Depends(get_current_user)):
+    """Server-Sent Events stream of job updates, closed once the job is done or failed."""
+    job = await _get_own_job(job_id, current_user)
+
+    def status_event(current):
+        return b"event: status\ndata: " + dumps(jobs.public_view(current)) + b"\n\n"
+
+    async def events():
+        current = job
+        yield status_event(current)
+        while current["status"] not in (jobs.DONE, jobs.FAILED):
+            if await request.is_disconnected():
+                return
+            updated = await job_queue.wait_for_update(job_id, current["updated_at"], timeout=15.0)
+            if updated is None:
+                return
+            if updated["updated_at"] == current["updated_at"]:
+                # Keep-alive comment so proxies do not close an idle stream
+                yield b": keep-alive\n\n"
+                continue
+            current = updated
+            yield status_event(current)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# -------------------------
+# REAL-TIME FRAME STREAMING
+# -------------------------
+# Frames from all live sessions are batched into shared inference calls. Each session
+# keeps at most one frame waiting, so when inference falls behind the stale frames are
+# dropped and clients always get a result for their most recent frame.
+STREAM_MAX_SESSIONS = int(os.getenv("STREAM_MAX_SESSIONS", "16"))
+STREAM_MAX_BATCH = int(os.getenv("STREAM_MAX_BATCH", "16"))
+STREAM_BATCH_WINDOW = float(os.getenv("STREAM_BATCH_WINDOW_MS", "5")) / 1000.0
+# Weight of the newest frame in the moving average sent back to clients
+STREAM_SMOOTHING = float(os.getenv("STREAM_SMOOTHING", "0.3"))
+STREAM_MAX_FRAME_BYTES = 2 * 1024 * 1024
+
+STREAM_FRAMES = counter("afi_stream_frames_total", "Streamed frames by outcome", ("outcome",))
+STREAM_SESSIONS = gauge("afi_stream_sessions", "Open frame-streaming sessions")
+
+def _predict_frames(frames: List[np.ndarray]) -> np.ndarray:
+    import numpy as np
+    model, _ = ensure_model()
+    return predict_batch(model, scale_images(np.stack(frames)))
+
+# A batch mixes frames of several sessions, so it takes one slot under a shared key
+frame_batcher = MicroBatcher(
+    _predict_frames, STREAM_MAX_BATCH, STREAM_BATCH_WINDOW, slot=lambda: prediction_admission.slot("stream")
+)
+_stream_sessions = 0
+
+class FrameSession:
+    """State of one streaming connection."""
+
+    def __init__(self):
+        # (sequence number, encoded frame, receive time) of the newest unprocessed frame
+        self.latest = None
+        self.frame_ready = asyncio.Event()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.smoothed = None
+        self.probability_sum = None
+        self.class_counts: Dict[str, int] = {}
+        self.started_at = datetime.now()
+
+    def summary(self) -> dict:
+        return {
+            "frames_received": self.received,
+            "frames_processed": self.processed,
+            "frames_dropped": self.dropped,
+            "frames_failed": self.failed,
+            "duration_seconds": (datetime.now() - self.started_at).total_seconds(),
+            "class_counts": self.class_counts,
+        }
+
+@router.websocket("/stream")
+async def stream_frames(websocket: WebSocket, token: str, patient_id: Optional[str] = None):
+    """
+    Classify a live stream of encoded frames (binary messages, JPEG/PNG).
+    Each processed frame is answered with temporally smoothed probabilities; send
+    {"type": "end"} to finish and receive the session summary, which is the only
+    thing persisted to predictions.
+    """
+    global _stream_sessions
+    try:
+        current_user = await get_current_user(token)
+    except Exception:
+        await websocket.close(code=1008, reason="Could not validate credentials")
+        return
+    if patient_id is not None:
+        from app.routers.patients import doctor_patient_ids
+        db = get_database()
+        if db is None:
+            await websocket.close(code=1011, reason="Database connection unavailable")
+            return
+        if (current_user.role != "doctor" or not ObjectId.is_valid(patient_id)
+                or ObjectId(patient_id) not in await doctor_patient_ids(db, current_user.id)):
+            await websocket.close(code=1008, reason="Access denied for this patient")
+            return
+    model, class_names = ensure_model()
+    if model is None:
+        await websocket.close(code=1011, reason="Model not available")
+        return
+    if _stream_sessions >= STREAM_MAX_SESSIONS:
+        await websocket.close(code=1013, reason="Too many streaming sessions, retry later")
+        return
+
+    await websocket.accept()
+    _stream_sessions += 1
+    STREAM_SESSIONS.inc()
+    session = FrameSession()
+    ended = False
+
+    async def receive_frames():
+        nonlocal ended
+        sequence = 0
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if data is None:
+                try:
+                    ended = json.loads(message.get("text") or "{}").get("type") == "end"
+                except (ValueError, AttributeError):
+                    ended = False
+                if ended:
+                    return
+                continue
+            sequence += 1
+            session.received += 1
+            if len(data) > STREAM_MAX_FRAME_BYTES:
+                session.failed += 1
+                STREAM_FRAMES.inc("failed")
+                continue
+            if session.latest is not None:
+                session.dropped += 1
+                STREAM_FRAMES.inc("dropped")
+            session.latest = (sequence, data, perf_counter())
+            session.frame_ready.set()
+
+    async def process_frames():
+        import numpy as np
+        while True:
+            await session.frame_ready.wait()
+            session.frame_ready.clear()
+            if session.latest is None:
+                continue
+            sequence, data, received_at = session.latest
+            session.latest = None
+            try:
+                pixels = await asyncio.to_thread(decode_image, data)
+            except HTTPException as e:
+                session.failed += 1
+                STREAM_FRAMES.inc("failed")
+                await websocket.send_json({"type": "error", "frame": sequence, "detail": e.detail})
+                continue
+            try:
+                probabilities = await frame_batcher.submit(pixels)
+            except HTTPException as e:
+                # Admission refused the batch (server busy); later frames may get through
+                session.failed += 1
+                STREAM_FRAMES.inc("failed")
+                await websocket.send_json({"type": "error", "frame": sequence, "detail": e.detail})
+                continue
+            session.processed += 1
+            STREAM_FRAMES.inc("processed")
+
+            if session.smoothed is None:
+                session.smoothed = probabilities.copy()
+                session.probability_sum = probabilities.astype(np.float64)
+            else:
+                session.smoothed = STREAM_SMOOTHING * probabilities + (1 - STREAM_SMOOTHING) * session.smoothed
+                session.probability_sum += probabilities
+            raw_class = class_names[int(probabilities.argmax())]
+            session.class_counts[raw_class] = session.class_counts.get(raw_class, 0) + 1
+            top = int(session.smoothed.argmax())
+            await websocket.send_text(dumps({
+                "type": "prediction",
+                "frame": sequence,
+                "class": class_names[top],
+                "confidence": float(session.smoothed[top]),
+                "probabilities": dict(zip(class_names, session.smoothed.tolist())),
+                "frame_class": raw_class,
+                "latency_ms": (perf_counter() - received_at) * 1000.0,
+                "dropped": session.dropped,
+            }).decode())
+
+    receiver = asyncio.create_task(receive_frames())
+    processor = asyncio.create_task(process_frames())
+    try:
+        done, _ = await asyncio.wait({receiver, processor}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        receiver.cancel()
+        processor.cancel()
+        await asyncio.gather(receiver, processor, return_exceptions=True)
+        _stream_sessions -= 1
+        STREAM_SESSIONS.dec()
+
+    summary = session.summary()
+    prediction_id = None
+    db = get_database()
+    if db is not None and session.processed:
+        # One document for the whole session: the mean of the per-frame probabilities
+        doc = prediction_document(
+            session.probability_sum / session.processed, class_names, current_user.id,
+            f"stream-{session.started_at:%Y%m%d-%H%M%S}"
+        )
+        doc["source"] = "stream"
+        doc["stream"] = summary
+        if patient_id:
+            doc["patient_id"] = patient_id
+        try:
+            await db.predictions.insert_one(doc)
+            await bump_versions(db, current_user.id, patient_id)
+            prediction_id = str(doc["_id"])
+        except Exception as db_error:
+            print(f"⚠️  Failed to save stream summary to database: {db_error}")
+    failure = processor.exception() if processor in done and not processor.cancelled() else None
+    if failure is not None:
+        print(f"⚠️  Frame stream failed: {failure}")
+        try:
+            await websocket.send_json({"type": "error", "detail": "Inference failed, session closed",
+                                       "prediction_id": prediction_id})
+            await websocket.close(code=1011)
+        except Exception:
+            # The client may already be gone
+            pass
+    elif ended:
+        await websocket.send_text(dumps({"type": "summary", "prediction_id": prediction_id, **summary}).decode())
+        await websocket.close()
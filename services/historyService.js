@@ -33,9 +33,28 @@ const getPredictionDetails = async (predictionId) => {
   }
 };
 
+const reviewPrediction = async (predictionId, confirmedClass, notes) => {
+  try {
+    const user = authService.getCurrentUser();
+    const response = await axios.put(API_URL + `predictions/${predictionId}/review`, {
+      confirmed_class: confirmedClass,
+      ...(notes !== undefined ? { notes } : {})
+    }, {
+      headers: {
+        Authorization: `Bearer ${user.access_token}`
+      }
+    });
+    return response.data;
+  } catch (error) {
+    console.error('Failed to review prediction:', error);
+    throw error;
+  }
+};
+
 const historyService = {
   getPredictionHistory,
   getPredictionDetails,
+  reviewPrediction,
 };
 
 export default historyService;
\ No newline at end of file
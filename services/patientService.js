@@ -38,9 +38,26 @@ const getAnalytics = async () => {
   }
 };
 
+const searchPatients = async (query, cursor = null, limit = 10) => {
+  try {
+    const user = authService.getCurrentUser();
+    const response = await axios.get(API_URL + 'search', {
+      params: { q: query, limit, ...(cursor ? { cursor } : {}) },
+      headers: {
+        Authorization: `Bearer ${user.access_token}`
+      }
+    });
+    return response.data;
+  } catch (error) {
+    console.error('Failed to search patients:', error);
+    return { results: [], next_cursor: null };
+  }
+};
+
 const patientService = {
   getPatientRecords,
   getAnalytics,
+  searchPatients,
 };
 
 export default patientService;
\ No newline at end of file
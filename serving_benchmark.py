@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+from convert_h5_to_savedmodel import BATCH_BUCKETS
+
+
+def time_signature(fn, batch: np.ndarray, runs: int) -> dict:
+    inputs = tf.constant(batch)
+    fn(inputs)  # warm up: tracing / XLA compilation
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn(inputs)
+        # Force materialisation of the output
+        (list(result.values())[0] if isinstance(result, dict) else result).numpy()
+        timings.append((time.perf_counter() - t0) * 1000.0)
+    p50 = float(np.percentile(timings, 50))
+    return {
+        'p50_ms': p50,
+        'p90_ms': float(np.percentile(timings, 90)),
+        'throughput_images_per_sec': len(batch) * 1000.0 / p50 if p50 > 0 else 0.0,
+    }
+
+
+def benchmark(model_dir: str, runs: int = 50, img_size=(224, 224)) -> dict:
+    """
+    Compare the XLA-compiled serve_b<N> signatures with the dynamic-batch `serve`
+    signature for every bucket, on CPU.
+    """
+    loaded = tf.saved_model.load(model_dir)
+    signatures = loaded.signatures
+    baseline = signatures.get('serve') or signatures.get('serving_default')
+    if baseline is None:
+        raise ValueError(f"No serve signature in {model_dir}")
+
+    report = {}
+    for bucket in BATCH_BUCKETS:
+        batch = np.random.rand(bucket, *img_size, 3).astype(np.float32)
+        entry = {'serve': time_signature(baseline, batch, runs)}
+        name = f'serve_b{bucket}'
+        if name in signatures:
+            entry['xla'] = time_signature(signatures[name], batch, runs)
+            entry['speedup'] = entry['serve']['p50_ms'] / entry['xla']['p50_ms'] if entry['xla']['p50_ms'] else None
+        report[str(bucket)] = entry
+
+        line = f"batch {bucket:>2}: serve p50={entry['serve']['p50_ms']:.2f}ms"
+        if 'xla' in entry:
+            line += f"  xla p50={entry['xla']['p50_ms']:.2f}ms  speedup={entry['speedup']:.2f}x"
+        else:
+            line += "  (no XLA signature, re-export the model)"
+        print(line)
+    return report
+
+
+if __name__ == '__main__':
+    """
+    Usage:
+      python serving_benchmark.py [model_dir] [--runs 50] [--output serving_benchmark.json]
+    """
+    this_dir = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Latency/throughput per batch bucket, XLA vs default signature.")
+    parser.add_argument('model_dir', nargs='?', default=os.path.join(this_dir, 'model', 'image_model'))
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.model_dir):
+        print(f"❌ Model directory not found: {args.model_dir}")
+        sys.exit(1)
+
+    with tf.device('/CPU:0'):
+        result = benchmark(args.model_dir, runs=args.runs)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"✅ Report written to: {args.output}")
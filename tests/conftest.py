@@ -0,0 +1,47 @@
+"""
+Tests run against the in-process app on a mongomock database with the load-test stub model
+(pip install pytest mongomock-motor httpx). Run from the backend directory: python -m pytest app/tests
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+# The package is imported as `app`, so its parent directory must be importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault("SECRET_KEY", "test-secret")
+_scratch = tempfile.mkdtemp(prefix="afi-tests-")
+for _name in ("IMAGE_STORE_DIR", "ARCHIVE_DIR", "SIMILARITY_INDEX_DIR"):
+    os.environ.setdefault(_name, os.path.join(_scratch, _name.lower()))
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+
+
+@pytest.fixture
+def api():
+    """App on a fresh mongomock database with a stub model and one doctor; yields app, db and auth headers."""
+    from mongomock_motor import AsyncMongoMockClient
+    from app.main import app
+    from app.routers import prediction
+    from app.utils.auth import create_access_token
+    from app.utils.database import database
+    from app.utils.load_test import CLASS_NAMES, StubModel
+
+    client = AsyncMongoMockClient()
+    db = client["afi_test"]
+    previous = database.client, database.database, prediction._model, prediction._class_names
+    database.client, database.database = client, db
+    prediction._model, prediction._class_names = StubModel(1.0, len(CLASS_NAMES)), CLASS_NAMES
+    email = "test-doctor@example.com"
+    doctor = {"_id": ObjectId(), "email": email, "full_name": "Test Doctor", "role": "doctor",
+              "hashed_password": "", "created_at": datetime.now()}
+    asyncio.run(db.users.insert_one(doctor))
+    token = create_access_token({"sub": email}, expires_delta=timedelta(hours=1))
+    yield SimpleNamespace(
+        app=app, db=db, doctor=doctor, headers={"Authorization": f"Bearer {token}"},
+    )
+    database.client, database.database, prediction._model, prediction._class_names = previous
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.utils.admission import AdmissionController
+
+
+async def request(controller: AdmissionController, key: str, served: list, hold: asyncio.Event):
+    try:
+        async with controller.slot(key):
+            served.append(key)
+            await hold.wait()
+        return 200
+    except HTTPException as e:
+        return e.status_code
+
+
+def test_flooding_key_does_not_lock_out_other_keys():
+    async def scenario():
+        controller = AdmissionController("test", max_concurrency=1, max_queue=4, max_wait=5.0, max_queue_per_key=3)
+        hold = asyncio.Event()
+        served = []
+        burst = [asyncio.create_task(request(controller, "flood", served, hold)) for _ in range(8)]
+        # One running, three queued (the per-key cap), four rejected straight away
+        await asyncio.sleep(0.05)
+        rejected_early = sum(1 for t in burst if t.done() and t.result() == 429)
+        other = asyncio.create_task(request(controller, "other", served, hold))
+        await asyncio.sleep(0.05)
+        hold.set()
+        statuses = await asyncio.gather(*burst)
+        return rejected_early, statuses, await other, served
+
+    rejected_early, statuses, other_status, served = asyncio.run(scenario())
+    assert rejected_early == 4
+    assert other_status == 200
+    assert statuses.count(200) == 4
+    # Round-robin: the other key waits for one queued "flood" request, not for all of them
+    assert served == ["flood", "flood", "other", "flood", "flood"]
+
+
+def test_full_queue_rejects_the_busiest_key_first():
+    async def scenario():
+        controller = AdmissionController("test", max_concurrency=1, max_queue=3, max_wait=5.0, max_queue_per_key=3)
+        hold = asyncio.Event()
+        served = []
+        flood = [asyncio.create_task(request(controller, "flood", served, hold)) for _ in range(4)]
+        await asyncio.sleep(0.05)
+        # The queue is full of "flood" waiters; a new key still gets in by displacing the newest of them
+        other = asyncio.create_task(request(controller, "other", served, hold))
+        await asyncio.sleep(0.05)
+        displaced = flood[-1].done() and flood[-1].result() == 429
+        hold.set()
+        return displaced, await asyncio.gather(*flood), await other
+
+    displaced, flood_statuses, other_status = asyncio.run(scenario())
+    assert displaced
+    assert flood_statuses == [200, 200, 200, 429]
+    assert other_status == 200
+
+
+@pytest.mark.parametrize("interruption", [asyncio.TimeoutError, asyncio.CancelledError])
+def test_rejection_racing_the_end_of_a_wait_does_not_grant_a_slot(monkeypatch, interruption):
+    async def scenario():
+        controller = AdmissionController("test", max_concurrency=1, max_queue=1, max_wait=5.0)
+        hold = asyncio.Event()
+        served = []
+        running = asyncio.create_task(request(controller, "running", served, hold))
+        await asyncio.sleep(0)
+
+        async def interrupted_wait(waiter, timeout):
+            # The queued waiter is displaced in the same loop turn its wait ends
+            assert controller._make_room("other")
+            waiter.cancel()
+            raise interruption()
+
+        monkeypatch.setattr(asyncio, "wait_for", interrupted_wait)
+        queued = asyncio.create_task(request(controller, "flood", served, hold))
+        # A wrongly admitted request would hold its slot until `hold` is set
+        await asyncio.wait({queued}, timeout=1.0)
+        monkeypatch.undo()
+        in_flight_while_held = controller.in_flight
+        hold.set()
+        await running
+        await asyncio.gather(queued, return_exceptions=True)
+        return queued, in_flight_while_held, controller.in_flight, controller.queued, served
+
+    queued, in_flight_while_held, in_flight, waiting, served = asyncio.run(scenario())
+    if interruption is asyncio.TimeoutError:
+        assert queued.result() == 429
+    else:
+        assert queued.cancelled()
+    assert served == ["running"]
+    assert (in_flight_while_held, in_flight, waiting) == (1, 0, 0)
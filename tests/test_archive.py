@@ -0,0 +1,36 @@
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+
+
+def test_archived_prediction_restores_every_field(api):
+    from app.utils import archive
+
+    created = datetime(2020, 3, 14, 9, 30)
+    prediction_id = ObjectId()
+    doc = {
+        "_id": prediction_id, "doctor_id": str(api.doctor["_id"]), "patient_id": "patient-1",
+        "class_prediction": "normal", "confidence": 0.875, "probabilities": {"normal": 0.875, "abnormal": 0.125},
+        "image_filename": "scan.dcm", "created_at": created, "image_ref": "ab" * 32,
+        "study_uid": "1.2.3", "gestational_age_days": 140, "notes": "follow up",
+        "confirmed_class": "abnormal", "corrected": True, "reviewed_by": "reviewer", "reviewed_at": created,
+        "dicom": {"modality": "US", "source_ref": "cd" * 32},
+        "embedding": b"\x00\x01\x02\x03", "embedding_model": "0123456789ab",
+        "stream": {"frames": 12}, "backfill_key": "/scans:a/scan.dcm",
+    }
+    asyncio.run(api.db.predictions.insert_one(dict(doc)))
+
+    result = asyncio.run(archive.archive_predictions(api.db, cutoff=datetime(2021, 1, 1)))
+    assert result["archived"] == 1
+    assert asyncio.run(api.db.predictions.count_documents({})) == 0
+
+    # The id was generated now, the row is filed under 2020-03: found through the id index
+    restored = archive.find_archived(str(prediction_id), doctor_id=doc["doctor_id"], full=True)
+    assert ObjectId(restored.pop("id")) == prediction_id
+    expected = {k: v for k, v in doc.items() if k != "_id"}
+    assert restored == expected
+
+    assert archive.find_archived(str(prediction_id), doctor_id="someone-else") is None
+    assert archive.find_archived(str(prediction_id), patient_id="patient-2") is None
+    assert "dicom" not in archive.find_archived(str(prediction_id), patient_id="patient-1")
@@ -0,0 +1,17 @@
+import asyncio
+
+from app.utils.image_store import LocalBlobStore, content_key
+
+
+def test_concurrent_puts_of_the_same_blob_all_succeed(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data = b"scan-bytes" * 100_000
+    key = content_key(data)
+
+    async def scenario():
+        await asyncio.gather(*(store.put(key, data) for _ in range(8)))
+        return await store.read(key)
+
+    assert asyncio.run(scenario()) == data
+    # Only the blob itself is left behind, no temp files
+    assert [p.name for p in tmp_path.rglob("*") if p.is_file()] == [key]
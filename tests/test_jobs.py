@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from bson import ObjectId
+
+from app.routers import prediction
+from app.utils import jobs
+from app.utils.load_test import sample_png
+
+
+def parse_events(body: str):
+    return [json.loads(block.split("data: ", 1)[1]) for block in body.split("\n\n") if block.startswith("event: status")]
+
+
+def test_job_events_stream_through_to_done(api):
+    async def scenario():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30.0) as client:
+            response = await client.post(
+                "/api/prediction/jobs", headers=api.headers,
+                files=[("files", ("a.png", sample_png(), "image/png")), ("files", ("b.png", sample_png(), "image/png"))],
+            )
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+
+            # Subscribe while the job is still queued, then start the workers
+            stream = asyncio.create_task(client.get(f"/api/prediction/jobs/{job_id}/events", headers=api.headers))
+            await asyncio.sleep(0.2)
+            await prediction.start_job_workers()
+            try:
+                events = parse_events((await asyncio.wait_for(stream, 20.0)).text)
+            finally:
+                await prediction.stop_job_workers()
+            return events, await api.db.predictions.count_documents({})
+
+    events, saved = asyncio.run(scenario())
+    statuses = [event["status"] for event in events]
+    assert statuses[0] == jobs.QUEUED
+    assert jobs.RUNNING in statuses
+    assert statuses[-1] == jobs.DONE
+    final = events[-1]
+    assert final["processed"] == final["total"] == 2
+    assert all(ObjectId.is_valid(result["prediction_id"]) for result in final["results"])
+    assert saved == 2
+
+
+def test_in_memory_queue_hands_out_copies():
+    async def scenario():
+        queue = jobs.InMemoryJobQueue()
+        job_id = await queue.submit(jobs.new_job("doctor", [{"filename": "a.png", "image": b"x"}]))
+        before = await queue.get(job_id)
+        await queue.update(job_id, processed=1)
+        return before, await queue.get(job_id)
+
+    before, after = asyncio.run(scenario())
+    assert before["processed"] == 0 and after["processed"] == 1
+    assert after["updated_at"] > before["updated_at"]
+
+
+def test_in_memory_queue_caps_jobs_and_bytes():
+    async def scenario():
+        queue = jobs.InMemoryJobQueue(max_jobs=2, max_bytes=10)
+        first = await queue.submit(jobs.new_job("doctor", [{"filename": "a", "image": b"123456"}]))
+        with pytest.raises(RuntimeError):
+            await queue.submit(jobs.new_job("doctor", [{"filename": "b", "image": b"123456"}]))
+        await queue.update(first, status=jobs.DONE)
+        # The finished job no longer holds its image, so its bytes are free again
+        second = await queue.submit(jobs.new_job("doctor", [{"filename": "b", "image": b"123456"}]))
+        await queue.update(second, status=jobs.DONE)
+        # At the job cap the oldest finished job is evicted
+        third = await queue.submit(jobs.new_job("doctor", [{"filename": "c", "image": b"1"}]))
+        return first, second, third, queue
+
+    first, second, third, queue = asyncio.run(scenario())
+    assert asyncio.run(queue.get(first)) is None
+    assert asyncio.run(queue.get(second))["status"] == jobs.DONE
+    assert asyncio.run(queue.get(third))["status"] == jobs.QUEUED
@@ -0,0 +1,19 @@
+import argparse
+import asyncio
+
+from app.utils import load_test
+
+
+def test_stub_model_load_test_has_no_errors():
+    """The harness must measure the API, not fail on a missing TensorFlow install."""
+    args = argparse.Namespace(
+        backend="mongomock", mongo_url=None, database="afi_test_loadtest", base_url=None,
+        doctors=3, patients=20, predictions=200, chat_turns=20, days=30, skew=1.2, reseed=True,
+        rate=40.0, duration=1.0, scenarios=["predict_image", "history"], max_in_flight=64,
+        timeout=30.0, stub_latency_ms=1.0, seed=7,
+    )
+    report = asyncio.run(load_test.run(args))
+    for name in ("predict_image", "history"):
+        endpoint = report["endpoints"][name]
+        assert endpoint["requests"] > 0
+        assert endpoint["error_rate"] == 0.0, endpoint["status_counts"]
@@ -0,0 +1,17 @@
+import asyncio
+
+import httpx
+
+from app.utils.metrics import render_prometheus
+
+
+def test_request_metrics_are_labelled_with_the_mounted_route(api):
+    async def get():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/history/predictions/not-an-id", headers=api.headers)
+
+    asyncio.run(get())
+    exposition = render_prometheus()
+    assert 'route="/api/history/predictions/{prediction_id}"' in exposition
+    assert 'route="/history/predictions/{prediction_id}"' not in exposition
@@ -0,0 +1,27 @@
+import os
+
+from app.routers import prediction
+from app.utils.model_version import model_version
+
+
+def write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_retrained_weights_change_the_model_version(tmp_path, monkeypatch):
+    model_dir = str(tmp_path / "image_model")
+    monkeypatch.setattr(prediction, "model_path", model_dir)
+    assert prediction._saved_model_version() == "unversioned"
+
+    write(os.path.join(model_dir, "saved_model.pb"), b"graph")
+    write(os.path.join(model_dir, "variables", "variables.index"), b"index-1")
+    write(os.path.join(model_dir, "variables", "variables.data-00000-of-00001"), b"weights-1")
+    before = prediction._saved_model_version()
+    assert before == model_version(model_dir)
+
+    # Same graph, new weights: a different model for cached explanations and embeddings
+    write(os.path.join(model_dir, "variables", "variables.data-00000-of-00001"), b"weights-2")
+    assert prediction._saved_model_version() != before
+    assert prediction._saved_model_version() == model_version(model_dir)
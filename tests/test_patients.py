@@ -0,0 +1,33 @@
+import asyncio
+from datetime import datetime
+
+import httpx
+from bson import ObjectId
+
+
+def test_records_summarise_each_patient(api):
+    doctor_id = str(api.doctor["_id"])
+    patient = {"_id": ObjectId(), "email": "patient@example.com", "full_name": "Ann Patient", "role": "patient"}
+
+    async def scenario():
+        await api.db.users.insert_one(patient)
+        await api.db.predictions.insert_many([
+            {"doctor_id": doctor_id, "patient_id": str(patient["_id"]), "class_prediction": "normal",
+             "created_at": datetime(2024, 1, 1)},
+            {"doctor_id": doctor_id, "patient_id": str(patient["_id"]), "class_prediction": "abnormal",
+             "created_at": datetime(2024, 3, 1)},
+            {"doctor_id": doctor_id, "class_prediction": "normal", "created_at": datetime(2024, 2, 1)},
+            {"doctor_id": "someone-else", "patient_id": str(patient["_id"]), "class_prediction": "normal",
+             "created_at": datetime(2024, 4, 1)},
+        ])
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/patients/records", headers=api.headers)
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 200
+    records = [(r["id"], r["name"], r["total_analyses"], r["latest_result"]) for r in response.json()]
+    assert records == [
+        (str(patient["_id"]), "Ann Patient", 2, "abnormal"),
+        ("Anonymous", "Anonymous Patient", 1, "normal"),
+    ]
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from app.utils import auth, profiling
+
+
+def scope_with(token=None, profile=b"1"):
+    headers = [(b"x-profile", profile)]
+    if token is not None:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    return {"type": "http", "path": "/api/history/predictions", "headers": headers}
+
+
+def test_profile_header_needs_allow_header_and_an_admin_token(monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_EMAILS", {"ops@example.com"})
+    monkeypatch.setattr(profiling.config, "sample_rate", 0.0)
+    admin = auth.create_access_token({"sub": "ops@example.com"}, expires_delta=timedelta(minutes=5))
+    doctor = auth.create_access_token({"sub": "doctor@example.com"}, expires_delta=timedelta(minutes=5))
+
+    monkeypatch.setattr(profiling.config, "allow_header", False)
+    assert not profiling._should_profile(scope_with(admin))
+
+    monkeypatch.setattr(profiling.config, "allow_header", True)
+    assert profiling._should_profile(scope_with(admin))
+    assert not profiling._should_profile(scope_with(doctor))
+    assert not profiling._should_profile(scope_with())
+    assert not profiling._should_profile(scope_with("not-a-token"))
+    assert not profiling._should_profile(scope_with(admin, profile=b"0"))
@@ -0,0 +1,16 @@
+import asyncio
+
+import httpx
+
+
+def search(api, q):
+    async def get():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/patients/search", params={"q": q}, headers=api.headers)
+    return asyncio.run(get())
+
+
+def test_blank_search_text_is_rejected_rather_than_matching_everyone(api):
+    assert search(api, "   ").status_code == 422
+    assert search(api, "ann").status_code == 200
@@ -0,0 +1,18 @@
+from app.utils import startup_report
+
+# Heavy dependencies a chat-only node must not pay for at startup
+PREDICTION_ONLY = ("numpy", "PIL", "motor", "app.routers.prediction")
+
+
+def test_cold_start_is_within_budget():
+    total_ms, rows = startup_report.measure(runs=3)
+    assert rows
+    assert total_ms < startup_report.DEFAULT_BUDGET_MS
+
+
+def test_chat_only_node_skips_prediction_imports(monkeypatch):
+    monkeypatch.setenv("ENABLED_ROUTERS", "chat")
+    _, rows = startup_report.measure(runs=1)
+    imported = {name for name, _, _ in rows}
+    assert "app.routers.chat" in imported
+    assert not [name for name in imported if name.split(".")[0] in PREDICTION_ONLY or name in PREDICTION_ONLY]
@@ -0,0 +1,44 @@
+import asyncio
+import json
+from urllib.parse import urlencode
+
+import pytest
+from bson import ObjectId
+
+from app.routers import prediction
+from app.utils.stream_client import InProcessWebSocket, synthetic_frames
+
+
+def open_stream(api, **params):
+    token = api.headers["Authorization"].split(" ", 1)[1]
+    return InProcessWebSocket(api.app, "/api/prediction/stream", urlencode({"token": token, **params}))
+
+
+def test_stream_rejects_a_patient_of_another_doctor(api):
+    other_patient = str(ObjectId())
+    asyncio.run(api.db.predictions.insert_one({"doctor_id": "someone-else", "patient_id": other_patient}))
+
+    with pytest.raises(ConnectionError, match="1008"):
+        asyncio.run(open_stream(api, patient_id=other_patient).connect())
+
+
+def test_stream_reports_an_inference_failure_and_closes(api, monkeypatch):
+    def failing_batch(frames):
+        raise RuntimeError("inference crashed")
+
+    monkeypatch.setattr(prediction.frame_batcher, "run_batch", failing_batch)
+
+    async def scenario():
+        ws = await open_stream(api).connect()
+        try:
+            await ws.send(next(synthetic_frames(0)))
+            message = json.loads(await asyncio.wait_for(ws.recv(), 10.0))
+            closing = await asyncio.wait_for(ws._from_app.get(), 10.0)
+        finally:
+            await ws.close()
+            await prediction.frame_batcher.stop()
+        return message, closing
+
+    message, closing = asyncio.run(scenario())
+    assert message["type"] == "error"
+    assert closing == {"type": "websocket.close", "code": 1011, "reason": ""}
@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI, File, UploadFile
+
+from app.utils.uploads import UploadLimitMiddleware
+
+
+def limited_app(max_bytes: int):
+    app = FastAPI()
+    parsed = []
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        parsed.append(file.filename)
+        return {"size": len(await file.read())}
+
+    app.add_middleware(UploadLimitMiddleware, max_bytes=max_bytes)
+    return app, parsed
+
+
+def post(app, **kwargs):
+    async def send():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/upload", **kwargs)
+    return asyncio.run(send())
+
+
+def multipart(size: int):
+    boundary = "limit-test"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"scan.png\"\r\n"
+        f"Content-Type: image/png\r\n\r\n"
+    ).encode() + b"\0" * size + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def test_declared_length_over_limit_is_refused_before_parsing():
+    app, parsed = limited_app(4096)
+    body, headers = multipart(8192)
+    response = post(app, content=body, headers=headers)
+    assert response.status_code == 413
+    assert parsed == []
+
+
+def test_streamed_body_is_counted_against_the_limit():
+    app, parsed = limited_app(4096)
+    body, headers = multipart(8192)
+
+    async def chunks():
+        # No Content-Length: sent chunked
+        for start in range(0, len(body), 1024):
+            yield body[start:start + 1024]
+
+    response = post(app, content=chunks(), headers=headers)
+    assert response.status_code == 413
+    assert parsed == []
+
+    body, headers = multipart(1024)
+    response = post(app, content=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"size": 1024}
@@ -1,11 +1,16 @@
 import os
 import json
+import math
+import time
 from pathlib import Path
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
+from tensorflow.keras.layers import (
+    Conv2D, SeparableConv2D, MaxPooling2D, Flatten, GlobalAveragePooling2D, Dense, Dropout
+)
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from sklearn.metrics import classification_report, confusion_matrix
+from convert_h5_to_savedmodel import export_serving_model
 
 def prepare_data_generators(train_dir, img_size=(224, 224), batch_size=32):
     """
@@ -39,21 +44,178 @@ def prepare_data_generators(train_dir, img_size=(224, 224), batch_size=32):
 
     return train_generator, val_generator
 
-def build_model(input_shape=(224, 224, 3), num_classes=3):
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+def list_image_files(data_dir):
+    """
+    List (path, class_index) pairs and class names for a directory structured by class.
+    Classes and files are sorted so the listing is stable across runs.
+    """
+    class_names = sorted(
+        d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d))
+    )
+    files = []
+    for class_idx, class_name in enumerate(class_names):
+        class_dir = os.path.join(data_dir, class_name)
+        for root, _, names in sorted(os.walk(class_dir)):
+            for name in sorted(names):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append((os.path.join(root, name), class_idx))
+    return files, class_names
+
+def split_files(files, num_classes, validation_split=0.2):
+    """
+    Deterministic per-class train/validation split.
+    Like flow_from_directory, the first `validation_split` of each class goes to validation.
+    """
+    train_files, val_files = [], []
+    for class_idx in range(num_classes):
+        class_files = [f for f in files if f[1] == class_idx]
+        n_val = int(validation_split * len(class_files))
+        val_files.extend(class_files[:n_val])
+        train_files.extend(class_files[n_val:])
+    return train_files, val_files
+
+def random_affine_transforms(batch_size, height, width, rotation_range=20, shear_range=0.2, zoom_range=0.2):
+    """
+    Build one random projective transform per image, matching ImageDataGenerator's
+    rotation (degrees), shear (degrees) and per-axis zoom, centred on the image.
+    Returns a [batch, 8] tensor for ImageProjectiveTransformV3.
+    """
+    theta = tf.random.uniform([batch_size], -rotation_range, rotation_range) * (math.pi / 180.0)
+    shear = tf.random.uniform([batch_size], -shear_range, shear_range) * (math.pi / 180.0)
+    zx = tf.random.uniform([batch_size], 1.0 - zoom_range, 1.0 + zoom_range)
+    zy = tf.random.uniform([batch_size], 1.0 - zoom_range, 1.0 + zoom_range)
+
+    cos_t, sin_t = tf.cos(theta), tf.sin(theta)
+    # Linear part of rotation @ shear @ zoom, mapping output coords to input coords
+    a0 = cos_t * zx
+    a1 = (-sin_t * tf.cos(shear) - cos_t * tf.sin(shear)) * zy
+    b0 = sin_t * zx
+    b1 = (cos_t * tf.cos(shear) - sin_t * tf.sin(shear)) * zy
+
+    cx = (tf.cast(width, tf.float32) - 1.0) / 2.0
+    cy = (tf.cast(height, tf.float32) - 1.0) / 2.0
+    a2 = cx - a0 * cx - a1 * cy
+    b2 = cy - b0 * cx - b1 * cy
+    zeros = tf.zeros([batch_size])
+    return tf.stack([a0, a1, a2, b0, b1, b2, zeros, zeros], axis=1)
+
+def augment_batch(images, labels):
+    """Apply rotation, shear, zoom and horizontal flip to a whole batch at once."""
+    shape = tf.shape(images)
+    batch_size, height, width = shape[0], shape[1], shape[2]
+    images = tf.cast(images, tf.float32) / 255.0
+
+    flip = tf.random.uniform([batch_size, 1, 1, 1]) < 0.5
+    images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=random_affine_transforms(batch_size, height, width),
+        output_shape=tf.stack([height, width]),
+        fill_value=0.0,
+        interpolation='BILINEAR',
+        fill_mode='NEAREST'
+    )
+    return images, labels
+
+def rescale_batch(images, labels):
+    return tf.cast(images, tf.float32) / 255.0, labels
+
+def prepare_tf_datasets(train_dir, img_size=(224, 224), batch_size=32, validation_split=0.2,
+                        seed=123, cache_dir=None):
+    """
+    Create training and validation tf.data pipelines as an alternative to
+    prepare_data_generators. Decoding and resizing run in parallel, decoded uint8
+    images are cached (in memory, or on disk under cache_dir), augmentation is
+    applied per batch and batches are prefetched.
+    Returns (train_ds, val_ds, class_names, num_train, num_val).
+    """
+    files, class_names = list_image_files(train_dir)
+    num_classes = len(class_names)
+    train_files, val_files = split_files(files, num_classes, validation_split)
+
+    def load(path, label):
+        data = tf.io.read_file(path)
+        image = tf.io.decode_image(data, channels=3, expand_animations=False)
+        image = tf.image.resize(image, img_size)
+        image = tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8)
+        return image, tf.one_hot(label, num_classes)
+
+    def make_dataset(file_list, subset):
+        paths = [f[0] for f in file_list]
+        labels = [f[1] for f in file_list]
+        ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+        ds = ds.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            ds = ds.cache(os.path.join(cache_dir, subset))
+        else:
+            ds = ds.cache()
+        if subset == 'training':
+            ds = ds.shuffle(len(file_list), seed=seed, reshuffle_each_iteration=True)
+            ds = ds.batch(batch_size).map(augment_batch, num_parallel_calls=tf.data.AUTOTUNE)
+        else:
+            ds = ds.batch(batch_size).map(rescale_batch, num_parallel_calls=tf.data.AUTOTUNE)
+        return ds.prefetch(tf.data.AUTOTUNE)
+
+    train_ds = make_dataset(train_files, 'training')
+    val_ds = make_dataset(val_files, 'validation')
+    print(f"Found {len(train_files)} training and {len(val_files)} validation images "
+          f"belonging to {num_classes} classes (tf.data pipeline).")
+    return train_ds, val_ds, class_names, len(train_files), len(val_files)
+
+class ThroughputLogger(tf.keras.callbacks.Callback):
+    """Log training images per second at the end of every epoch."""
+
+    def __init__(self, images_per_epoch, pipeline):
+        super().__init__()
+        self.images_per_epoch = images_per_epoch
+        self.pipeline = pipeline
+        self._epoch_start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._epoch_start
+        rate = self.images_per_epoch / elapsed if elapsed > 0 else 0.0
+        print(f"📈 [{self.pipeline}] epoch {epoch + 1}: {self.images_per_epoch} images "
+              f"in {elapsed:.1f}s ({rate:.1f} images/sec)")
+        if logs is not None:
+            logs['images_per_sec'] = rate
+
+ARCHITECTURES = ('flatten', 'gap', 'separable')
+
+def build_model(input_shape=(224, 224, 3), num_classes=3, architecture='flatten', width_multiplier=1.0):
     """
     Build the same CNN architecture as used in the notebook.
+
+    architecture selects the variant:
+    - 'flatten': the notebook model, Flatten into Dense(128) (~11M parameters in that layer)
+    - 'gap': same convolutions with a GlobalAveragePooling head
+    - 'separable': depthwise-separable convolutions after the first layer, with a GAP head
+    width_multiplier scales the number of filters in every conv layer.
     """
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture: {architecture}. Choose from {ARCHITECTURES}")
+
+    def filters(n):
+        return max(8, int(n * width_multiplier))
+
+    conv = SeparableConv2D if architecture == 'separable' else Conv2D
     model = Sequential([
-        Conv2D(32, (3,3), activation='relu', input_shape=input_shape),
+        Conv2D(filters(32), (3,3), activation='relu', input_shape=input_shape),
         MaxPooling2D(2,2),
         
-        Conv2D(64, (3,3), activation='relu'),
+        conv(filters(64), (3,3), activation='relu'),
         MaxPooling2D(2,2),
         
-        Conv2D(128, (3,3), activation='relu'),
+        conv(filters(128), (3,3), activation='relu'),
         MaxPooling2D(2,2),
         
-        Flatten(),
+        Flatten() if architecture == 'flatten' else GlobalAveragePooling2D(),
         Dense(128, activation='relu'),
         Dropout(0.3),
         Dense(num_classes, activation='softmax')
@@ -67,21 +229,41 @@ def build_model(input_shape=(224, 224, 3), num_classes=3):
     
     return model
 
-def train_model(train_dir, model_dir=None, img_size=(224, 224), batch_size=32, epochs=25):
+def train_model(train_dir, model_dir=None, img_size=(224, 224), batch_size=32, epochs=25,
+                pipeline='generator', cache_dir=None, architecture='flatten', width_multiplier=1.0):
     """
     Train the CNN model using data from train_dir.
     Saves the model and class mapping to model_dir.
+    pipeline selects the input path: 'generator' (ImageDataGenerator), 'tf_data',
+    or 'shards' (train_dir is a shard directory built by build_dataset.py).
+    architecture and width_multiplier are passed to build_model.
     """
     if model_dir is None:
         model_dir = os.path.join(os.path.dirname(__file__), 'model', 'image_model')
 
-    # Prepare data generators
-    train_generator, val_generator = prepare_data_generators(
-        train_dir, img_size=img_size, batch_size=batch_size
-    )
+    if pipeline == 'tf_data':
+        train_data, val_data, class_names, num_train, _ = prepare_tf_datasets(
+            train_dir, img_size=img_size, batch_size=batch_size, cache_dir=cache_dir
+        )
+    elif pipeline == 'shards':
+        from build_dataset import prepare_shard_datasets
+        train_data, val_data, class_names, num_train, _ = prepare_shard_datasets(
+            train_dir, batch_size=batch_size
+        )
+    elif pipeline == 'generator':
+        # Prepare data generators
+        train_data, val_data = prepare_data_generators(
+            train_dir, img_size=img_size, batch_size=batch_size
+        )
+        class_indices = {v: k for k, v in train_data.class_indices.items()}
+        class_names = [class_indices[i] for i in range(len(class_indices))]
+        num_train = train_data.samples
+    else:
+        raise ValueError(f"Unknown input pipeline: {pipeline}")
 
     # Build and compile model
-    model = build_model(input_shape=img_size + (3,), num_classes=len(train_generator.class_indices))
+    model = build_model(input_shape=img_size + (3,), num_classes=len(class_names),
+                        architecture=architecture, width_multiplier=width_multiplier)
 
     # Ensure model directory exists
     os.makedirs(model_dir, exist_ok=True)
@@ -103,40 +285,71 @@ def train_model(train_dir, model_dir=None, img_size=(224, 224), batch_size=32, e
             save_best_only=True,
             save_weights_only=False,
             save_format='tf'
-        )
+        ),
+        ThroughputLogger(num_train, pipeline)
     ]
 
     # Train the model
+    fit_start = time.perf_counter()
     history = model.fit(
-        train_generator,
-        validation_data=val_generator,
+        train_data,
+        validation_data=val_data,
         epochs=epochs,
         callbacks=callbacks
     )
+    fit_seconds = time.perf_counter() - fit_start
 
     # Explicitly save the final model as SavedModel format
-    # This ensures the model is saved in the format expected by prediction.py
+    # This ensures the model is saved in the format expected by prediction.py,
+    # including the XLA-compiled serve_b<N> signatures for each batch bucket
     print(f"Saving final model to: {model_dir}")
-    model.save(model_dir, save_format='tf')
+    export_serving_model(model, model_dir)
     print(f"✅ Model saved successfully as SavedModel to: {model_dir}")
 
     # Save class mapping
-    class_indices = {v: k for k, v in train_generator.class_indices.items()}
-    class_names = [class_indices[i] for i in range(len(class_indices))]
-    
     labels_path = os.path.join(model_dir, 'labels.json')
     with open(labels_path, 'w') as f:
         json.dump(class_names, f)
     print(f"✅ Class labels saved to: {labels_path}")
     print(f"Class names: {class_names}")
+
+    # Record the cost of a full retrain so incremental fine-tuning can report time saved
+    with open(os.path.join(model_dir, 'training_meta.json'), 'w') as f:
+        json.dump({
+            'mode': 'full',
+            'num_train': num_train,
+            'epochs_run': len(history.history.get('loss', [])),
+            'fit_seconds': fit_seconds,
+            'pipeline': pipeline,
+            'architecture': architecture,
+            'width_multiplier': width_multiplier
+        }, f, indent=2)
     
     return model, class_names, history
 
 
 def test_on_images(model_dir, test_dir, img_size=(224, 224), batch_size=32):
-    """Load a saved model and evaluate it on an image test directory structured by class."""
+    """
+    Load a saved model and evaluate it on an image test directory structured by class,
+    or on a shard directory built by build_dataset.py.
+    """
     model = tf.keras.models.load_model(model_dir)
 
+    from build_dataset import is_shard_dir, ShardedDataset
+    if is_shard_dir(test_dir):
+        dataset = ShardedDataset(test_dir)
+        y_true = []
+        y_pred = []
+        for images, labels in dataset.iter_batches(dataset.entries, batch_size):
+            preds = model.predict(images.astype('float32') / 255.0, verbose=0)
+            y_true.extend(labels.tolist())
+            y_pred.extend(preds.argmax(axis=1).tolist())
+        print("Classification report:")
+        print(classification_report(y_true, y_pred, target_names=dataset.class_names))
+        print("Confusion matrix:")
+        print(confusion_matrix(y_true, y_pred))
+        return
+
     test_ds = tf.keras.utils.image_dataset_from_directory(
         test_dir,
         labels='inferred',
@@ -169,9 +382,21 @@ if __name__ == '__main__':
     # Place images under backend/ml/data/images/<class_name>/*.png (or jpg)
     base = os.path.join(os.path.dirname(__file__), 'data', 'images')
     model_output = os.path.join(os.path.dirname(__file__), 'model', 'image_model')
+    # Set TRAIN_PIPELINE=tf_data to use the parallel tf.data input pipeline,
+    # or TRAIN_PIPELINE=shards to read pre-decoded shards from data/shards
+    pipeline = os.getenv('TRAIN_PIPELINE', 'generator')
+    train_dir = base
+    # The test split stays in the image tree; a shard build of it (build_dataset.py data\images\test
+    # data\shards\test) is used instead when the shards pipeline is selected and one exists
+    test_dir = os.path.join(base, 'test')
+    if pipeline == 'shards':
+        from build_dataset import is_shard_dir
+        train_dir = os.path.join(os.path.dirname(__file__), 'data', 'shards')
+        shard_test_dir = os.path.join(train_dir, 'test')
+        if is_shard_dir(shard_test_dir):
+            test_dir = shard_test_dir
 
     # If a 'test' subfolder exists, we'll run training then test; otherwise only train.
-    train_model(base, model_dir=model_output, epochs=8)
-    test_dir = os.path.join(base, 'test')
+    train_model(train_dir, model_dir=model_output, epochs=8, pipeline=pipeline)
     if os.path.exists(test_dir):
         test_on_images(model_output, test_dir)
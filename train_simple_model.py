@@ -1,43 +1,30 @@
 import os
+import sys
 import json
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Flatten, Conv2D, MaxPooling2D, Dropout
+from train_model import build_model
+from convert_h5_to_savedmodel import export_serving_model
 
-def create_simple_model():
-    """Create a simple CNN model for AFI classification"""
-    model = Sequential([
-        Conv2D(32, (3, 3), activation='relu', input_shape=(224, 224, 3)),
-        MaxPooling2D(2, 2),
-        Conv2D(64, (3, 3), activation='relu'),
-        MaxPooling2D(2, 2),
-        Conv2D(128, (3, 3), activation='relu'),
-        MaxPooling2D(2, 2),
-        Flatten(),
-        Dense(128, activation='relu'),
-        Dropout(0.3),
-        Dense(3, activation='softmax')  # 3 classes: Normal, Low, High
-    ])
-    
-    model.compile(
-        optimizer='adam',
-        loss='categorical_crossentropy',
-        metrics=['accuracy']
+def create_simple_model(architecture='flatten', width_multiplier=1.0):
+    """Create a simple CNN model for AFI classification (3 classes: Normal, Low, High)"""
+    return build_model(
+        input_shape=(224, 224, 3),
+        num_classes=3,
+        architecture=architecture,
+        width_multiplier=width_multiplier
     )
-    
-    return model
 
-def save_model_and_labels():
+def save_model_and_labels(architecture='flatten', width_multiplier=1.0):
     """Create and save a simple model with labels"""
     model_dir = os.path.join(os.path.dirname(__file__), 'model', 'image_model')
     os.makedirs(model_dir, exist_ok=True)
     
     # Create model
-    model = create_simple_model()
+    model = create_simple_model(architecture, width_multiplier)
     
-    # Save as SavedModel format
-    model.save(model_dir, save_format='tf')
+    # Save as SavedModel format with the serving signatures the API expects
+    export_serving_model(model, model_dir)
     print(f"✅ Model saved to: {model_dir}")
     
     # Save labels
@@ -50,5 +37,8 @@ def save_model_and_labels():
     return model_dir
 
 if __name__ == '__main__':
-    save_model_and_labels()
+    # Optional: python train_simple_model.py [flatten|gap|separable] [width_multiplier]
+    architecture = sys.argv[1] if len(sys.argv) > 1 else 'flatten'
+    width_multiplier = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    save_model_and_labels(architecture, width_multiplier)
     print("🎉 Simple model created successfully!")
\ No newline at end of file
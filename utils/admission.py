@@ -0,0 +1,176 @@
+"""
+Admission control for expensive endpoints.
+
+An AdmissionController bounds how many requests run at once and how many may wait
+for a slot. Waiting requests are queued per key (the doctor's user id) and slots
+are handed out round-robin across keys, so one clinic's bulk upload only delays its
+own requests. A key may hold at most max_queue_per_key waiting requests, and when
+the whole queue is full the newest waiter of the key with the most waiters makes
+room for a key with fewer, so one burst cannot lock everyone else out. Requests
+beyond that, or waiting longer than max_wait, are rejected with 429 and a
+Retry-After estimated from recent service times.
+
+Usage:
+    async with prediction_admission.slot(current_user.id):
+        ...
+"""
+import asyncio
+import math
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import Deque, Dict, Optional
+from fastapi import HTTPException
+from app.utils.metrics import counter, gauge, histogram
+
+PREDICTION_MAX_CONCURRENCY = int(os.getenv("PREDICTION_MAX_CONCURRENCY", "2"))
+PREDICTION_MAX_QUEUE = int(os.getenv("PREDICTION_MAX_QUEUE", "32"))
+PREDICTION_MAX_QUEUE_PER_DOCTOR = int(os.getenv("PREDICTION_MAX_QUEUE_PER_DOCTOR", "8"))
+PREDICTION_MAX_WAIT_SECONDS = float(os.getenv("PREDICTION_MAX_WAIT_SECONDS", "10"))
+
+ADMISSION_TOTAL = counter(
+    "afi_admission_total", "Requests admitted or rejected by admission control", ("pool", "outcome")
+)
+ADMISSION_QUEUED = gauge("afi_admission_queued", "Requests waiting for an admission slot", ("pool",))
+ADMISSION_IN_FLIGHT = gauge("afi_admission_in_flight", "Requests holding an admission slot", ("pool",))
+ADMISSION_WAIT = histogram("afi_admission_wait_seconds", "Time spent waiting for an admission slot", ("pool",))
+
+
+def _granted(waiter: asyncio.Future) -> bool:
+    """Whether a finished waiter was handed a slot (rather than rejected)."""
+    return not waiter.cancelled() and waiter.exception() is None
+
+
+class AdmissionController:
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, max_wait: float,
+                 max_queue_per_key: Optional[int] = None):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_queue_per_key = self.max_queue if max_queue_per_key is None else max(0, max_queue_per_key)
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.queued = 0
+        # key -> waiters in arrival order; key order is the round-robin order
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        # Exponentially weighted average of slot hold time, for Retry-After
+        self._service_seconds = 1.0
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained."""
+        backlog = self.queued + self.in_flight
+        return max(1, math.ceil(self._service_seconds * backlog / self.max_concurrency))
+
+    def _rejection(self, reason: str) -> HTTPException:
+        ADMISSION_TOTAL.inc(self.name, "rejected")
+        return HTTPException(
+            status_code=429,
+            detail=f"Server busy ({reason}), retry later",
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    def _reject(self, reason: str):
+        raise self._rejection(reason)
+
+    def _make_room(self, key: str) -> bool:
+        """Reject the newest waiter of the busiest key if it has more waiters than `key`."""
+        busiest, waiters = max(self._waiters.items(), key=lambda item: len(item[1]))
+        if len(waiters) <= len(self._waiters.get(key, ())):
+            return False
+        waiter = waiters[-1]
+        self._remove_waiter(busiest, waiter)
+        waiter.set_exception(self._rejection("queue full"))
+        return True
+
+    def _remove_waiter(self, key: str, waiter: asyncio.Future):
+        waiters = self._waiters.get(key)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[key]
+            self.queued -= 1
+            ADMISSION_QUEUED.dec(self.name)
+
+    def _release(self):
+        """Hand the slot to the next waiter (round-robin across keys) or free it."""
+        while self._waiters:
+            key, waiters = next(iter(self._waiters.items()))
+            waiter = waiters.popleft()
+            self.queued -= 1
+            ADMISSION_QUEUED.dec(self.name)
+            if waiters:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if not waiter.done():
+                # The slot transfers directly, so in_flight is unchanged
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.dec(self.name)
+
+    async def _acquire(self, key: str):
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            ADMISSION_IN_FLIGHT.inc(self.name)
+            return
+        if len(self._waiters.get(key, ())) >= self.max_queue_per_key:
+            self._reject("too many queued requests for this account")
+        if self.queued >= self.max_queue and not (self._waiters and self._make_room(key)):
+            self._reject("queue full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(waiter)
+        self.queued += 1
+        ADMISSION_QUEUED.inc(self.name)
+        start = perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Granted or displaced by _make_room just as the wait ran out
+                if _granted(waiter):
+                    return
+                raise waiter.exception()
+            self._remove_waiter(key, waiter)
+            self._reject("queue wait exceeded")
+        except asyncio.CancelledError:
+            # Client went away; give the slot back if it was granted meanwhile
+            if not waiter.done():
+                self._remove_waiter(key, waiter)
+            elif _granted(waiter):
+                self._release()
+            raise
+        finally:
+            ADMISSION_WAIT.observe(perf_counter() - start, self.name)
+
+    @asynccontextmanager
+    async def slot(self, key: Optional[str] = None):
+        """Hold one slot for the body of the block; raises 429 if the request is not admitted."""
+        await self._acquire(key or "")
+        ADMISSION_TOTAL.inc(self.name, "admitted")
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * (perf_counter() - start)
+            self._release()
+
+    def as_dict(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_queue_per_key": self.max_queue_per_key,
+            "max_wait_seconds": self.max_wait,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "waiting_keys": len(self._waiters),
+            "retry_after": self.retry_after(),
+        }
+
+
+prediction_admission = AdmissionController(
+    "prediction", PREDICTION_MAX_CONCURRENCY, PREDICTION_MAX_QUEUE, PREDICTION_MAX_WAIT_SECONDS,
+    PREDICTION_MAX_QUEUE_PER_DOCTOR
+)
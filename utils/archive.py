@@ -0,0 +1,359 @@
+"""
+Cold archive for old predictions.
+
+Predictions older than PREDICTION_HOT_MONTHS are moved out of the `predictions`
+collection into compressed columnar NPZ files, partitioned by month and doctor:
+
+    ARCHIVE_DIR/predictions/<YYYY-MM>/<doctor_id>.npz
+
+Each file holds one array per PredictionHistory field (strings as fixed-width
+unicode, datetimes as datetime64[ms], probabilities as a float32 matrix over the
+file's `classes`). Every other document field (dicom metadata, embeddings, review
+details, ...) is kept per row as BSON in the `extra` member so documents restore in
+full. Files are written before the documents are deleted and merged by id on
+rewrite, so an interrupted run can simply be repeated.
+
+Lookups by id go to the month the ObjectId was generated in; rows filed under
+another month (backfilled scans keep their original created_at) are listed in
+ARCHIVE_DIR/prediction_index/<YYYY-MM>.json.
+
+Run on a schedule with ARCHIVE_INTERVAL_HOURS (on one API node) or from cron:
+
+    python -m app.utils.archive [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+import os
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import bson
+from bson import ObjectId
+
+PREDICTION_HOT_MONTHS = int(os.getenv("PREDICTION_HOT_MONTHS", "12"))
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", "90"))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "0"))
+ARCHIVE_DIR = os.getenv(
+    "ARCHIVE_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "ml", "data", "archive"))
+)
+ARCHIVE_CHUNK = 50_000
+# Loaded partitions kept in memory, keyed by path and mtime
+PARTITION_CACHE_ENTRIES = 64
+
+STRING_FIELDS = ("id", "doctor_id", "patient_id", "class_prediction", "image_filename",
+                 "notes", "confirmed_class", "image_ref", "study_uid")
+DATETIME_FIELDS = ("created_at", "reviewed_at")
+COLUMN_FIELDS = {"_id", *STRING_FIELDS, *DATETIME_FIELDS, "confidence", "gestational_age_days", "probabilities"}
+
+_partition_cache: "OrderedDict[Tuple[str, float], Dict]" = OrderedDict()
+
+
+def hot_cutoff(now: Optional[datetime] = None) -> Optional[datetime]:
+    """Start of the hot window, or None when archiving is disabled."""
+    if PREDICTION_HOT_MONTHS <= 0:
+        return None
+    now = now or datetime.now()
+    month = now.year * 12 + now.month - 1 - PREDICTION_HOT_MONTHS
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def _month_key(moment: datetime) -> str:
+    return f"{moment.year:04d}-{moment.month:02d}"
+
+
+def _months_between(start: datetime, end: datetime) -> List[str]:
+    months = []
+    index = start.year * 12 + start.month - 1
+    last = end.year * 12 + end.month - 1
+    while index <= last:
+        months.append(f"{index // 12:04d}-{index % 12 + 1:02d}")
+        index += 1
+    return months
+
+
+def partition_path(month: str, doctor_id: str) -> str:
+    return os.path.join(ARCHIVE_DIR, "predictions", month, f"{doctor_id}.npz")
+
+
+def _id_month(prediction_id: str) -> str:
+    return _month_key(ObjectId(prediction_id).generation_time.replace(tzinfo=None))
+
+
+def _index_path(id_month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, "prediction_index", f"{id_month}.json")
+
+
+# -------------------------
+# COLUMNAR ENCODING
+# -------------------------
+def encode(rows: List[Dict]) -> Dict:
+    import numpy as np
+    columns = {}
+    for field in STRING_FIELDS:
+        columns[field] = np.array([str(r.get(field) or "") for r in rows], dtype=str)
+    for field in DATETIME_FIELDS:
+        columns[field] = np.array([r.get(field) or "NaT" for r in rows], dtype="datetime64[ms]")
+    columns["confidence"] = np.array([r["confidence"] for r in rows], dtype=np.float32)
+    # -1 marks a missing gestational age
+    columns["gestational_age_days"] = np.array(
+        [r.get("gestational_age_days") if r.get("gestational_age_days") is not None else -1 for r in rows],
+        dtype=np.int16
+    )
+    classes = sorted({c for r in rows for c in r.get("probabilities", {})})
+    columns["classes"] = np.array(classes, dtype=str)
+    columns["probabilities"] = np.array(
+        [[r.get("probabilities", {}).get(c, np.nan) for c in classes] for r in rows], dtype=np.float32
+    ).reshape(len(rows), len(classes))
+    # Remaining fields as one BSON document per row, located by offsets
+    extras = [bson.encode({k: v for k, v in r.items() if k not in COLUMN_FIELDS}) for r in rows]
+    columns["extra"] = np.frombuffer(b"".join(extras), dtype=np.uint8)
+    columns["extra_offsets"] = np.cumsum([0] + [len(e) for e in extras], dtype=np.int64)
+    return columns
+
+
+def decode(columns: Dict, mask=None, full: bool = False) -> List[Dict]:
+    """
+    Rows for the selected entries of a partition: the PredictionHistory fields, plus
+    every other archived document field when full is set.
+    """
+    import numpy as np
+    indices = np.arange(len(columns["id"])) if mask is None else np.flatnonzero(mask)
+    classes = [str(c) for c in columns["classes"]]
+    rows = []
+    for i in indices:
+        # Partitions written before a field existed do not have its column
+        row = {field: (str(columns[field][i]) or None) if field in columns else None for field in STRING_FIELDS}
+        for field in DATETIME_FIELDS:
+            value = columns[field][i]
+            row[field] = None if np.isnat(value) else value.astype("datetime64[ms]").astype(datetime)
+        row["confidence"] = float(columns["confidence"][i])
+        age = int(columns["gestational_age_days"][i]) if "gestational_age_days" in columns else -1
+        row["gestational_age_days"] = age if age >= 0 else None
+        row["probabilities"] = {
+            c: float(p) for c, p in zip(classes, columns["probabilities"][i]) if not np.isnan(p)
+        }
+        if full and "extra" in columns:
+            start, end = columns["extra_offsets"][i], columns["extra_offsets"][i + 1]
+            row.update(bson.decode(columns["extra"][start:end].tobytes()))
+        rows.append(row)
+    return rows
+
+
+def load_partition(path: str) -> Optional[Dict]:
+    import numpy as np
+    try:
+        key = (path, os.path.getmtime(path))
+    except OSError:
+        return None
+    columns = _partition_cache.get(key)
+    if columns is None:
+        with np.load(path, allow_pickle=False) as data:
+            columns = {name: data[name] for name in data.files}
+        _partition_cache[key] = columns
+        while len(_partition_cache) > PARTITION_CACHE_ENTRIES:
+            _partition_cache.popitem(last=False)
+    _partition_cache.move_to_end(key)
+    return columns
+
+
+def write_partition(path: str, rows: List[Dict]) -> None:
+    """Merge rows into the partition (existing rows with the same id are replaced)."""
+    import numpy as np
+    existing = load_partition(path)
+    if existing is not None:
+        new_ids = {r["id"] for r in rows}
+        rows = [r for r in decode(existing, full=True) if r["id"] not in new_ids] + rows
+    rows.sort(key=lambda r: r["created_at"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, **encode(rows))
+    os.replace(tmp_path, path)
+
+
+def load_index(id_month: str) -> Dict[str, str]:
+    """Archive month of each id generated in id_month but filed under another month."""
+    try:
+        with open(_index_path(id_month)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_index(id_month: str, entries: Dict[str, str]) -> None:
+    path = _index_path(id_month)
+    index = {**load_index(id_month), **entries}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+# -------------------------
+# QUERIES
+# -------------------------
+def _partitions(months: Iterable[str], doctor_id: Optional[str]) -> List[str]:
+    paths = []
+    for month in months:
+        if doctor_id is not None:
+            paths.append(partition_path(month, doctor_id))
+            continue
+        month_dir = os.path.join(ARCHIVE_DIR, "predictions", month)
+        if os.path.isdir(month_dir):
+            paths.extend(os.path.join(month_dir, name) for name in sorted(os.listdir(month_dir)) if name.endswith(".npz"))
+    return paths
+
+
+def _archived_months() -> List[str]:
+    root = os.path.join(ARCHIVE_DIR, "predictions")
+    return sorted(os.listdir(root)) if os.path.isdir(root) else []
+
+
+def query_archive(start: Optional[datetime], end: Optional[datetime], doctor_id: Optional[str] = None,
+                  patient_id: Optional[str] = None) -> List[Dict]:
+    """Archived predictions in [start, end) for a doctor or a patient, newest first."""
+    import numpy as np
+    months = _archived_months()
+    if start is not None:
+        months = [m for m in months if m >= _month_key(start)]
+    if end is not None:
+        months = [m for m in months if m <= _month_key(end)]
+
+    rows = []
+    for path in _partitions(months, doctor_id):
+        columns = load_partition(path)
+        if columns is None:
+            continue
+        mask = np.ones(len(columns["id"]), dtype=bool)
+        if patient_id is not None:
+            mask &= columns["patient_id"] == patient_id
+        if start is not None:
+            mask &= columns["created_at"] >= np.datetime64(start, "ms")
+        if end is not None:
+            mask &= columns["created_at"] < np.datetime64(end, "ms")
+        rows.extend(decode(columns, mask))
+    rows.sort(key=lambda r: r["created_at"], reverse=True)
+    return rows
+
+
+def find_archived(prediction_id: str, doctor_id: Optional[str] = None, patient_id: Optional[str] = None,
+                  full: bool = False) -> Optional[Dict]:
+    """
+    One archived prediction by id, optionally only if it belongs to doctor_id or
+    patient_id. Reads the partitions of the month its ObjectId was generated in, or
+    the month recorded for it in the id index.
+    """
+    if not ObjectId.is_valid(prediction_id):
+        return None
+    id_month = _id_month(prediction_id)
+    month = load_index(id_month).get(prediction_id, id_month)
+    for path in _partitions([month], doctor_id):
+        columns = load_partition(path)
+        if columns is None:
+            continue
+        mask = columns["id"] == prediction_id
+        if patient_id is not None:
+            mask &= columns["patient_id"] == patient_id
+        if mask.any():
+            return decode(columns, mask, full)[0]
+    return None
+
+
+# -------------------------
+# ARCHIVAL JOB
+# -------------------------
+async def ensure_retention_indexes(db) -> None:
+    """TTL on chat turns (CHAT_RETENTION_DAYS, 0 keeps them forever) and the archival scan index."""
+    if CHAT_RETENTION_DAYS > 0:
+        # Turns stored before timestamps existed start their retention period now
+        await db.chat_history.update_many({"created_at": {"$exists": False}}, {"$set": {"created_at": datetime.now()}})
+        ttl = CHAT_RETENTION_DAYS * 86400
+        try:
+            await db.chat_history.create_index("created_at", expireAfterSeconds=ttl)
+        except Exception:
+            # Retention changed: update the existing TTL index in place
+            await db.command("collMod", "chat_history", index={"keyPattern": {"created_at": 1}, "expireAfterSeconds": ttl})
+    await db.predictions.create_index("created_at")
+
+
+async def archive_predictions(db, cutoff: Optional[datetime] = None, dry_run: bool = False) -> Dict:
+    """Move predictions created before cutoff (default: hot_cutoff()) into the archive."""
+    from app.utils.conditional import bump_versions
+
+    cutoff = cutoff or hot_cutoff()
+    if cutoff is None:
+        return {"archived": 0, "cutoff": None}
+    archived = 0
+    partitions = set()
+    while True:
+        docs = await db.predictions.find(
+            {"created_at": {"$lt": cutoff}}
+        ).sort("created_at", 1).limit(ARCHIVE_CHUNK).to_list(ARCHIVE_CHUNK)
+        if not docs:
+            break
+        if dry_run:
+            archived += await db.predictions.count_documents({"created_at": {"$lt": cutoff}})
+            break
+
+        groups: Dict[Tuple[str, str], List[Dict]] = defaultdict(list)
+        moved: Dict[str, Dict[str, str]] = defaultdict(dict)
+        for doc in docs:
+            doc["id"] = str(doc.pop("_id"))
+            month = _month_key(doc["created_at"])
+            groups[(month, doc["doctor_id"])].append(doc)
+            if month != _id_month(doc["id"]):
+                moved[_id_month(doc["id"])][doc["id"]] = month
+        for (month, doctor_id), rows in groups.items():
+            path = partition_path(month, doctor_id)
+            await asyncio.to_thread(write_partition, path, rows)
+            partitions.add(path)
+        for id_month, entries in moved.items():
+            await asyncio.to_thread(write_index, id_month, entries)
+
+        # Only delete once every row of the chunk is on disk
+        await db.predictions.delete_many({"_id": {"$in": [ObjectId(doc["id"]) for doc in docs]}})
+        await bump_versions(db, *{d["doctor_id"] for d in docs}, *{d.get("patient_id") for d in docs})
+        archived += len(docs)
+    return {"archived": archived, "cutoff": cutoff, "partitions_written": len(partitions), "dry_run": dry_run}
+
+
+async def run_scheduled(get_database) -> None:
+    """Background loop for ARCHIVE_INTERVAL_HOURS; enable on a single node."""
+    while True:
+        db = get_database()
+        if db is not None:
+            try:
+                await ensure_retention_indexes(db)
+                result = await archive_predictions(db)
+                if result["archived"]:
+                    print(f"🗄️  Archived {result['archived']} predictions older than {result['cutoff']:%Y-%m-%d}")
+            except Exception as e:
+                print(f"⚠️  Archival run failed: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply retention: chat TTL index and prediction archival.")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived")
+    parser.add_argument("--hot-months", type=int, default=None, help=f"Override PREDICTION_HOT_MONTHS ({PREDICTION_HOT_MONTHS})")
+    args = parser.parse_args()
+    if args.hot_months is not None:
+        PREDICTION_HOT_MONTHS = args.hot_months
+
+    async def main():
+        from app.utils.database import connect_to_mongo, close_mongo_connection, get_database
+        await connect_to_mongo()
+        db = get_database()
+        if db is None:
+            raise SystemExit(1)
+        if not args.dry_run:
+            await ensure_retention_indexes(db)
+        result = await archive_predictions(db, dry_run=args.dry_run)
+        await close_mongo_connection()
+        return result
+
+    result = asyncio.run(main())
+    verb = "Would archive" if args.dry_run else "Archived"
+    print(f"🗄️  {verb} {result['archived']} predictions (cutoff: {result['cutoff']}) into {ARCHIVE_DIR}")
@@ -7,6 +7,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from app.models.user import User, UserInDB
 from app.utils.database import get_database
+from app.utils.metrics import timed_stage
 import os
 from dotenv import load_dotenv
 
@@ -17,6 +18,8 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Comma-separated emails allowed to use operator endpoints (e.g. profiling)
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
 
 # Validate SECRET_KEY on startup
 if not SECRET_KEY:
@@ -61,7 +64,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
     
     db = get_database()
-    user_data = await db.users.find_one({"email": email})
+    with timed_stage("user_lookup"):
+        user_data = await db.users.find_one({"email": email})
     if user_data is None:
         raise credentials_exception
     
@@ -81,4 +85,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing user data: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+def is_admin_token(token: str) -> bool:
+    """Whether token is valid and issued to an ADMIN_EMAILS account, without a database lookup."""
+    try:
+        email = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return False
+    return bool(email) and email.lower() in ADMIN_EMAILS
+
+async def get_admin_user(current_user: UserInDB = Depends(get_current_user)):
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
\ No newline at end of file
@@ -0,0 +1,279 @@
+"""
+Offline backfill of archived scans.
+
+Walks a directory tree or a .zip/.tar(.gz) archive, decodes images and DICOM files in
+a process pool with the API's decode_scan (DICOM files in a directory are memory-mapped
+and only their sampled frames are read), runs batched inference through the API's
+ensure_model / predict_with_embeddings and writes prediction documents (with their
+embeddings for similar-case retrieval) with ordered insert_many batches. A cine loop becomes one prediction, aggregated over its sampled frames.
+
+Progress is checkpointed after every insert, so an interrupted run resumes where it
+stopped. Every document carries a `backfill_key` (source + relative path) with a
+unique index, so a batch that was inserted just before a crash is skipped, not
+duplicated.
+
+Usage:
+    python -m app.utils.backfill D:\\archive\\hospital_a --doctor-id <user id> [--workers 8]
+        [--batch-size 64] [--insert-batch 1000] [--store-images] [--checkpoint PATH]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# The prediction router pulls in app.utils.auth, which refuses to import without a key.
+# Nothing here issues or checks tokens.
+os.environ.setdefault("SECRET_KEY", "offline-backfill")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".dcm", ".dicom")
+REPORT_EVERY_SECONDS = 10.0
+
+# Per-process handle on the zip being read, opened on first use in each worker
+_zip_handles: Dict[str, zipfile.ZipFile] = {}
+
+
+def list_sources(source: str) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """
+    (relative path, bytes or None) for every image in sorted order. Directory and zip
+    entries are read by the workers (bytes is None); tar members can only be read
+    sequentially, so their bytes are read here.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.relpath(os.path.join(root, name), source), None
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield name, None
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise ValueError(f"{source} is not a directory, zip or tar archive")
+
+
+def _read(source: str, relpath: str) -> bytes:
+    if os.path.isdir(source):
+        with open(os.path.join(source, relpath), "rb") as f:
+            return f.read()
+    archive = _zip_handles.get(source)
+    if archive is None:
+        archive = _zip_handles[source] = zipfile.ZipFile(source)
+    return archive.read(relpath)
+
+
+def decode_item(source: str, relpath: str, data: Optional[bytes], keep_bytes: bool):
+    """
+    Worker: (relpath, decode_scan result or None, raw bytes or None, error or None).
+    The scan is (uint8 frames [n, 224, 224, 3], DICOM metadata or None, preview PNG or None).
+    """
+    from app.routers.prediction import decode_scan
+    try:
+        if data is None and os.path.isdir(source) and not keep_bytes:
+            # Decode straight from the file so DICOM pixel data is memory-mapped, not read whole
+            scan = decode_scan(os.path.join(source, relpath))
+        else:
+            data = data if data is not None else _read(source, relpath)
+            scan = decode_scan(data, preview=keep_bytes)
+    except Exception as e:
+        # HTTPException does not survive pickling back to the parent, so return text
+        return relpath, None, None, str(getattr(e, "detail", e))
+    return relpath, scan, data if keep_bytes else None, None
+
+
+def read_checkpoint(path: str) -> Dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_checkpoint(path: str, state: Dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+async def insert_ordered(collection, documents: List[Dict]) -> int:
+    """insert_many(ordered=True), skipping documents already written by an interrupted run."""
+    from pymongo.errors import BulkWriteError
+    inserted = 0
+    while documents:
+        try:
+            await collection.insert_many(documents, ordered=True)
+            return inserted + len(documents)
+        except BulkWriteError as e:
+            error = e.details["writeErrors"][0]
+            if error["code"] != 11000:
+                raise
+            inserted += e.details["nInserted"]
+            documents = documents[error["index"] + 1:]
+    return inserted
+
+
+async def backfill(source: str, doctor_id: str, checkpoint_path: str, workers: int, batch_size: int,
+                   insert_batch: int, store_images: bool, patient_id: Optional[str] = None) -> Dict:
+    import numpy as np
+    from app.routers import prediction
+    from app.utils.conditional import bump_versions
+    from app.utils.database import connect_to_mongo, close_mongo_connection, get_database
+    from app.utils.image_store import store_image
+
+    model, class_names = prediction.ensure_model()
+    if model is None:
+        raise RuntimeError(f"Model not available: {prediction._model_error}")
+    await connect_to_mongo()
+    db = get_database()
+    if db is None:
+        raise RuntimeError("Database connection unavailable")
+    await db.predictions.create_index(
+        "backfill_key", unique=True, partialFilterExpression={"backfill_key": {"$exists": True}}
+    )
+
+    source_id = os.path.abspath(source)
+    state = read_checkpoint(checkpoint_path)
+    if state.get("source") != source_id:
+        state = {"source": source_id, "done": 0, "inserted": 0, "failed": 0, "errors": []}
+    skip = state["done"]
+    if skip:
+        print(f"↩️  Resuming after {skip} images")
+
+    loop = asyncio.get_running_loop()
+    pending: List[Dict] = []
+    # Images handled since the last checkpoint, including ones that failed to decode
+    pending_items = 0
+    started = perf_counter()
+    last_report = started
+    timings = {"decode_wait": 0.0, "inference": 0.0, "db": 0.0}
+    processed = 0
+
+    async def flush():
+        nonlocal pending, pending_items
+        if pending:
+            t0 = perf_counter()
+            state["inserted"] += await insert_ordered(db.predictions, pending)
+            await bump_versions(db, doctor_id, patient_id)
+            timings["db"] += perf_counter() - t0
+        # Failed images count as done too, so a resume does not retry them forever
+        state["done"] += pending_items
+        state["updated_at"] = datetime.now().isoformat()
+        write_checkpoint(checkpoint_path, state)
+        pending = []
+        pending_items = 0
+
+    async def run_batch(decoded):
+        nonlocal processed, pending_items
+        ok = [d for d in decoded if d[3] is None]
+        for relpath, _, _, error in decoded:
+            if error is not None:
+                state["failed"] += 1
+                if len(state["errors"]) < 100:
+                    state["errors"].append({"path": relpath, "error": error})
+        if ok:
+            t0 = perf_counter()
+            # Cine loops contribute all their sampled frames to the same inference call
+            batch = prediction.scale_images(np.concatenate([scan[0] for _, scan, _, _ in ok]))
+            probabilities, embeddings = await loop.run_in_executor(None, prediction.predict_with_embeddings, model, batch)
+            timings["inference"] += perf_counter() - t0
+            offset = 0
+            for relpath, (frames, dicom_metadata, preview), data, _ in ok:
+                rows = slice(offset, offset + len(frames))
+                offset += len(frames)
+                doc = prediction.scan_document(
+                    probabilities[rows], class_names, doctor_id, os.path.basename(relpath), dicom_metadata,
+                    embeddings[rows] if embeddings is not None else None
+                )
+                doc["backfill_key"] = f"{source_id}:{relpath}"
+                doc["source"] = "backfill"
+                if patient_id:
+                    doc["patient_id"] = patient_id
+                if preview is not None:
+                    doc["image_ref"] = await store_image(preview)
+                    doc["dicom"]["source_ref"] = await store_image(data)
+                elif data is not None:
+                    doc["image_ref"] = await store_image(data)
+                pending.append(doc)
+        pending_items += len(decoded)
+        processed += len(decoded)
+        if len(pending) >= insert_batch:
+            await flush()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        items = (item for index, item in enumerate(list_sources(source)) if index >= skip)
+        in_flight = []
+        # Keep a few batches decoding ahead of inference so neither side waits
+        max_in_flight = batch_size * 4
+        exhausted = False
+        while not exhausted or in_flight:
+            while not exhausted and len(in_flight) < max_in_flight:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                    break
+                relpath, data = item
+                in_flight.append(loop.run_in_executor(pool, decode_item, source, relpath, data, store_images))
+            if not in_flight:
+                break
+            chunk, in_flight = in_flight[:batch_size], in_flight[batch_size:]
+            t0 = perf_counter()
+            decoded = await asyncio.gather(*chunk)
+            timings["decode_wait"] += perf_counter() - t0
+            await run_batch(decoded)
+
+            now = perf_counter()
+            if now - last_report >= REPORT_EVERY_SECONDS:
+                print(f"📈 {skip + processed} images, {processed / (now - started):.1f} images/s "
+                      f"(waiting on decode {timings['decode_wait']:.0f}s, inference {timings['inference']:.0f}s, "
+                      f"db {timings['db']:.0f}s)")
+                last_report = now
+        await flush()
+    await close_mongo_connection()
+
+    elapsed = perf_counter() - started
+    return {
+        **{k: state[k] for k in ("source", "done", "inserted", "failed")},
+        "processed_this_run": processed,
+        "seconds": elapsed,
+        "images_per_second": processed / elapsed if elapsed else 0.0,
+        "timings": timings,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify an archive of scans and store the predictions.")
+    parser.add_argument("source", help="Directory tree, .zip or .tar(.gz) archive of images and DICOM files")
+    parser.add_argument("--doctor-id", required=True, help="User id of the doctor the predictions belong to")
+    parser.add_argument("--patient-id", default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Decode processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Images per inference call")
+    parser.add_argument("--insert-batch", type=int, default=1000, help="Documents per insert_many")
+    parser.add_argument("--store-images", action="store_true", help="Also keep the scans in the image store")
+    parser.add_argument("--checkpoint", default=None, help="Progress file (default: <source>.backfill.json)")
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or os.path.abspath(args.source).rstrip("\\/") + ".backfill.json"
+    try:
+        summary = asyncio.run(backfill(
+            args.source, args.doctor_id, checkpoint, args.workers, args.batch_size,
+            args.insert_batch, args.store_images, args.patient_id
+        ))
+    except (RuntimeError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"✅ {summary['processed_this_run']} images in {summary['seconds']:.1f}s "
+          f"({summary['images_per_second']:.1f} images/s); {summary['inserted']} predictions stored, "
+          f"{summary['failed']} failed. Checkpoint: {checkpoint}")
@@ -0,0 +1,65 @@
+"""
+Micro-batching for blocking model calls.
+
+Callers await submit(item) concurrently; a background task gathers whatever has been
+submitted within `window` seconds (up to max_batch items), runs run_batch(items) once
+in a worker thread and hands each caller its own result. With `slot` (e.g. an
+admission controller's slot), every batch runs inside one; if the slot is refused,
+every caller in the batch gets the error.
+"""
+import asyncio
+from typing import Any, AsyncContextManager, Callable, List, Optional, Sequence
+
+
+class MicroBatcher:
+    def __init__(self, run_batch: Callable[[List[Any]], Sequence[Any]], max_batch: int, window: float,
+                 slot: Optional[Callable[[], AsyncContextManager]] = None):
+        self.run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.window = window
+        self.slot = slot
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, item):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), max(0.0, deadline - loop.time())))
+                except asyncio.TimeoutError:
+                    break
+            # Callers that gave up (cancelled) are skipped
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                if self.slot is None:
+                    results = await asyncio.to_thread(self.run_batch, [item for item, _ in batch])
+                else:
+                    async with self.slot():
+                        results = await asyncio.to_thread(self.run_batch, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
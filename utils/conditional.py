@@ -0,0 +1,95 @@
+"""
+Conditional GET for per-user listings.
+
+Every user has a change version in the `change_versions` collection, bumped by
+bump_versions() whenever a prediction is written for them (as doctor or patient).
+Listing endpoints derive ETag/Last-Modified from it: a matching If-None-Match or
+If-Modified-Since returns 304 after a single primary-key lookup, and rendered
+bodies are kept in a shared in-process LRU until the user's version moves on.
+Because the version lives in Mongo, several API processes stay consistent.
+"""
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import Request, Response
+from app.utils.metrics import counter, timed_stage
+from app.utils.serialization import dumps
+
+RESPONSE_CACHE_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", "512"))
+
+LISTING_RESPONSES = counter(
+    "afi_listing_responses_total", "Listing responses by cache outcome", ("listing", "outcome")
+)
+
+# (listing, user_id) -> (version, body)
+_cache: "OrderedDict[Tuple[str, str], Tuple[int, bytes]]" = OrderedDict()
+
+
+async def get_version(db, user_id: str) -> Tuple[int, Optional[datetime]]:
+    doc = await db.change_versions.find_one({"_id": user_id})
+    if doc is None:
+        return 0, None
+    return doc["version"], doc.get("modified_at")
+
+
+async def bump_versions(db, *user_ids: Optional[str]) -> None:
+    """Mark the listings of these users as changed. Call after writing their predictions."""
+    # UTC, second resolution: HTTP dates carry no more (Mongo returns it as naive UTC)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    for user_id in {u for u in user_ids if u and u != "Anonymous"}:
+        await db.change_versions.update_one(
+            {"_id": user_id}, {"$inc": {"version": 1}, "$set": {"modified_at": now}}, upsert=True
+        )
+
+
+def _not_modified(request: Request, etag: str, modified_at: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison: proxies that compress the body mark the tag W/
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and modified_at is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            return modified_at.replace(tzinfo=timezone.utc) <= since.astimezone(timezone.utc)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def cached_listing(request: Request, db, listing: str, user_id: str,
+                         build: Callable[[], Awaitable]) -> Response:
+    """
+    Serve `listing` for user_id with ETag/Last-Modified. build() runs the query and
+    returns the payload; it is only called when the cached body is stale or missing.
+    """
+    with timed_stage("version_lookup"):
+        version, modified_at = await get_version(db, user_id)
+    etag = f'"{user_id}.{version}"'
+    headers: Dict[str, str] = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if modified_at is not None:
+        headers["Last-Modified"] = format_datetime(modified_at.replace(tzinfo=timezone.utc), usegmt=True)
+
+    if _not_modified(request, etag, modified_at):
+        LISTING_RESPONSES.inc(listing, "not_modified")
+        return Response(status_code=304, headers=headers)
+
+    key = (listing, user_id)
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == version:
+        _cache.move_to_end(key)
+        LISTING_RESPONSES.inc(listing, "cache_hit")
+        return Response(cached[1], media_type="application/json", headers=headers)
+
+    payload = await build()
+    with timed_stage("serialize"):
+        body = dumps(payload)
+    _cache[key] = (version, body)
+    _cache.move_to_end(key)
+    while len(_cache) > RESPONSE_CACHE_ENTRIES:
+        _cache.popitem(last=False)
+    LISTING_RESPONSES.inc(listing, "rendered")
+    return Response(body, media_type="application/json", headers=headers)
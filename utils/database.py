@@ -1,42 +1,31 @@
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import ConnectionFailure
 import os
-import certifi
 from dotenv import load_dotenv
 
 # backend/app/utils/database.py
+# motor is imported when connecting, so importing this module (and every router
+# that depends on it) does not pay for the driver or open a client.
 
-import os
-from motor.motor_asyncio import AsyncIOMotorClient
+load_dotenv()
 
-# Load environment values
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DATABASE_NAME = os.getenv("DATABASE_NAME", "afi_health")
+class Database:
+    client = None
+    database = None
 
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DATABASE_NAME]
+database = Database()
 
 # Return db instance
 def get_db():
-    return db
+    return database.database
 
 # OPTIONAL: Create indexes for chatbot history
 async def create_indexes():
+    db = get_database()
     await db["chats"].create_index([("timestamp", -1)])
     await db["chats"].create_index("user_id")
 
-
-
-load_dotenv()
-
-class Database:
-    client: AsyncIOMotorClient = None
-    database = None
-
-database = Database()
-
 async def connect_to_mongo():
     try:
+        from motor.motor_asyncio import AsyncIOMotorClient
         mongo_url = os.getenv("MONGO_URL")
         database.client = AsyncIOMotorClient(
             mongo_url,
@@ -59,4 +48,3 @@ async def close_mongo_connection():
 
 def get_database():
     return database.database
-
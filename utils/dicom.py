@@ -0,0 +1,316 @@
+"""
+DICOM and multi-frame cine-loop reading (requires pydicom).
+
+Headers are parsed with pydicom without touching pixel data (stop_before_pixels).
+Native (uncompressed) pixel data is then viewed in place - np.memmap for files on
+disk, a zero-copy np.frombuffer view for uploads - so only the frames that are
+sampled are ever read and converted. Encapsulated JPEG / JPEG 2000 frames are split
+from the pixel data fragments and only the sampled ones are decoded with PIL; other
+compressed transfer syntaxes are decoded frame by frame by pydicom 3.
+
+Frames are sampled by stride or, by default, by a quality heuristic: the loop is cut
+into DICOM_MAX_FRAMES equal segments and the sharpest non-blank candidate of each
+segment is kept, so the sample prefers well-imaged frames but still covers the loop.
+"""
+from __future__ import annotations
+
+import io
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+from fastapi import HTTPException
+
+if TYPE_CHECKING:
+    import numpy as np
+
+DICOM_MAX_FRAMES = int(os.getenv("DICOM_MAX_FRAMES", "16"))
+DICOM_SAMPLING = os.getenv("DICOM_SAMPLING", "quality")  # quality | stride
+# Frames scored per frame kept when sampling by quality
+DICOM_QUALITY_CANDIDATES = int(os.getenv("DICOM_QUALITY_CANDIDATES", "4"))
+DICOM_EXTENSIONS = (".dcm", ".dicom")
+
+IMPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2"
+EXPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2.1"
+EXPLICIT_VR_BIG_ENDIAN = "1.2.840.10008.1.2.2"
+NATIVE_SYNTAXES = (IMPLICIT_VR_LITTLE_ENDIAN, EXPLICIT_VR_LITTLE_ENDIAN, EXPLICIT_VR_BIG_ENDIAN)
+# JPEG baseline, JPEG extended, JPEG 2000 (lossless and lossy): one PIL-readable codestream per frame
+PIL_SYNTAXES = ("1.2.840.10008.1.2.4.50", "1.2.840.10008.1.2.4.51",
+                "1.2.840.10008.1.2.4.90", "1.2.840.10008.1.2.4.91")
+UNDEFINED_LENGTH = 0xFFFFFFFF
+# A gestational age outside this range means the dates in the header are not usable
+MAX_GESTATIONAL_AGE_DAYS = 320
+
+
+def _invalid(detail: str):
+    raise HTTPException(status_code=400, detail=f"Failed to process DICOM: {detail}")
+
+
+def _unsupported(detail: str):
+    raise HTTPException(status_code=415, detail=f"Unsupported DICOM: {detail}")
+
+
+# -------------------------
+# HEADER
+# -------------------------
+def read_header(source) -> Tuple[object, int, bytes]:
+    """
+    Parse everything before the pixel data of a path, bytes or binary file-like object.
+    Returns the pydicom dataset, the offset of the pixel data element and the first
+    12 bytes of that element (tag, VR and length).
+    """
+    import pydicom
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return _read_header(pydicom, f)
+    stream = source if hasattr(source, "read") else io.BytesIO(source)
+    position = stream.tell()
+    try:
+        stream.seek(0)
+        return _read_header(pydicom, stream)
+    finally:
+        stream.seek(position)
+
+
+def _read_header(pydicom, f) -> Tuple[object, int, bytes]:
+    ds = pydicom.dcmread(f, stop_before_pixels=True)
+    # pydicom leaves the file positioned at the start of the pixel data element
+    offset = f.tell()
+    return ds, offset, f.read(12)
+
+
+def dimensions(source) -> Tuple[int, int, int]:
+    """(width, height, frames) from the header alone."""
+    ds, _, _ = read_header(source)
+    if "Rows" not in ds or "Columns" not in ds:
+        raise ValueError("DICOM header has no image dimensions")
+    return int(ds.Columns), int(ds.Rows), int(ds.get("NumberOfFrames", 1) or 1)
+
+
+def _parse_date(value) -> Optional[datetime]:
+    try:
+        return datetime.strptime(str(value).strip()[:8], "%Y%m%d") if value else None
+    except ValueError:
+        return None
+
+
+def gestational_age_days(ds) -> Optional[int]:
+    """Gestational age at acquisition from the last menstrual date, when the header carries one."""
+    lmp = _parse_date(ds.get("LastMenstrualDate"))
+    acquired = _parse_date(ds.get("AcquisitionDate") or ds.get("ContentDate") or ds.get("StudyDate"))
+    if lmp is None or acquired is None:
+        return None
+    days = (acquired - lmp).days
+    return days if 0 < days <= MAX_GESTATIONAL_AGE_DAYS else None
+
+
+def acquisition_metadata(ds) -> Dict:
+    """Identifiers and acquisition details stored with the prediction (absent tags are left out)."""
+    metadata = {
+        key: str(ds.get(keyword) or "")
+        for key, keyword in (("study_uid", "StudyInstanceUID"), ("series_uid", "SeriesInstanceUID"),
+                             ("sop_instance_uid", "SOPInstanceUID"), ("modality", "Modality"),
+                             ("manufacturer", "Manufacturer"))
+    }
+    metadata.update({
+        "study_date": _parse_date(ds.get("StudyDate")),
+        "number_of_frames": int(ds.get("NumberOfFrames", 1) or 1),
+        "frame_time_ms": float(ds.FrameTime) if ds.get("FrameTime") else None,
+        "gestational_age_days": gestational_age_days(ds),
+    })
+    return {k: v for k, v in metadata.items() if v not in (None, "")}
+
+
+# -------------------------
+# FRAMES
+# -------------------------
+def _encapsulated_frames(value: bytes, number_of_frames: int) -> List[bytes]:
+    try:
+        from pydicom.encaps import generate_frames  # pydicom >= 3
+        return list(generate_frames(value, number_of_frames=number_of_frames))
+    except ImportError:
+        from pydicom.encaps import generate_pixel_data_frame
+        return list(generate_pixel_data_frame(value, number_of_frames))
+
+
+def _ybr_to_rgb(ybr: np.ndarray) -> np.ndarray:
+    import numpy as np
+    y = ybr[..., 0].astype(np.float32)
+    cb = ybr[..., 1].astype(np.float32) - 128.0
+    cr = ybr[..., 2].astype(np.float32) - 128.0
+    rgb = np.stack([y + 1.402 * cr, y - 0.344136 * cb - 0.714136 * cr, y + 1.772 * cb], axis=-1)
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def _frame_reader(source, ds, offset: int, element_header: bytes) -> Callable[[int], np.ndarray]:
+    """Function returning frame i as stored (before any intensity or colour conversion)."""
+    import numpy as np
+    syntax = str(ds.file_meta.get("TransferSyntaxUID", IMPLICIT_VR_LITTLE_ENDIAN))
+    frames = int(ds.get("NumberOfFrames", 1) or 1)
+    rows, columns = int(ds.Rows), int(ds.Columns)
+    samples = int(ds.get("SamplesPerPixel", 1))
+    is_path = isinstance(source, (str, os.PathLike))
+
+    if syntax in NATIVE_SYNTAXES or syntax in PIL_SYNTAXES:
+        little = syntax != EXPLICIT_VR_BIG_ENDIAN
+        byteorder = "little" if little else "big"
+        if element_header[:4] != (b"\xe0\x7f\x10\x00" if little else b"\x7f\xe0\x00\x10"):
+            _invalid("no pixel data")
+        if syntax == IMPLICIT_VR_LITTLE_ENDIAN:
+            length, value_offset = int.from_bytes(element_header[4:8], byteorder), offset + 8
+        else:
+            length, value_offset = int.from_bytes(element_header[8:12], byteorder), offset + 12
+        data = None if is_path else (source.getbuffer() if hasattr(source, "getbuffer") else memoryview(source))
+        total = os.path.getsize(source) if is_path else len(data)
+
+        if syntax in NATIVE_SYNTAXES:
+            bits = int(ds.BitsAllocated)
+            if bits not in (8, 16, 32):
+                _unsupported(f"{bits} bits allocated")
+            signed = int(ds.get("PixelRepresentation", 0)) == 1
+            dtype = np.dtype(f"{'<' if little else '>'}{'i' if signed else 'u'}{bits // 8}")
+            count = frames * rows * columns * samples
+            if length == UNDEFINED_LENGTH or value_offset + count * dtype.itemsize > total:
+                _invalid("pixel data is truncated")
+            if is_path:
+                pixels = np.memmap(source, dtype=dtype, mode="r", offset=value_offset, shape=(count,))
+            else:
+                pixels = np.frombuffer(data, dtype=dtype, count=count, offset=value_offset)
+            planar = samples > 1 and int(ds.get("PlanarConfiguration", 0)) == 1
+            if planar:
+                pixels = pixels.reshape(frames, samples, rows, columns)
+                return lambda i: np.moveaxis(pixels[i], 0, -1)
+            pixels = pixels.reshape(frames, rows, columns, samples)
+            return lambda i: pixels[i]
+
+        if length != UNDEFINED_LENGTH:
+            _invalid("compressed pixel data must be encapsulated")
+        if is_path:
+            with open(source, "rb") as f:
+                f.seek(value_offset)
+                value = f.read()
+        else:
+            value = bytes(data[value_offset:])
+        encoded = _encapsulated_frames(value, frames)
+        if len(encoded) < frames:
+            _invalid(f"expected {frames} frames, found {len(encoded)}")
+
+        def read_encoded(i: int) -> np.ndarray:
+            from PIL import Image
+            with Image.open(io.BytesIO(encoded[i])) as img:
+                return np.asarray(img)
+        return read_encoded
+
+    try:
+        from pydicom.pixels import pixel_array
+    except ImportError:
+        _unsupported(f"transfer syntax {syntax} needs pydicom 3 to decode")
+    target = source if is_path else io.BytesIO(source.getbuffer() if hasattr(source, "getbuffer") else source)
+    return lambda i: pixel_array(target, index=i)
+
+
+def _to_rgb8(frame: np.ndarray, photometric: str, convert_ybr: bool) -> np.ndarray:
+    """8-bit RGB [rows, columns, 3] for display and the model."""
+    import numpy as np
+    if frame.dtype != np.uint8:
+        # Deeper data is stretched per frame; ultrasound is almost always 8-bit already
+        frame = frame.astype(np.float32)
+        low, high = float(frame.min()), float(frame.max())
+        scale = 255.0 / (high - low) if high > low else 0.0
+        frame = ((frame - low) * scale).astype(np.uint8)
+    if frame.ndim == 3 and frame.shape[-1] == 1:
+        frame = frame[..., 0]
+    if frame.ndim == 2:
+        if photometric == "MONOCHROME1":
+            frame = 255 - frame
+        return np.repeat(frame[..., np.newaxis], 3, axis=-1)
+    if convert_ybr and photometric == "YBR_FULL":
+        return _ybr_to_rgb(frame)
+    return frame
+
+
+def frame_quality(rgb: np.ndarray) -> float:
+    """Sharpness (variance of the Laplacian) of a downsampled frame; 0 for near-black frames."""
+    import numpy as np
+    gray = rgb[::4, ::4].mean(axis=-1, dtype=np.float32)
+    if gray.mean() < 8.0:
+        # Probe lifted off the patient, or a blank frame between sweeps
+        return 0.0
+    laplacian = (4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:])
+    return float(laplacian.var())
+
+
+def _stride(frames: int, count: int) -> List[int]:
+    if frames <= count:
+        return list(range(frames))
+    return sorted({int(i * frames / count) for i in range(count)})
+
+
+def sample_frames(frames: int, read: Callable[[int], np.ndarray], max_frames: int,
+                  sampling: str) -> Tuple[List[int], Dict[int, np.ndarray], Dict[int, float]]:
+    """Selected frame indices, the frames decoded along the way and their quality scores."""
+    if sampling == "stride" or frames <= max_frames:
+        indices = _stride(frames, max_frames)
+        return indices, {i: read(i) for i in indices}, {}
+
+    candidates = _stride(frames, max_frames * max(1, DICOM_QUALITY_CANDIDATES))
+    decoded = {i: read(i) for i in candidates}
+    scores = {i: frame_quality(frame) for i, frame in decoded.items()}
+    selected = []
+    for segment in range(max_frames):
+        start, end = segment * frames / max_frames, (segment + 1) * frames / max_frames
+        in_segment = [i for i in candidates if start <= i < end]
+        if in_segment:
+            selected.append(max(in_segment, key=lambda i: scores[i]))
+    return selected, {i: decoded[i] for i in selected}, scores
+
+
+def load_frames(source, max_frames: int = DICOM_MAX_FRAMES, sampling: str = DICOM_SAMPLING,
+                preview: bool = False) -> Tuple[np.ndarray, Dict, Optional[bytes]]:
+    """
+    Sampled frames of a DICOM (path, bytes or BytesIO) as uint8 [n, 224, 224, 3], its
+    acquisition metadata plus the sampled frame indices, and optionally a full-resolution
+    PNG of the best sampled frame for viewing.
+    """
+    import numpy as np
+    from PIL import Image
+    try:
+        ds, offset, element_header = read_header(source)
+    except HTTPException:
+        raise
+    except Exception as e:
+        _invalid(str(e))
+    if "Rows" not in ds or "Columns" not in ds:
+        _invalid("no image dimensions in header")
+
+    syntax = str(ds.file_meta.get("TransferSyntaxUID", IMPLICIT_VR_LITTLE_ENDIAN))
+    photometric = str(ds.get("PhotometricInterpretation", "MONOCHROME2"))
+    if syntax in NATIVE_SYNTAXES and photometric not in ("MONOCHROME1", "MONOCHROME2", "RGB", "YBR_FULL"):
+        _unsupported(f"photometric interpretation {photometric}")
+    frames = int(ds.get("NumberOfFrames", 1) or 1)
+    read = _frame_reader(source, ds, offset, element_header)
+
+    def read_rgb(i: int) -> np.ndarray:
+        return _to_rgb8(read(i), photometric, convert_ybr=syntax in NATIVE_SYNTAXES)
+
+    try:
+        indices, decoded, scores = sample_frames(frames, read_rgb, max(1, max_frames), sampling)
+        batch = np.stack([
+            np.asarray(Image.fromarray(decoded[i]).resize((224, 224)), dtype=np.uint8) for i in indices
+        ])
+    except HTTPException:
+        raise
+    except Exception as e:
+        _invalid(f"could not decode frames: {e}")
+
+    metadata = acquisition_metadata(ds)
+    metadata["sampled_frames"] = indices
+    metadata["sampling"] = "all" if len(indices) == frames else ("quality" if scores else "stride")
+
+    preview_png = None
+    if preview:
+        best = max(indices, key=lambda i: scores.get(i, 0.0)) if scores else indices[len(indices) // 2]
+        out = io.BytesIO()
+        Image.fromarray(decoded[best]).save(out, format="PNG")
+        preview_png = out.getvalue()
+        metadata["preview_frame"] = best
+    return batch, metadata, preview_png
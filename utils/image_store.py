@@ -0,0 +1,222 @@
+"""
+Content-addressed image storage.
+
+Uploaded scans are stored once under their SHA-256 digest (the prediction's
+`image_ref`), so identical uploads are deduplicated. Thumbnails are generated on
+first request and stored alongside the originals under a derived key.
+
+Backends (IMAGE_STORE_BACKEND):
+- local: files under IMAGE_STORE_DIR/<aa>/<bb>/<digest>
+- gridfs: a GridFS bucket (`images`) in the application database, with a unique
+  index on filename so racing uploads of the same digest keep a single copy
+"""
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from typing import Callable, Optional, Tuple
+
+IMAGE_STORE_BACKEND = os.getenv("IMAGE_STORE_BACKEND", "local")
+IMAGE_STORE_DIR = os.getenv(
+    "IMAGE_STORE_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "ml", "data", "image_store"))
+)
+THUMBNAIL_SIZES = (128, 256, 512)
+DEFAULT_THUMBNAIL_SIZE = 256
+
+def content_key(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def thumbnail_key(image_ref: str, size: int) -> str:
+    return f"{image_ref}.t{size}"
+
+class BlobStore:
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def put(self, key: str, data) -> None:
+        raise NotImplementedError
+
+    async def size(self, key: str) -> Optional[int]:
+        """Size in bytes, or None if the blob does not exist."""
+        raise NotImplementedError
+
+    async def read(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        """Bytes [start, end] inclusive (whole blob by default)."""
+        raise NotImplementedError
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    async def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    async def put(self, key, data):
+        path = self.path(key)
+
+        def write():
+            if os.path.isfile(path):
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write a private temp file then rename, so concurrent readers never see a
+            # partial blob and concurrent writers of the same key never share a file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{key}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                try:
+                    os.replace(tmp_path, path)
+                except OSError:
+                    # Keys are content hashes: another writer already stored the same bytes
+                    if not os.path.isfile(path):
+                        raise
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        await asyncio.to_thread(write)
+
+    async def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except OSError:
+            return None
+
+    async def read(self, key, start=0, end=None):
+        def read_range():
+            with open(self.path(key), "rb") as f:
+                f.seek(start)
+                return f.read() if end is None else f.read(end - start + 1)
+        return await asyncio.to_thread(read_range)
+
+class GridFSBlobStore(BlobStore):
+    bucket_name = "images"
+
+    def __init__(self, get_database: Callable):
+        self._get_database = get_database
+        self._bucket = None
+        self._indexed = False
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+            db = self._get_database()
+            if db is None:
+                raise RuntimeError("Database connection unavailable")
+            self._bucket = AsyncIOMotorGridFSBucket(db, bucket_name=self.bucket_name)
+        return self._bucket
+
+    async def _find(self, key):
+        cursor = self.bucket.find({"filename": key}, limit=1)
+        async for grid_file in cursor:
+            return grid_file
+        return None
+
+    async def exists(self, key):
+        return await self._find(key) is not None
+
+    async def _ensure_index(self):
+        if self._indexed:
+            return
+        from pymongo.errors import OperationFailure
+        try:
+            await self._get_database()[f"{self.bucket_name}.files"].create_index("filename", unique=True)
+        except OperationFailure as e:
+            # Duplicates stored before the index existed; dedup stays best effort until they are removed
+            print(f"⚠️  Could not create unique index on {self.bucket_name}.files.filename: {e}")
+        self._indexed = True
+
+    async def put(self, key, data):
+        from bson import ObjectId
+        from gridfs.errors import NoFile
+        from pymongo.errors import DuplicateKeyError
+        await self._ensure_index()
+        file_id = ObjectId()
+        try:
+            # The files document is inserted last, so a racing upload of the same key fails here
+            await self.bucket.upload_from_stream_with_id(file_id, key, bytes(data))
+        except DuplicateKeyError:
+            try:
+                # Drop this upload's orphaned chunks; the stored copy is identical
+                await self.bucket.delete(file_id)
+            except NoFile:
+                pass
+
+    async def size(self, key):
+        grid_file = await self._find(key)
+        return grid_file.length if grid_file else None
+
+    async def read(self, key, start=0, end=None):
+        stream = await self.bucket.open_download_stream_by_name(key)
+        stream.seek(start)
+        return await (stream.read() if end is None else stream.read(end - start + 1))
+
+_store: Optional[BlobStore] = None
+
+def get_image_store() -> BlobStore:
+    global _store
+    if _store is None:
+        if IMAGE_STORE_BACKEND == "gridfs":
+            from app.utils.database import get_database
+            _store = GridFSBlobStore(get_database)
+        elif IMAGE_STORE_BACKEND == "local":
+            _store = LocalBlobStore(IMAGE_STORE_DIR)
+        else:
+            raise RuntimeError(f"Unknown IMAGE_STORE_BACKEND: {IMAGE_STORE_BACKEND}")
+    return _store
+
+async def store_image(data) -> str:
+    """Store image bytes under their content hash (skipping duplicates) and return the image_ref."""
+    store = get_image_store()
+    key = content_key(data)
+    if not await store.exists(key):
+        await store.put(key, data)
+    return key
+
+def _make_thumbnail(data: bytes, size: int) -> bytes:
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as img:
+        # draft() lets the JPEG decoder downscale while decoding
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+        img.thumbnail((size, size))
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=80, optimize=True)
+        return out.getvalue()
+
+async def ensure_thumbnail(image_ref: str, size: int = DEFAULT_THUMBNAIL_SIZE) -> str:
+    """Key of the thumbnail for image_ref, generating and storing it on first use."""
+    store = get_image_store()
+    key = thumbnail_key(image_ref, size)
+    if not await store.exists(key):
+        original = await store.read(image_ref)
+        await store.put(key, await asyncio.to_thread(_make_thumbnail, original, size))
+    return key
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into inclusive (start, end).
+    Returns None when there is no usable Range header; raises ValueError if unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            # Suffix range: last N bytes
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError("empty suffix range")
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise ValueError("malformed range")
+    if start >= size or end < start:
+        raise ValueError("unsatisfiable range")
+    return start, min(end, size - 1)
@@ -0,0 +1,307 @@
+"""
+Asynchronous prediction jobs.
+
+A job holds one or more uploaded images. Clients submit a job and get its id back
+immediately; workers claim queued jobs in batches, run them through a processor
+callable and record per-image results. Two queue backends are available:
+
+- InMemoryJobQueue: single process, jobs are lost on restart. Holds at most
+  JOB_MEMORY_MAX_JOBS jobs (finished ones are evicted oldest first) and
+  JOB_MEMORY_MAX_BYTES of unprocessed images.
+- MongoJobQueue: jobs live in the `prediction_jobs` collection, so they survive
+  restarts and any number of inference nodes can drain the same queue. A running
+  job whose lease expires (worker crashed) is picked up again; workers renew the
+  lease while they are still processing.
+
+Select with JOB_QUEUE_BACKEND=memory|mongo.
+"""
+import asyncio
+import copy
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from bson import ObjectId
+from app.utils.metrics import counter, gauge
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "8"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Job documents carry the image bytes, so stay below Mongo's 16 MB document limit
+MAX_JOB_BYTES = 15 * 1024 * 1024
+JOB_MEMORY_MAX_JOBS = int(os.getenv("JOB_MEMORY_MAX_JOBS", "1000"))
+JOB_MEMORY_MAX_BYTES = int(os.getenv("JOB_MEMORY_MAX_BYTES", str(256 * 1024 * 1024)))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+JOBS_TOTAL = counter("afi_prediction_jobs_total", "Prediction jobs by final status", ("status",))
+JOBS_QUEUED = gauge("afi_prediction_jobs_queued", "Jobs submitted but not yet claimed (this process)")
+
+def public_view(job: Dict) -> Dict:
+    """Job as returned to clients, without image payloads."""
+    return {
+        "id": str(job["_id"]),
+        "status": job["status"],
+        "total": job["total"],
+        "processed": job["processed"],
+        "results": job.get("results", []),
+        "error": job.get("error"),
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+def new_job(doctor_id: str, items: List[Dict], patient_id: Optional[str] = None) -> Dict:
+    now = datetime.now()
+    return {
+        "_id": ObjectId(),
+        "status": QUEUED,
+        "doctor_id": doctor_id,
+        "patient_id": patient_id,
+        "items": items,
+        "total": len(items),
+        "processed": 0,
+        "results": [],
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+class JobQueue:
+    """Backend interface."""
+
+    async def submit(self, job: Dict) -> str:
+        raise NotImplementedError
+
+    async def claim(self, limit: int, worker_id: str) -> List[Dict]:
+        raise NotImplementedError
+
+    async def update(self, job_id, **fields) -> None:
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def wait_for_update(self, job_id: str, since: datetime, timeout: float) -> Optional[Dict]:
+        """Return the job once updated_at is newer than since, or the current job after timeout."""
+        raise NotImplementedError
+
+    async def renew(self, job_ids: List, worker_id: str) -> None:
+        """Extend the lease of running jobs; backends without leases have nothing to do."""
+
+def payload_bytes(job: Dict) -> int:
+    return sum(len(item["image"]) for item in job.get("items", []))
+
+class InMemoryJobQueue(JobQueue):
+    """
+    Jobs are handed out as copies, so callers comparing an earlier snapshot with a
+    later one (the SSE stream) see the change.
+    """
+
+    def __init__(self, max_jobs: int = JOB_MEMORY_MAX_JOBS, max_bytes: int = JOB_MEMORY_MAX_BYTES):
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self._jobs: Dict[str, Dict] = {}
+        self._bytes = 0
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._events: Dict[str, asyncio.Event] = {}
+
+    def _notify(self, job_id: str):
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _evict_finished(self):
+        # Dicts keep insertion order, so this drops the oldest finished jobs first
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_jobs + 1)]:
+            del self._jobs[job_id]
+
+    async def submit(self, job):
+        size = payload_bytes(job)
+        if len(self._jobs) >= self.max_jobs:
+            self._evict_finished()
+        if len(self._jobs) >= self.max_jobs or self._bytes + size > self.max_bytes:
+            raise RuntimeError("Job queue is full, retry later")
+        job_id = str(job["_id"])
+        self._jobs[job_id] = job
+        self._bytes += size
+        await self._pending.put(job_id)
+        JOBS_QUEUED.inc()
+        return job_id
+
+    async def claim(self, limit, worker_id):
+        # Block for the first job, then take whatever else is already waiting
+        job_ids = [await self._pending.get()]
+        while len(job_ids) < limit and not self._pending.empty():
+            job_ids.append(self._pending.get_nowait())
+        jobs = []
+        for job_id in job_ids:
+            JOBS_QUEUED.dec()
+            job = self._jobs[job_id]
+            job.update(status=RUNNING, worker_id=worker_id, updated_at=datetime.now())
+            self._notify(job_id)
+            jobs.append(copy.deepcopy(job))
+        return jobs
+
+    async def update(self, job_id, **fields):
+        job = self._jobs.get(str(job_id))
+        if job is None:
+            return
+        job.update(copy.deepcopy(fields), updated_at=datetime.now())
+        if job["status"] in (DONE, FAILED) and "items" in job:
+            self._bytes -= payload_bytes(job)
+            del job["items"]
+        self._notify(str(job_id))
+
+    async def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return copy.deepcopy(job) if job is not None else None
+
+    async def wait_for_update(self, job_id, since, timeout):
+        job = self._jobs.get(job_id)
+        if job is not None and job["updated_at"] <= since:
+            event = self._events.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await self.get(job_id)
+
+class MongoJobQueue(JobQueue):
+    poll_interval = 0.5
+
+    def __init__(self, get_database: Callable):
+        self._get_database = get_database
+
+    @property
+    def collection(self):
+        db = self._get_database()
+        if db is None:
+            raise RuntimeError("Database connection unavailable")
+        return db.prediction_jobs
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", 1), ("created_at", 1)])
+
+    async def submit(self, job):
+        await self.collection.insert_one(job)
+        return str(job["_id"])
+
+    async def claim(self, limit, worker_id):
+        jobs = []
+        while len(jobs) < limit:
+            now = datetime.now()
+            job = await self.collection.find_one_and_update(
+                {"$or": [
+                    {"status": QUEUED},
+                    # Lease expired: the worker that claimed it is gone
+                    {"status": RUNNING, "lease_until": {"$lt": now}},
+                ]},
+                {"$set": {
+                    "status": RUNNING,
+                    "worker_id": worker_id,
+                    "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "updated_at": now,
+                }},
+                sort=[("created_at", 1)],
+                return_document=True,
+            )
+            if job is None:
+                break
+            jobs.append(job)
+        if not jobs:
+            await asyncio.sleep(self.poll_interval)
+        return jobs
+
+    async def update(self, job_id, **fields):
+        update = {"$set": {**fields, "updated_at": datetime.now()}}
+        if fields.get("status") in (DONE, FAILED):
+            update["$unset"] = {"items": ""}
+        await self.collection.update_one({"_id": ObjectId(job_id)}, update)
+
+    async def renew(self, job_ids, worker_id):
+        await self.collection.update_many(
+            {"_id": {"$in": [ObjectId(job_id) for job_id in job_ids]}, "status": RUNNING, "worker_id": worker_id},
+            # updated_at is left alone: a renewal is not progress clients should hear about
+            {"$set": {"lease_until": datetime.now() + timedelta(seconds=JOB_LEASE_SECONDS)}},
+        )
+
+    async def get(self, job_id):
+        if not ObjectId.is_valid(job_id):
+            return None
+        return await self.collection.find_one({"_id": ObjectId(job_id)}, {"items": 0})
+
+    async def wait_for_update(self, job_id, since, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            job = await self.get(job_id)
+            if job is None or job["updated_at"] > since or loop.time() >= deadline:
+                return job
+            await asyncio.sleep(self.poll_interval)
+
+Processor = Callable[[List[Dict], JobQueue], Awaitable[None]]
+
+class JobWorkers:
+    """Background tasks that claim batches of jobs and hand them to the processor."""
+
+    def __init__(self, queue: JobQueue, processor: Processor, workers: int = JOB_WORKERS,
+                 batch_size: int = JOB_BATCH_SIZE):
+        self.queue = queue
+        self.processor = processor
+        self.workers = workers
+        self.batch_size = batch_size
+        self._tasks: List[asyncio.Task] = []
+
+    async def _run(self, worker_id: str):
+        while True:
+            try:
+                jobs = await self.queue.claim(self.batch_size, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  Job claim failed: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if not jobs:
+                continue
+            renewal = asyncio.create_task(self._renew_leases(jobs, worker_id))
+            try:
+                await self.processor(jobs, self.queue)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Job batch failed: {e}")
+                for job in jobs:
+                    await self.queue.update(job["_id"], status=FAILED, error=str(e))
+                    JOBS_TOTAL.inc(FAILED)
+            finally:
+                renewal.cancel()
+                await asyncio.gather(renewal, return_exceptions=True)
+
+    async def _renew_leases(self, jobs: List[Dict], worker_id: str):
+        """Keep the batch's leases alive while it is processed, so no other worker claims it again."""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await self.queue.renew([job["_id"] for job in jobs], worker_id)
+            except Exception as e:
+                print(f"⚠️  Job lease renewal failed: {e}")
+
+    def start(self):
+        node = os.getenv("HOSTNAME", "local")
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._run(f"{node}:{os.getpid()}:{i}")))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+def create_queue(get_database: Callable) -> JobQueue:
+    if JOB_QUEUE_BACKEND == "mongo":
+        return MongoJobQueue(get_database)
+    if JOB_QUEUE_BACKEND == "memory":
+        return InMemoryJobQueue()
+    raise RuntimeError(f"Unknown JOB_QUEUE_BACKEND: {JOB_QUEUE_BACKEND}")
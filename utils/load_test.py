@@ -0,0 +1,410 @@
+"""
+End-to-end API load test against a seeded dataset.
+
+Seeds MongoDB (or an in-process mongomock stand-in) with doctors, patients,
+predictions and chat turns, then drives a weighted mix of endpoints at a target
+request rate (open loop, Poisson arrivals) and reports latency percentiles and
+error rates per endpoint.
+
+Predictions are spread over doctors with a Zipf distribution, so the busiest
+doctor has a large share (100k+ predictions with the defaults), and doctors are
+picked for traffic in proportion to their workload. Inference uses a stub model
+with a configurable latency, so results reflect the API and data-access code.
+
+Usage:
+    # In-process app and mongomock (pip install mongomock-motor httpx)
+    python -m app.utils.load_test --backend mongomock --rate 50 --duration 60
+
+    # Against a local MongoDB, seeding once into a separate database
+    python -m app.utils.load_test --backend mongo --mongo-url mongodb://localhost:27017 --database afi_loadtest
+
+    # Against a running server seeded as above (it must share SECRET_KEY and DATABASE_NAME)
+    python -m app.utils.load_test --backend mongo --base-url http://localhost:8000
+
+Exits with status 2 if --max-p99-ms or --max-error-rate is exceeded on any endpoint.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Dict, List, Tuple
+from bson import ObjectId
+
+# Tokens are minted locally, so the key must be known before app.utils.auth is imported
+os.environ.setdefault("SECRET_KEY", "load-test-secret")
+
+CLASS_NAMES = ["low", "normal", "high"]
+CLASS_WEIGHTS = [0.2, 0.7, 0.1]
+PASSWORD = "loadtest"
+INSERT_BATCH = 10_000
+FIRST_NAMES = ["Aisha", "Anitha", "Deepa", "Fatima", "Kavya", "Lakshmi", "Maria", "Meera", "Nandini", "Priya",
+               "Radha", "Rekha", "Sara", "Shreya", "Sneha", "Sunita", "Usha", "Vidya"]
+LAST_NAMES = ["Acharya", "Bhat", "Gowda", "Hegde", "Iyer", "Joshi", "Kamath", "Kulkarni", "Menon", "Nair",
+              "Patil", "Rao", "Reddy", "Shetty", "Sharma", "Shenoy", "Singh", "Verma"]
+
+# name -> (weight, method, path)
+SCENARIOS = {
+    "history": (0.35, "GET", "/api/history/predictions"),
+    "patient_records": (0.2, "GET", "/api/patients/records"),
+    "patient_analytics": (0.15, "GET", "/api/patients/analytics"),
+    "chat": (0.2, "POST", "/api/chat/"),
+    "predict_image": (0.1, "POST", "/api/prediction/predict_image"),
+    "patient_search": (0.1, "GET", "/api/patients/search"),
+}
+
+
+def zipf_weights(n: int, skew: float) -> List[float]:
+    weights = [1.0 / (rank ** skew) for rank in range(1, n + 1)]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def random_created_at(rng: random.Random, now: datetime, days: int) -> datetime:
+    """Timestamps over the last `days` days, concentrated in clinic hours."""
+    day = now - timedelta(days=rng.randrange(days))
+    hour = min(23, max(0, int(rng.gauss(12.5, 2.5))))
+    return day.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60), microsecond=0)
+
+
+def prediction_doc(rng: random.Random, doctor_id: str, patient_id, created_at: datetime) -> Dict:
+    predicted = rng.choices(CLASS_NAMES, CLASS_WEIGHTS)[0]
+    confidence = rng.betavariate(8, 2)
+    others = [c for c in CLASS_NAMES if c != predicted]
+    split = rng.random()
+    probabilities = {
+        predicted: confidence,
+        others[0]: (1 - confidence) * split,
+        others[1]: (1 - confidence) * (1 - split),
+    }
+    doc = {
+        "class_prediction": predicted,
+        "confidence": confidence,
+        "probabilities": probabilities,
+        "doctor_id": doctor_id,
+        "image_filename": f"scan_{rng.randrange(10**8)}.png",
+        "created_at": created_at,
+    }
+    if patient_id is not None:
+        doc["patient_id"] = patient_id
+    return doc
+
+
+async def seed(db, args) -> Dict:
+    """Populate db; returns the doctors (with their workload weight) and patients used for traffic."""
+    from app.utils.auth import get_password_hash
+    from app.utils.search import search_terms
+    from app.routers.chat import knowledge
+
+    rng = random.Random(args.seed)
+    now = datetime.now()
+    hashed = get_password_hash(PASSWORD)
+
+    doctors = [{
+        "_id": ObjectId(),
+        "email": f"loadtest-doctor-{i}@example.com",
+        "full_name": f"Doctor {i}",
+        "role": "doctor",
+        "hashed_password": hashed,
+        "created_at": now,
+    } for i in range(args.doctors)]
+    doctor_weights = zipf_weights(args.doctors, args.skew)
+
+    patients = []
+    patients_by_doctor: Dict[int, List[str]] = {i: [] for i in range(args.doctors)}
+    for i in range(args.patients):
+        full_name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        patient = {
+            "_id": ObjectId(),
+            "email": f"{full_name.split()[0].lower()}.{i}@example.com",
+            "full_name": full_name,
+            "role": "patient",
+            "hashed_password": hashed,
+            "created_at": now,
+        }
+        patients.append(patient)
+        # Busier doctors also see more patients
+        doctor_idx = rng.choices(range(args.doctors), doctor_weights)[0]
+        patients_by_doctor[doctor_idx].append(str(patient["_id"]))
+
+    for user in doctors + patients:
+        user["search_terms"] = search_terms(user["full_name"], user["email"])
+    await db.users.create_index("email", unique=True)
+    for start in range(0, len(doctors) + len(patients), INSERT_BATCH):
+        await db.users.insert_many((doctors + patients)[start:start + INSERT_BATCH])
+
+    batch = []
+    for _ in range(args.predictions):
+        doctor_idx = rng.choices(range(args.doctors), doctor_weights)[0]
+        own_patients = patients_by_doctor[doctor_idx]
+        # About one scan in ten is analysed without a registered patient
+        patient_id = rng.choice(own_patients) if own_patients and rng.random() > 0.1 else None
+        batch.append(prediction_doc(
+            rng, str(doctors[doctor_idx]["_id"]), patient_id, random_created_at(rng, now, args.days)
+        ))
+        if len(batch) >= INSERT_BATCH:
+            await db.predictions.insert_many(batch)
+            batch = []
+    if batch:
+        await db.predictions.insert_many(batch)
+
+    messages = list(knowledge)
+    batch = []
+    turns = 0
+    while turns < args.chat_turns:
+        session = str(rng.choice(patients)["_id"]) if patients else str(ObjectId())
+        # Conversations are short: geometric number of exchanges, mean ~4
+        for _ in range(min(args.chat_turns - turns, 1 + int(rng.expovariate(0.25)))):
+            text = rng.choice(messages)
+            created_at = random_created_at(rng, now, 30)
+            batch.append({"sender": "user", "text": text, "session": session, "created_at": created_at})
+            batch.append({"sender": "bot", "text": knowledge[text], "session": session, "created_at": created_at})
+            turns += 1
+        if len(batch) >= INSERT_BATCH:
+            await db.chat_history.insert_many(batch)
+            batch = []
+    if batch:
+        await db.chat_history.insert_many(batch)
+
+    return {
+        "doctors": [d["email"] for d in doctors],
+        "doctor_weights": doctor_weights,
+        "patients": [str(p["_id"]) for p in patients],
+    }
+
+
+async def seed_or_reuse(db, args) -> Dict:
+    """Seed once per parameter set; large datasets are reused across runs unless --reseed."""
+    from app.utils.search import ensure_search_indexes
+    params = {k: getattr(args, k) for k in ("doctors", "patients", "predictions", "chat_turns", "days", "skew", "seed")}
+    meta = await db.loadtest_meta.find_one({"_id": "seed"})
+    if meta and meta["params"] == params and not args.reseed:
+        print("♻️  Reusing seeded dataset")
+        await ensure_search_indexes(db)
+        return meta["population"]
+    if meta or args.reseed:
+        for name in ("users", "predictions", "chat_history", "loadtest_meta"):
+            await db.drop_collection(name)
+
+    start = perf_counter()
+    population = await seed(db, args)
+    await ensure_search_indexes(db)
+    await db.loadtest_meta.insert_one({"_id": "seed", "params": params, "population": population})
+    print(f"🌱 Seeded {args.doctors} doctors, {args.patients} patients, {args.predictions} predictions, "
+          f"{args.chat_turns} chat turns in {perf_counter() - start:.1f}s")
+    return population
+
+
+class StubModel:
+    """Keras-like model returning random probabilities after a fixed delay."""
+
+    def __init__(self, latency_ms: float, num_classes: int):
+        self.latency = latency_ms / 1000.0
+        self.num_classes = num_classes
+
+    def predict(self, batch, verbose=0):
+        import time
+        import numpy as np
+        time.sleep(self.latency)
+        logits = np.random.rand(len(batch), self.num_classes).astype(np.float32)
+        return logits / logits.sum(axis=1, keepdims=True)
+
+
+def sample_png() -> bytes:
+    from PIL import Image
+    import numpy as np
+    pixels = (np.random.rand(224, 224, 3) * 255).astype("uint8")
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, format="PNG")
+    return out.getvalue()
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = math.ceil(q / 100.0 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+def summarize(results: Dict[str, List[Tuple[float, int]]], elapsed: float) -> Dict:
+    report = {}
+    for name, samples in sorted(results.items()):
+        latencies = sorted(ms for ms, _ in samples)
+        errors = sum(1 for _, status in samples if status == 0 or status >= 500)
+        report[name] = {
+            "requests": len(samples),
+            "rps": len(samples) / elapsed if elapsed else 0.0,
+            "error_rate": errors / len(samples) if samples else 0.0,
+            "status_counts": {str(s): sum(1 for _, st in samples if st == s) for s in sorted({st for _, st in samples})},
+            "p50_ms": percentile(latencies, 50),
+            "p90_ms": percentile(latencies, 90),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": latencies[-1] if latencies else 0.0,
+        }
+    return report
+
+
+async def drive(client, population: Dict, args) -> Tuple[Dict, Dict]:
+    """Open-loop traffic: requests start on a Poisson schedule regardless of how slow responses are."""
+    from app.utils.auth import create_access_token
+    from app.routers.chat import knowledge
+
+    rng = random.Random(args.seed + 1)
+    mix = {name: SCENARIOS[name] for name in args.scenarios}
+    names = list(mix)
+    weights = [mix[name][0] for name in names]
+    tokens = {
+        email: create_access_token({"sub": email}, expires_delta=timedelta(hours=2))
+        for email in population["doctors"]
+    }
+    image = sample_png() if "predict_image" in mix else None
+    messages = list(knowledge)
+
+    results: Dict[str, List[Tuple[float, int]]] = {name: [] for name in names}
+    skipped = {"client_saturated": 0}
+
+    async def one(name: str, email: str):
+        _, method, path = mix[name]
+        kwargs = {"headers": {"Authorization": f"Bearer {tokens[email]}"}}
+        if name == "chat":
+            kwargs["json"] = {"message": rng.choice(messages), "session_id": rng.choice(population["patients"] or [email])}
+        elif name == "predict_image":
+            kwargs["files"] = {"file": ("scan.png", image, "image/png")}
+        elif name == "patient_search":
+            # Typeahead: the first 1-4 characters of a surname
+            kwargs["params"] = {"q": rng.choice(LAST_NAMES)[:rng.randint(1, 4)].lower(), "limit": 10}
+        start = perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+            status = response.status_code
+        except Exception:
+            status = 0
+        results[name].append(((perf_counter() - start) * 1000.0, status))
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    next_at = start
+    in_flight = set()
+    while next_at < start + args.duration:
+        delay = next_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= args.max_in_flight:
+            skipped["client_saturated"] += 1
+        else:
+            name = rng.choices(names, weights)[0]
+            email = rng.choices(population["doctors"], population["doctor_weights"])[0]
+            task = asyncio.create_task(one(name, email))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        next_at += rng.expovariate(args.rate)
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return summarize(results, loop.time() - start), skipped
+
+
+def open_database(args):
+    if args.backend == "mongomock":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--backend mongomock requires the mongomock-motor package")
+        client = AsyncMongoMockClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url, serverSelectionTimeoutMS=5000)
+    return client, client[args.database]
+
+
+async def run(args) -> Dict:
+    import httpx
+
+    client, db = open_database(args)
+    population = await seed_or_reuse(db, args)
+
+    if args.base_url:
+        http = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout)
+    else:
+        # Serve the app in-process on the seeded database with a stub model
+        from app.main import app
+        from app.utils.database import database
+        from app.routers import prediction
+        database.client, database.database = client, db
+        prediction._model = StubModel(args.stub_latency_ms, len(CLASS_NAMES))
+        prediction._class_names = CLASS_NAMES
+        http = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=args.timeout
+        )
+
+    async with http:
+        endpoints, skipped = await drive(http, population, args)
+    client.close()
+    return {
+        "started_at": datetime.now().isoformat(),
+        "target": args.base_url or "in-process",
+        "backend": args.backend,
+        "rate": args.rate,
+        "duration": args.duration,
+        "dataset": {k: getattr(args, k) for k in ("doctors", "patients", "predictions", "chat_turns")},
+        "skipped": skipped,
+        "endpoints": endpoints,
+    }
+
+
+def print_report(report: Dict):
+    print(f"\n{'endpoint':<20}{'reqs':>7}{'rps':>8}{'err%':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)")
+    for name, s in report["endpoints"].items():
+        print(f"{name:<20}{s['requests']:>7}{s['rps']:>8.1f}{s['error_rate'] * 100:>7.1f}"
+              f"{s['p50_ms']:>9.1f}{s['p90_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['max_ms']:>9.1f}")
+    if report["skipped"]["client_saturated"]:
+        print(f"⚠️  {report['skipped']['client_saturated']} requests not sent: --max-in-flight reached")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a large dataset and load-test the API.")
+    parser.add_argument("--backend", choices=("mongomock", "mongo"), default="mongomock")
+    parser.add_argument("--mongo-url", default=os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="afi_loadtest")
+    parser.add_argument("--base-url", default=None, help="Running server to target (default: in-process app)")
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--predictions", type=int, default=300_000)
+    parser.add_argument("--chat-turns", type=int, default=50_000)
+    parser.add_argument("--days", type=int, default=365, help="Spread prediction timestamps over this many days")
+    parser.add_argument("--skew", type=float, default=1.2, help="Zipf exponent of predictions per doctor")
+    parser.add_argument("--reseed", action="store_true")
+    parser.add_argument("--rate", type=float, default=20.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of traffic")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--stub-latency-ms", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None, help="Write the report as JSON")
+    parser.add_argument("--max-p99-ms", type=float, default=None)
+    parser.add_argument("--max-error-rate", type=float, default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
+
+    failures = []
+    for name, s in report["endpoints"].items():
+        if args.max_p99_ms is not None and s["p99_ms"] > args.max_p99_ms:
+            failures.append(f"{name}: p99 {s['p99_ms']:.1f} ms > {args.max_p99_ms} ms")
+        if args.max_error_rate is not None and s["error_rate"] > args.max_error_rate:
+            failures.append(f"{name}: error rate {s['error_rate']:.3f} > {args.max_error_rate}")
+    if failures:
+        print("❌ " + "\n❌ ".join(failures))
+        sys.exit(2)
@@ -0,0 +1,20 @@
+"""
+Model version shared by the API and the offline ML scripts (no third-party imports,
+so evaluate_model.py can use it as `utils.model_version` from the backend directory).
+"""
+import hashlib
+import os
+
+
+def model_version(model_dir: str) -> str:
+    """Short content hash of the SavedModel graph, variables and labels."""
+    digest = hashlib.sha256()
+    for root, _, names in sorted(os.walk(model_dir)):
+        if 'checkpoints' in os.path.relpath(root, model_dir).split(os.sep):
+            continue
+        for name in sorted(names):
+            digest.update(name.encode())
+            with open(os.path.join(root, name), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()[:12]
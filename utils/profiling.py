@@ -0,0 +1,171 @@
+"""
+On-demand request profiling.
+
+Operators enable profiling at runtime (see routers/admin.py), either for a sampled
+fraction of requests on chosen routes or per request with the `X-Profile: 1` header.
+The header is off by default (allow_header) and, when allowed, only honoured on
+requests carrying an admin's bearer token, so clients cannot make the server
+profile their requests.
+Profiles are kept in a bounded in-memory ring and can be downloaded as pstats
+(cProfile mode) or collapsed stacks for flamegraph tools (sampling mode).
+
+When profiling is disabled the middleware does a single attribute check per request.
+
+Note: requests share the event loop thread, so a profile also contains work done by
+other requests interleaved with the profiled one.
+"""
+import cProfile
+import marshal
+import pstats
+import random
+import sys
+import threading
+import uuid
+from collections import Counter as StackCounter, deque
+from datetime import datetime
+from time import perf_counter
+from typing import Dict, List, Optional
+from app.utils.auth import is_admin_token
+
+PROFILE_HEADER = b"x-profile"
+AUTHORIZATION_HEADER = b"authorization"
+MODES = ("cprofile", "sampling")
+
+
+class ProfilingConfig:
+    def __init__(self):
+        self.enabled = False
+        self.mode = "cprofile"
+        self.sample_rate = 0.0
+        self.routes: List[str] = []
+        self.allow_header = False
+        self.sampling_interval = 0.005
+
+    def as_dict(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "mode": self.mode,
+            "sample_rate": self.sample_rate,
+            "routes": self.routes,
+            "allow_header": self.allow_header,
+            "sampling_interval": self.sampling_interval,
+            "capacity": profiles.maxlen,
+        }
+
+
+config = ProfilingConfig()
+profiles: deque = deque(maxlen=20)
+# cProfile cannot nest on one thread, so only one request is profiled at a time
+_active = threading.Lock()
+
+
+def set_capacity(capacity: int) -> None:
+    global profiles
+    profiles = deque(profiles, maxlen=max(1, capacity))
+
+
+def get_profile(profile_id: str) -> Optional[Dict]:
+    for entry in profiles:
+        if entry["id"] == profile_id:
+            return entry
+    return None
+
+
+class _SamplingProfiler:
+    """Samples the stack of one thread on a background thread and counts collapsed stacks."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _header_requested(scope) -> bool:
+    """X-Profile: 1 sent with an admin's bearer token."""
+    requested, token = False, None
+    for name, value in scope.get("headers", []):
+        if name == PROFILE_HEADER:
+            requested = value.strip() in (b"1", b"true")
+        elif name == AUTHORIZATION_HEADER:
+            scheme, _, credentials = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                token = credentials.strip()
+    return requested and token is not None and is_admin_token(token)
+
+
+def _should_profile(scope) -> bool:
+    path = scope.get("path", "")
+    if config.allow_header and _header_requested(scope):
+        return True
+    if config.sample_rate <= 0 or not any(path.startswith(route) for route in config.routes):
+        return False
+    return random.random() < config.sample_rate
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not config.enabled or scope["type"] != "http" or not _should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        if not _active.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        mode = config.mode
+        started_at = datetime.now()
+        start = perf_counter()
+        if mode == "sampling":
+            profiler = _SamplingProfiler(threading.get_ident(), config.sampling_interval)
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if mode == "cprofile":
+                profiler.disable()
+            else:
+                profiler.stop()
+            _active.release()
+            entry = {
+                "id": uuid.uuid4().hex[:12],
+                "mode": mode,
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "started_at": started_at.isoformat(),
+                "duration_ms": (perf_counter() - start) * 1000.0,
+            }
+            if mode == "cprofile":
+                stats = pstats.Stats(profiler)
+                # Same format as pstats.Stats.dump_stats, loadable with pstats/snakeviz
+                entry["data"] = marshal.dumps(stats.stats)
+            else:
+                entry["data"] = profiler.collapsed().encode("utf-8")
+            profiles.append(entry)
@@ -0,0 +1,52 @@
+"""
+Prefix search over users.
+
+Each user document carries `search_terms`: the lowercased full name, each word of
+it, the email and the email's local part. A multikey index on that field turns
+an anchored, case-sensitive regex (`^prefix` on already-lowercased terms) into an
+index range scan, which is what typeahead needs.
+"""
+import re
+from typing import List
+
+SEARCH_BACKFILL_BATCH = 1000
+
+
+def search_terms(full_name: str, email: str) -> List[str]:
+    name = " ".join((full_name or "").lower().split())
+    email = (email or "").lower()
+    terms = {name, email, email.split("@")[0], *name.split(" ")}
+    return sorted(t for t in terms if t)
+
+
+def prefix_query(text: str) -> dict:
+    """Index-friendly prefix match on search_terms; multi-word input matches the full name."""
+    prefix = " ".join(text.lower().split())
+    if not prefix:
+        # `^` alone would match every user
+        raise ValueError("empty search prefix")
+    return {"search_terms": {"$regex": "^" + re.escape(prefix)}}
+
+
+async def ensure_search_indexes(db) -> int:
+    """Create the search indexes and fill search_terms for users created before them."""
+    from pymongo import UpdateOne
+    await db.users.create_index("search_terms")
+    # Lets the doctor's patient set be read with a DISTINCT_SCAN instead of a collection scan
+    await db.predictions.create_index([("doctor_id", 1), ("patient_id", 1)])
+
+    updated = 0
+    batch = []
+    async for user in db.users.find({"search_terms": {"$exists": False}}, {"full_name": 1, "email": 1}):
+        batch.append(UpdateOne(
+            {"_id": user["_id"]},
+            {"$set": {"search_terms": search_terms(user.get("full_name"), user.get("email"))}}
+        ))
+        if len(batch) >= SEARCH_BACKFILL_BATCH:
+            await db.users.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await db.users.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
@@ -0,0 +1,104 @@
+"""
+Fast JSON responses.
+
+FastJSONResponse renders with orjson, which serializes datetime natively; ObjectId
+and Pydantic models are handled by the default hook. Endpoints that build typed
+models from Mongo documents return FastJSONResponse directly so FastAPI does not
+re-validate and re-encode the payload through jsonable_encoder.
+"""
+from typing import Any
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+def _default(obj: Any):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def projection(model: type) -> dict:
+    """Mongo projection for the fields of a response model (plus _id)."""
+    return {name: 1 for name in model.model_fields if name != "id"}
+
+if __name__ == "__main__":
+    # Benchmark: hand-rolled _id renaming + FastAPI's default encoding vs typed models + orjson
+    import json
+    import random
+    import timeit
+    from datetime import datetime, timedelta
+    from fastapi.encoders import jsonable_encoder
+    from app.models.prediction import PredictionHistory
+    from app.models.patient import PatientRecord
+
+    classes = ["low", "normal", "high"]
+    now = datetime.now()
+
+    def history_docs(n):
+        docs = []
+        for i in range(n):
+            probs = [random.random() for _ in classes]
+            total = sum(probs)
+            docs.append({
+                "_id": ObjectId(),
+                "class_prediction": random.choice(classes),
+                "confidence": max(probs) / total,
+                "probabilities": {c: p / total for c, p in zip(classes, probs)},
+                "patient_id": str(ObjectId()),
+                "doctor_id": str(ObjectId()),
+                "image_filename": f"scan_{i}.png",
+                "created_at": now - timedelta(minutes=i),
+            })
+        return docs
+
+    def record_docs(n):
+        return [{
+            "id": str(ObjectId()),
+            "name": f"Patient {i}",
+            "email": f"patient{i}@example.com",
+            "last_analysis": now - timedelta(hours=i),
+            "total_analyses": random.randint(1, 40),
+            "latest_result": random.choice(classes),
+        } for i in range(n)]
+
+    def old_history(docs):
+        out = []
+        for doc in docs:
+            doc = dict(doc)
+            doc["id"] = str(doc["_id"])
+            doc.pop("_id", None)
+            out.append(doc)
+        validated = [PredictionHistory(**d) for d in out]
+        return json.dumps(jsonable_encoder(validated)).encode()
+
+    def new_history(docs):
+        return dumps([PredictionHistory.from_mongo(dict(doc)) for doc in docs])
+
+    def old_records(docs):
+        return json.dumps(jsonable_encoder(docs)).encode()
+
+    def new_records(docs):
+        return dumps([PatientRecord.model_construct(**doc) for doc in docs])
+
+    for label, make, old, new in (
+        ("history", history_docs, old_history, new_history),
+        ("records", record_docs, old_records, new_records),
+    ):
+        for n in (1_000, 10_000, 100_000):
+            docs = make(n)
+            runs = 3 if n >= 100_000 else 10
+            t_old = min(timeit.repeat(lambda: old(docs), number=1, repeat=runs))
+            t_new = min(timeit.repeat(lambda: new(docs), number=1, repeat=runs))
+            print(f"{label:8s} n={n:>7,}: default {t_old * 1000:8.1f} ms  orjson {t_new * 1000:8.1f} ms  "
+                  f"({t_old / t_new:.1f}x)")
@@ -0,0 +1,535 @@
+"""
+Similar-case retrieval over prediction embeddings.
+
+Predictions made with a model exported with the `embed` signature store the
+L2-normalized penultimate-layer activations as float16 bytes (`embedding`, 256 bytes
+for the 128-unit layer of build_model) together with the version of the model that
+produced them (`embedding_model`, the content hash of the whole SavedModel directory
+from utils/model_version.py, so retrained weights count as a new model and the index
+is rebuilt for them).
+
+SimilarityIndex is an IVF (inverted file) index over one model version's embeddings:
+spherical k-means splits the space into nlist cells and every vector is filed under
+its nearest centroid, grouped by doctor. A query only ever scans the doctor's own
+vectors - all of them below SIMILARITY_EXACT_LIMIT, otherwise those in the
+SIMILARITY_NPROBE cells nearest the query, up to SIMILARITY_MAX_CANDIDATES. Scanning
+uses int8 copies with a per-vector scale held in memory (132 bytes per vector); the
+best candidates are then re-scored by cosine similarity on the float16 vectors,
+memory-mapped from disk.
+
+The index is persisted under SIMILARITY_INDEX_DIR as append-only arrays plus a header
+written last, and kept current incrementally: sync() appends predictions written
+since the newest indexed one, whichever process wrote them (API, jobs, backfill).
+The directory must belong to a single API process.
+
+Rebuild offline (API stopped, or into a new SIMILARITY_INDEX_DIR) after adding
+embeddings to older predictions or when the cells no longer fit the data:
+
+    python -m app.utils.similarity [--reembed] [--nlist N]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+from bson import ObjectId
+
+if TYPE_CHECKING:
+    import numpy as np
+
+SIMILARITY_INDEX_DIR = os.getenv(
+    "SIMILARITY_INDEX_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "ml", "data", "similarity"))
+)
+SIMILARITY_NPROBE = int(os.getenv("SIMILARITY_NPROBE", "16"))
+SIMILARITY_EXACT_LIMIT = int(os.getenv("SIMILARITY_EXACT_LIMIT", "20000"))
+SIMILARITY_TRAIN_MIN = int(os.getenv("SIMILARITY_TRAIN_MIN", "10000"))
+SIMILARITY_SYNC_SECONDS = float(os.getenv("SIMILARITY_SYNC_SECONDS", "5"))
+# Upper bound on vectors scanned per query, however large the probed cells are
+SIMILARITY_MAX_CANDIDATES = int(os.getenv("SIMILARITY_MAX_CANDIDATES", "20000"))
+# Candidates re-scored on the float16 vectors: max(k * RERANK_FACTOR, RERANK_MIN)
+RERANK_FACTOR = 8
+RERANK_MIN = 100
+SYNC_BATCH = 10_000
+# Newly added vectors are scanned linearly until this many have accumulated, then filed into cells
+MERGE_PENDING = 10_000
+# ObjectIds from different writers are only roughly ordered, so each sync re-reads this far back
+SYNC_LOOKBACK_SECONDS = 120
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+ID_BYTES = 12
+
+
+def encode_embedding(vector) -> bytes:
+    """L2-normalized float16 bytes for a prediction document."""
+    import numpy as np
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm if norm > 0 else vector).astype(np.float16).tobytes()
+
+
+def decode_embedding(data: bytes) -> np.ndarray:
+    import numpy as np
+    return np.frombuffer(data, dtype=np.float16)
+
+
+def spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Unit-norm centroids [nlist, d] trained on a sample of the (unit-norm) vectors."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))].astype(np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+    for _ in range(iterations):
+        assignment = (sample @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=nlist) == 0
+        # Cells that lost all their points restart from random points
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """int8 codes and per-vector float32 scales; codes * scale approximates the vector."""
+    import numpy as np
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    return np.rint(vectors / scales[:, np.newaxis]).astype(np.int8), scales.astype(np.float32)
+
+
+class SimilarityIndex:
+    """In-memory IVF index over one model version's embeddings, persisted under `directory`."""
+
+    # Persisted per-row arrays: file name -> (dtype, values per row, None = embedding width)
+    FILES = {
+        "vectors.f16": ("float16", None),
+        "ids.u8": ("uint8", ID_BYTES),
+        "doctors.i32": ("int32", 1),
+        "lists.i32": ("int32", 1),
+    }
+
+    def __init__(self, directory: str = SIMILARITY_INDEX_DIR):
+        self.directory = directory
+        self.model_version: Optional[str] = None
+        self.dim = 0
+        self.count = 0
+        # In memory: int8 codes and scales for scanning, ids, doctor codes and cells. The float16
+        # vectors stay on disk and are memory-mapped to re-score the best candidates.
+        self.codes = self.scales = self.ids = self.doctors = self.lists = None
+        self.centroids = None
+        self.doctor_ids: List[str] = []
+        self.doctor_codes: Dict[str, int] = {}
+        self.last_id: Optional[ObjectId] = None
+        self._vectors_map = None
+        # Ids inside the lookback window, so re-read predictions are not indexed twice
+        self._recent = set()
+        # (doctor code -> (cell of each row, rows) sorted by cell, rows covered). Swapped as one
+        # tuple so searches never see cells and coverage from different builds.
+        self._cells: Tuple[Dict[int, Tuple[np.ndarray, np.ndarray]], int] = ({}, 0)
+        self._loaded = False
+        self._synced_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _row_width(self, name: str) -> int:
+        width = self.FILES[name][1]
+        return self.dim if width is None else width
+
+    # -------------------------
+    # PERSISTENCE
+    # -------------------------
+    def reset(self, model_version: Optional[str]) -> None:
+        import numpy as np
+        self._vectors_map = None
+        for name in (*self.FILES, "centroids.npy", "header.json"):
+            if os.path.isfile(self._path(name)):
+                os.remove(self._path(name))
+        self.model_version = model_version
+        self.dim = self.count = 0
+        self.codes = np.zeros((0, 0), dtype=np.int8)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.ids = np.zeros((0, ID_BYTES), dtype=np.uint8)
+        self.doctors = np.zeros(0, dtype=np.int32)
+        self.lists = np.zeros(0, dtype=np.int32)
+        self.centroids = None
+        self.doctor_ids, self.doctor_codes = [], {}
+        self.last_id = None
+        self._recent = set()
+        self._cells = ({}, 0)
+
+    def load(self) -> bool:
+        """Read the persisted index; False (and an empty index) if there is none or it is unreadable."""
+        import numpy as np
+        header_path = self._path("header.json")
+        if not os.path.isfile(header_path):
+            self.reset(None)
+            return False
+        with open(header_path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+        self.model_version, self.dim, self.count = header["model_version"], header["dim"], header["count"]
+        try:
+            columns = {}
+            for name, (dtype, _) in self.FILES.items():
+                width = self._row_width(name)
+                # Rows past the header's count are from an interrupted append and are ignored
+                values = np.fromfile(self._path(name), dtype=dtype, count=self.count * width)
+                if len(values) != self.count * width:
+                    raise ValueError(f"{name} is shorter than the header")
+                columns[name] = values
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Similarity index at {self.directory} is unreadable ({e}); rebuilding")
+            self.reset(self.model_version)
+            return False
+        vectors = columns["vectors.f16"].reshape(self.count, self.dim)
+        self.codes = np.empty((self.count, self.dim), dtype=np.int8)
+        self.scales = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, 65536):
+            self.codes[start:start + 65536], self.scales[start:start + 65536] = quantize(vectors[start:start + 65536])
+        self.ids = columns["ids.u8"].reshape(self.count, ID_BYTES)
+        self.doctors, self.lists = columns["doctors.i32"], columns["lists.i32"]
+        centroids_path = self._path("centroids.npy")
+        self.centroids = np.load(centroids_path) if os.path.isfile(centroids_path) else None
+        self.doctor_ids = header["doctor_ids"]
+        self.doctor_codes = {doctor_id: code for code, doctor_id in enumerate(self.doctor_ids)}
+        self.last_id = ObjectId(header["last_id"]) if header.get("last_id") else None
+        self._rebuild_recent()
+        self._build_cells()
+        return True
+
+    def _write_header(self) -> None:
+        header = {
+            "model_version": self.model_version, "dim": self.dim, "count": self.count,
+            "doctor_ids": self.doctor_ids, "last_id": str(self.last_id) if self.last_id else None,
+            "nlist": len(self.centroids) if self.centroids is not None else 0,
+        }
+        tmp_path = self._path("header.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(header, f)
+        os.replace(tmp_path, self._path("header.json"))
+
+    def _write_rows(self, name: str, start: int, values: np.ndarray) -> None:
+        """Write rows from `start` on, dropping anything an interrupted append left after them."""
+        import numpy as np
+        os.makedirs(self.directory, exist_ok=True)
+        dtype, _ = self.FILES[name]
+        path = self._path(name)
+        with open(path, "r+b" if os.path.isfile(path) else "wb") as f:
+            f.seek(start * self._row_width(name) * np.dtype(dtype).itemsize)
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+            f.truncate()
+
+    def _stored_vectors(self, count: int) -> np.ndarray:
+        """float16 vectors of the first `count` rows, memory-mapped from disk."""
+        import numpy as np
+        vectors = self._vectors_map
+        if vectors is None or len(vectors) < count:
+            vectors = np.memmap(self._path("vectors.f16"), dtype=np.float16, mode="r", shape=(count, self.dim))
+            self._vectors_map = vectors
+        return vectors
+
+    def _rebuild_recent(self) -> None:
+        self._recent = set()
+        if self.last_id is None:
+            return
+        window = timedelta(seconds=SYNC_LOOKBACK_SECONDS)
+        threshold = self.last_id.generation_time - window
+        for row in range(self.count - 1, -1, -1):
+            oid = ObjectId(self.ids[row].tobytes())
+            if oid.generation_time >= threshold:
+                self._recent.add(oid)
+            elif oid.generation_time < threshold - window:
+                # Rows are appended in id order per sync, so nothing older follows
+                break
+
+    # -------------------------
+    # UPDATES
+    # -------------------------
+    def _doctor_code(self, doctor_id: str) -> int:
+        code = self.doctor_codes.get(doctor_id)
+        if code is None:
+            code = len(self.doctor_ids)
+            self.doctor_ids.append(doctor_id)
+            self.doctor_codes[doctor_id] = code
+        return code
+
+    def _reserve(self, rows: int) -> None:
+        import numpy as np
+        needed = self.count + rows
+        if needed <= len(self.ids):
+            return
+        capacity = max(1024, 2 * needed)
+        for attribute, shape in (("codes", (capacity, self.dim)), ("scales", (capacity,)), ("ids", (capacity, ID_BYTES)),
+                                 ("doctors", (capacity,)), ("lists", (capacity,))):
+            old = getattr(self, attribute)
+            grown = np.zeros(shape, dtype=old.dtype)
+            grown[:self.count] = old[:self.count]
+            setattr(self, attribute, grown)
+
+    def _nearest_cells(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        import numpy as np
+        cells = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 65536):
+            cells[start:start + 65536] = (vectors[start:start + 65536].astype(np.float32) @ centroids.T).argmax(axis=1)
+        return cells
+
+    def add(self, ids: List[ObjectId], doctor_ids: List[str], vectors: np.ndarray) -> None:
+        """Append vectors (searchable once `count` moves past them) and persist them."""
+        import numpy as np
+        if self.dim == 0:
+            self.dim = vectors.shape[1]
+            self.codes = np.zeros((0, self.dim), dtype=np.int8)
+        start, n = self.count, len(ids)
+        self._reserve(n)
+        rows = slice(start, start + n)
+        self.codes[rows], self.scales[rows] = quantize(vectors)
+        self.ids[rows] = np.frombuffer(b"".join(oid.binary for oid in ids), dtype=np.uint8).reshape(n, ID_BYTES)
+        self.doctors[rows] = [self._doctor_code(d) for d in doctor_ids]
+        self.lists[rows] = self._nearest_cells(vectors, self.centroids) if self.centroids is not None else -1
+        for name, values in (("vectors.f16", vectors), ("ids.u8", self.ids[rows]),
+                             ("doctors.i32", self.doctors[rows]), ("lists.i32", self.lists[rows])):
+            self._write_rows(name, start, values)
+        self.count = start + n
+        self.last_id = max(ids + ([self.last_id] if self.last_id else []))
+        self._write_header()
+
+    def _build_cells(self) -> None:
+        """Group rows by doctor, sorted by cell, so a query slices out its probed cells."""
+        import numpy as np
+        n = self.count
+        doctors, cells = self.doctors[:n], self.lists[:n]
+        order = np.lexsort((cells, doctors))
+        by_doctor = {}
+        for rows in np.split(order, np.flatnonzero(np.diff(doctors[order])) + 1):
+            if len(rows):
+                by_doctor[int(doctors[rows[0]])] = (cells[rows], rows)
+        self._cells = (by_doctor, n)
+
+    def train(self, nlist: Optional[int] = None) -> None:
+        """Cluster the current vectors into nlist cells (default ~sqrt(count)) and refile every row."""
+        import numpy as np
+        n = self.count
+        nlist = min(n, nlist or int(np.clip(np.sqrt(n), 16, 4096)))
+        vectors = self._stored_vectors(n)[:n]
+        centroids = spherical_kmeans(vectors, nlist)
+        self.lists[:n] = self._nearest_cells(vectors, centroids)
+        # Searches may briefly pair the new centroids with the old cell layout
+        self.centroids = centroids
+        os.makedirs(self.directory, exist_ok=True)
+        np.save(self._path("centroids.tmp.npy"), centroids)
+        os.replace(self._path("centroids.tmp.npy"), self._path("centroids.npy"))
+        self._write_rows("lists.i32", 0, self.lists[:n])
+        self._write_header()
+        self._build_cells()
+
+    def _add_documents(self, docs: List[dict]) -> int:
+        import numpy as np
+        vectors, ids, doctor_ids = [], [], []
+        for doc in docs:
+            vector = decode_embedding(doc["embedding"])
+            if self.dim and len(vector) != self.dim:
+                continue
+            vectors.append(vector)
+            ids.append(doc["_id"])
+            doctor_ids.append(doc["doctor_id"])
+        if ids:
+            self.add(ids, doctor_ids, np.stack(vectors))
+        self._recent.update(ids)
+        if self.last_id is not None:
+            threshold = self.last_id.generation_time - timedelta(seconds=SYNC_LOOKBACK_SECONDS)
+            self._recent = {oid for oid in self._recent if oid.generation_time >= threshold}
+        return len(ids)
+
+    async def sync(self, db, model_version: str) -> int:
+        """Index predictions embedded by model_version that were written since the last sync."""
+        async with self._lock:
+            if not self._loaded:
+                await asyncio.to_thread(self.load)
+                self._loaded = True
+            if self.model_version != model_version:
+                if self.count:
+                    print(f"♻️  Similarity index was built for model {self.model_version}; rebuilding for {model_version}")
+                await asyncio.to_thread(self.reset, model_version)
+
+            query = {"embedding_model": model_version}
+            if self.last_id is not None:
+                since = self.last_id.generation_time - timedelta(seconds=SYNC_LOOKBACK_SECONDS)
+                query["_id"] = {"$gt": ObjectId.from_datetime(since)}
+            added = 0
+            batch = []
+            async for doc in db.predictions.find(query, {"doctor_id": 1, "embedding": 1}).sort("_id", 1):
+                if doc["_id"] in self._recent:
+                    continue
+                batch.append(doc)
+                if len(batch) >= SYNC_BATCH:
+                    added += await asyncio.to_thread(self._add_documents, batch)
+                    batch = []
+            if batch:
+                added += await asyncio.to_thread(self._add_documents, batch)
+
+            if self.centroids is None and self.count >= SIMILARITY_TRAIN_MIN:
+                await asyncio.to_thread(self.train)
+            elif self.count - self._cells[1] >= MERGE_PENDING:
+                await asyncio.to_thread(self._build_cells)
+            self._synced_at = time.monotonic()
+            return added
+
+    async def refresh(self, db, model_version: str) -> None:
+        """sync() at most every SIMILARITY_SYNC_SECONDS; once loaded, queries never wait for a running sync."""
+        if self._loaded and (self._lock.locked() or time.monotonic() - self._synced_at < SIMILARITY_SYNC_SECONDS):
+            return
+        await self.sync(db, model_version)
+
+    # -------------------------
+    # QUERIES
+    # -------------------------
+    def _candidates(self, code: int, query: np.ndarray, count: int) -> List[np.ndarray]:
+        import numpy as np
+        by_doctor, covered = self._cells
+        centroids = self.centroids
+        parts = []
+        entry = by_doctor.get(code)
+        if entry is not None:
+            cells, rows = entry
+            if centroids is None or len(rows) <= SIMILARITY_EXACT_LIMIT:
+                parts.append(rows)
+            else:
+                # Nearest cells first, stopping once the candidate budget is reached
+                nprobe = min(SIMILARITY_NPROBE, len(centroids))
+                probes = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+                probes = probes[np.argsort(-(centroids[probes] @ query))]
+                starts = np.searchsorted(cells, probes, side="left")
+                ends = np.searchsorted(cells, probes, side="right")
+                scanned = np.cumsum(ends - starts)
+                last = min(len(probes), int(np.searchsorted(scanned, SIMILARITY_MAX_CANDIDATES)) + 1)
+                parts.extend(rows[s:e] for s, e in zip(starts[:last], ends[:last]))
+        if covered < count:
+            parts.append(covered + np.flatnonzero(self.doctors[covered:count] == code))
+        return parts
+
+    def search(self, doctor_id: str, query: np.ndarray, k: int,
+               exclude: Optional[ObjectId] = None) -> List[Tuple[ObjectId, float]]:
+        """Top-k (prediction id, cosine similarity) among the doctor's indexed predictions."""
+        import numpy as np
+        # count first: arrays are only ever replaced by larger copies, rows below count are final
+        count = self.count
+        code = self.doctor_codes.get(doctor_id)
+        if code is None or count == 0 or len(query) != self.dim:
+            return []
+        codes, scales, ids = self.codes, self.scales, self.ids
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        parts = self._candidates(code, query, count)
+        if not parts:
+            return []
+        candidates = np.concatenate(parts)
+        if not len(candidates):
+            return []
+
+        # Approximate scores on the int8 codes, then exact ones for the best few on the float16 vectors
+        scores = (codes[candidates].astype(np.float32) @ query) * scales[candidates]
+        shortlist = min(len(candidates), max(k * RERANK_FACTOR, RERANK_MIN))
+        if shortlist < len(candidates):
+            candidates = candidates[np.argpartition(-scores, shortlist - 1)[:shortlist]]
+        candidates.sort()
+        if exclude is not None:
+            candidates = candidates[~(ids[candidates] == np.frombuffer(exclude.binary, dtype=np.uint8)).all(axis=1)]
+        scores = self._stored_vectors(count)[candidates].astype(np.float32) @ query
+        top = np.argsort(-scores)[:k]
+        return [(ObjectId(ids[candidates[i]].tobytes()), float(scores[i])) for i in top]
+
+
+similarity_index = SimilarityIndex()
+
+
+async def ensure_similarity_indexes(db) -> None:
+    # Incremental sync reads predictions of one model version in _id order
+    await db.predictions.create_index([("embedding_model", 1), ("_id", 1)])
+
+
+async def reembed(db, batch_size: int = 64) -> int:
+    """Compute embeddings for stored predictions whose image is kept but whose embedding is missing or stale."""
+    import numpy as np
+    from pymongo import UpdateOne
+    from app.routers import prediction
+    from app.utils.image_store import get_image_store
+
+    model, _ = prediction.ensure_model()
+    if model is None or prediction._embed_fn is None:
+        raise RuntimeError("The loaded model has no `embed` signature; re-export it with convert_h5_to_savedmodel.py")
+    version = prediction._model_version
+    store = get_image_store()
+    updated = 0
+
+    async def flush(docs):
+        frames, embedded = [], []
+        for doc in docs:
+            try:
+                frames.append(await asyncio.to_thread(prediction.decode_image, await store.read(doc["image_ref"])))
+                embedded.append(doc)
+            except Exception as e:
+                print(f"⚠️  Skipping {doc['_id']}: {getattr(e, 'detail', e)}")
+        if not embedded:
+            return 0
+        _, embeddings = await asyncio.to_thread(
+            prediction.predict_with_embeddings, model, prediction.scale_images(np.stack(frames))
+        )
+        await db.predictions.bulk_write([
+            UpdateOne({"_id": d["_id"]}, {"$set": {"embedding": encode_embedding(e), "embedding_model": version}})
+            for d, e in zip(embedded, embeddings)
+        ], ordered=False)
+        return len(embedded)
+
+    batch = []
+    query = {"image_ref": {"$exists": True}, "embedding_model": {"$ne": version}}
+    async for doc in db.predictions.find(query, {"image_ref": 1}):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            updated += await flush(batch)
+            batch = []
+    if batch:
+        updated += await flush(batch)
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the similar-case index from MongoDB.")
+    parser.add_argument("--reembed", action="store_true", help="First embed stored scans that have no current embedding")
+    parser.add_argument("--nlist", type=int, default=None, help="Number of cells (default ~sqrt(vectors))")
+    parser.add_argument("--directory", default=SIMILARITY_INDEX_DIR)
+    args = parser.parse_args()
+
+    async def main():
+        os.environ.setdefault("SECRET_KEY", "offline-similarity")
+        from app.routers import prediction
+        from app.utils.database import connect_to_mongo, close_mongo_connection, get_database
+        await connect_to_mongo()
+        db = get_database()
+        if db is None:
+            raise SystemExit(1)
+        await ensure_similarity_indexes(db)
+        if args.reembed:
+            print(f"🧬 Embedded {await reembed(db)} stored scans")
+        model_version = prediction.current_model_version()
+        index = SimilarityIndex(args.directory)
+        index.reset(model_version)
+        index._loaded = True
+        started = time.perf_counter()
+        await index.sync(db, model_version)
+        if index.count:
+            await asyncio.to_thread(index.train, args.nlist)
+        await close_mongo_connection()
+        return index, time.perf_counter() - started
+
+    index, seconds = asyncio.run(main())
+    cells = len(index.centroids) if index.centroids is not None else 0
+    print(f"✅ Indexed {index.count} embeddings in {cells} cells for model {index.model_version} "
+          f"in {seconds:.1f}s ({args.directory})")
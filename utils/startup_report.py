@@ -0,0 +1,81 @@
+"""
+Cold-start report for the API process.
+
+Imports app.main in a fresh interpreter with `-X importtime` and breaks the cost
+down per top-level package and per module. With --budget-ms it exits non-zero when
+the total import time exceeds the budget, so it can gate CI:
+
+    python -m app.utils.startup_report --budget-ms 1500
+    ENABLED_ROUTERS=chat python -m app.utils.startup_report
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+DEFAULT_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1500"))
+
+def measure(target: str = "app.main", runs: int = 3):
+    """
+    Import target in fresh interpreters and return (best total ms, per-module rows)
+    where rows are (module, self_us, cumulative_us) from the fastest run.
+    """
+    env = dict(os.environ)
+    # app.utils.auth refuses to import without a key; any value is fine for timing
+    env.setdefault("SECRET_KEY", "startup-report")
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {target}; "
+        "print((time.perf_counter() - t) * 1000.0)"
+    )
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"Importing {target} failed:\n{proc.stderr[-2000:]}")
+        total_ms = float(proc.stdout.strip().splitlines()[-1])
+        if best is None or total_ms < best[0]:
+            best = (total_ms, proc.stderr)
+
+    rows = []
+    for line in best[1].splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return best[0], rows
+
+def report(total_ms: float, rows, top: int = 15) -> str:
+    per_package = defaultdict(int)
+    for name, self_us, _ in rows:
+        per_package[name.split(".")[0]] += self_us
+
+    lines = [f"Cold import of app.main: {total_ms:.1f} ms", "", "By top-level package (self time):"]
+    for package, us in sorted(per_package.items(), key=lambda kv: -kv[1])[:top]:
+        lines.append(f"  {package:30s} {us / 1000.0:8.1f} ms")
+    lines += ["", "Slowest modules (cumulative):"]
+    for name, _, cumulative_us in sorted(rows, key=lambda r: -r[2])[:top]:
+        lines.append(f"  {name:50s} {cumulative_us / 1000.0:8.1f} ms")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time breakdown and cold-start budget check.")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help=f"Fail if cold import exceeds this (STARTUP_BUDGET_MS, default {DEFAULT_BUDGET_MS:g})")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    total, module_rows = measure(runs=args.runs)
+    print(report(total, module_rows, args.top))
+
+    budget = args.budget_ms if args.budget_ms is not None else DEFAULT_BUDGET_MS
+    if total > budget:
+        print(f"\n❌ Cold start {total:.1f} ms exceeds the {budget:g} ms budget")
+        sys.exit(1)
+    print(f"\n✅ Cold start within the {budget:g} ms budget")
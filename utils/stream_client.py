@@ -0,0 +1,253 @@
+"""
+Synthetic client for the frame-streaming WebSocket (/api/prediction/stream).
+
+Generates ultrasound-like frames (speckle noise with a dark fluid pocket that drifts
+and changes size), JPEG-encodes them and sends them at a fixed frame rate from one
+or more concurrent sessions, then reports delivered frame rate, drop rate and
+frame-to-result latency.
+
+Usage:
+    # In-process app, mongomock database and a stub model (pip install mongomock-motor)
+    python -m app.utils.stream_client --sessions 8 --fps 30 --seconds 20
+
+    # Against a running server (pip install websockets)
+    python -m app.utils.stream_client --url ws://localhost:8000/api/prediction/stream --token <JWT>
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import quote
+
+# Tokens are minted locally for the in-process run
+os.environ.setdefault("SECRET_KEY", "stream-client-secret")
+
+STREAM_PATH = "/api/prediction/stream"
+
+
+def synthetic_frames(seed: int, size: int = 224, quality: int = 80) -> Iterator[bytes]:
+    """Endless JPEG frames: Rayleigh speckle with an elliptical dark pocket moving over time."""
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size]
+    phase = rng.uniform(0, 2 * math.pi)
+    t = 0
+    while True:
+        speckle = rng.rayleigh(55.0, (size, size))
+        cx = size * (0.5 + 0.15 * math.sin(t / 40 + phase))
+        cy = size * (0.55 + 0.1 * math.cos(t / 55 + phase))
+        rx = size * (0.18 + 0.1 * math.sin(t / 90 + phase))
+        ry = rx * 0.6
+        pocket = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1.0
+        frame = np.clip(np.where(pocket, speckle * 0.15, speckle), 0, 255).astype(np.uint8)
+        out = io.BytesIO()
+        Image.fromarray(frame, mode="L").save(out, format="JPEG", quality=quality)
+        yield out.getvalue()
+        t += 1
+
+
+class InProcessWebSocket:
+    """Minimal ASGI WebSocket client: runs one connection against the app on this event loop."""
+
+    def __init__(self, app, path: str, query: str):
+        self.app = app
+        self.scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "path": path,
+            "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+            "headers": [], "client": ("127.0.0.1", 0), "server": ("stream-client", 80), "subprotocols": [],
+        }
+        self._to_app: asyncio.Queue = asyncio.Queue()
+        self._from_app: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        self._task = asyncio.create_task(self.app(self.scope, self._to_app.get, self._from_app.put))
+        await self._to_app.put({"type": "websocket.connect"})
+        message = await self._from_app.get()
+        if message["type"] != "websocket.accept":
+            raise ConnectionError(f"Rejected: {message.get('code')} {message.get('reason', '')}")
+        return self
+
+    async def send(self, data):
+        key = "bytes" if isinstance(data, bytes) else "text"
+        await self._to_app.put({"type": "websocket.receive", key: data})
+
+    async def recv(self):
+        message = await self._from_app.get()
+        if message["type"] != "websocket.send":
+            return None
+        return message.get("text") if message.get("text") is not None else message.get("bytes")
+
+    async def close(self):
+        await self._to_app.put({"type": "websocket.disconnect", "code": 1000})
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class RemoteWebSocket:
+    """Same interface over the `websockets` package, for a running server."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._ws = None
+
+    async def connect(self):
+        try:
+            import websockets
+        except ImportError:
+            sys.exit("--url requires the websockets package")
+        self._ws = await websockets.connect(self.url, max_size=None)
+        return self
+
+    async def send(self, data):
+        await self._ws.send(data)
+
+    async def recv(self):
+        import websockets
+        try:
+            return await self._ws.recv()
+        except websockets.ConnectionClosed:
+            return None
+
+    async def close(self):
+        await self._ws.close()
+
+
+async def run_session(ws, frames: Iterator[bytes], fps: float, seconds: float) -> Dict:
+    """Send frames open loop at `fps`; collect results until the server's summary arrives."""
+    sent_at: Dict[int, float] = {}
+    latencies: List[float] = []
+    summary: Dict = {}
+    errors = 0
+
+    async def send_frames():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sequence = 0
+        while loop.time() - start < seconds:
+            sequence += 1
+            sent_at[sequence] = perf_counter()
+            await ws.send(next(frames))
+            await asyncio.sleep(max(0.0, start + sequence / fps - loop.time()))
+        await ws.send(json.dumps({"type": "end"}))
+
+    sender = asyncio.create_task(send_frames())
+    while True:
+        message = await ws.recv()
+        if message is None:
+            break
+        payload = json.loads(message)
+        if payload["type"] == "prediction":
+            latencies.append((perf_counter() - sent_at[payload["frame"]]) * 1000.0)
+        elif payload["type"] == "error":
+            errors += 1
+        elif payload["type"] == "summary":
+            summary = payload
+            break
+    sender.cancel()
+    await asyncio.gather(sender, return_exceptions=True)
+    await ws.close()
+    return {"sent": len(sent_at), "latencies": latencies, "errors": errors, "summary": summary}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(q / 100.0 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+async def in_process_app(args):
+    """The API on a mongomock database with one doctor and a stub model; returns (app, token)."""
+    from bson import ObjectId
+    from app.main import app
+    from app.routers import prediction
+    from app.utils.auth import create_access_token
+    from app.utils.database import database
+    from app.utils.load_test import CLASS_NAMES, StubModel
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("The in-process run requires the mongomock-motor package")
+    client = AsyncMongoMockClient()
+    database.client, database.database = client, client["afi_stream"]
+    email = "stream-doctor@example.com"
+    await database.database.users.insert_one({
+        "_id": ObjectId(), "email": email, "full_name": "Stream Doctor", "role": "doctor",
+        "hashed_password": "", "created_at": datetime.now(),
+    })
+    prediction._model = StubModel(args.stub_latency_ms, len(CLASS_NAMES))
+    prediction._class_names = CLASS_NAMES
+    return app, create_access_token({"sub": email}, expires_delta=timedelta(hours=1))
+
+
+async def run(args) -> Dict:
+    if args.url:
+        def connection(_):
+            return RemoteWebSocket(f"{args.url}?token={quote(args.token or '')}")
+    else:
+        app, token = await in_process_app(args)
+
+        def connection(_):
+            return InProcessWebSocket(app, STREAM_PATH, f"token={quote(token)}")
+
+    async def one(index: int):
+        ws = await connection(index).connect()
+        return await run_session(ws, synthetic_frames(args.seed + index), args.fps, args.seconds)
+
+    started = perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(args.sessions)), return_exceptions=True)
+    elapsed = perf_counter() - started
+
+    failed = [r for r in results if isinstance(r, BaseException)]
+    sessions = [r for r in results if not isinstance(r, BaseException)]
+    latencies = sorted(ms for s in sessions for ms in s["latencies"])
+    sent = sum(s["sent"] for s in sessions)
+    dropped = sum(s["summary"].get("frames_dropped", 0) for s in sessions)
+    return {
+        "sessions": len(sessions),
+        "rejected_sessions": len(failed),
+        "rejections": sorted({str(e) for e in failed}),
+        "frames_sent": sent,
+        "frames_processed": len(latencies),
+        "frames_dropped": dropped,
+        "frame_errors": sum(s["errors"] for s in sessions),
+        "drop_rate": dropped / sent if sent else 0.0,
+        "processed_fps_per_session": len(latencies) / args.seconds / len(sessions) if sessions else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "seconds": elapsed,
+        "prediction_ids": [s["summary"].get("prediction_id") for s in sessions],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream synthetic frames to the prediction WebSocket.")
+    parser.add_argument("--url", default=None, help=f"ws(s)://host{STREAM_PATH} of a running server (default: in-process)")
+    parser.add_argument("--token", default=None, help="Access token for --url")
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent streams")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--stub-latency-ms", type=float, default=20.0, help="Per-batch latency of the in-process model")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f"📡 {report['sessions']} sessions ({report['rejected_sessions']} rejected), "
+          f"{report['frames_sent']} frames sent, {report['frames_processed']} processed, "
+          f"{report['frames_dropped']} dropped ({report['drop_rate']:.1%})")
+    print(f"⏱️  {report['processed_fps_per_session']:.1f} results/s per session; latency "
+          f"p50 {report['p50_ms']:.1f} ms, p95 {report['p95_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
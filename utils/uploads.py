@@ -0,0 +1,157 @@
+import io
+import os
+from typing import Optional, Tuple
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+from app.utils.metrics import counter
+
+# Configuration
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Whole multipart request bodies; batch job submissions carry several images
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+MAX_JOB_UPLOAD_BYTES = int(os.getenv("MAX_JOB_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+MAX_IMAGE_DIMENSION = int(os.getenv("MAX_IMAGE_DIMENSION", "8192"))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+CHUNK_SIZE = 64 * 1024
+# Bytes needed before the format can be sniffed (DICOM magic sits at offset 128)
+SNIFF_BYTES = 132
+# Stop probing partial uploads for the header after this much data; check once complete instead
+HEADER_PROBE_BYTES = 1024 * 1024
+
+UPLOAD_REJECTIONS = counter(
+    "afi_upload_rejections_total", "Uploads rejected before inference", ("reason",)
+)
+
+def reject(reason: str, status_code: int, detail: str):
+    UPLOAD_REJECTIONS.inc(reason)
+    raise HTTPException(status_code=status_code, detail=detail)
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Identify an upload from its magic bytes: 'jpeg', 'png', 'dicom' or None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if len(head) >= 132 and head[128:132] == b"DICM":
+        return "dicom"
+    return None
+
+def check_dimensions(buffer: io.BytesIO, fmt: str, complete: bool) -> bool:
+    """
+    Read image dimensions from the header without decoding pixels and reject oversized
+    images. Returns False if the header is not yet fully available in buffer.
+    """
+    from PIL import Image
+    position = buffer.tell()
+    try:
+        buffer.seek(0)
+        if fmt == "dicom":
+            # Rows/Columns tags only; pixel data is not read (checked per frame)
+            from app.utils.dicom import dimensions
+            width, height, _ = dimensions(buffer)
+        else:
+            # Image.open only parses the header; pixels are decoded on first access
+            with Image.open(buffer) as img:
+                width, height = img.size
+    except ImportError:
+        reject("unsupported_format", 415, "DICOM uploads are not enabled on this server (pydicom is not installed)")
+    except Image.DecompressionBombError:
+        reject("dimensions", 413, "Image dimensions exceed the decompression limit")
+    except Exception:
+        if not complete:
+            return False
+        reject("unreadable_header", 400, "Failed to process image: unreadable image header")
+    finally:
+        buffer.seek(position)
+
+    if width > MAX_IMAGE_DIMENSION or height > MAX_IMAGE_DIMENSION or width * height > MAX_IMAGE_PIXELS:
+        reject(
+            "dimensions",
+            413,
+            f"Image dimensions {width}x{height} exceed the limit of "
+            f"{MAX_IMAGE_DIMENSION}px per side / {MAX_IMAGE_PIXELS} pixels"
+        )
+    return True
+
+def _too_large(max_bytes: int) -> str:
+    return f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit"
+
+class UploadLimitMiddleware:
+    """
+    Enforce the request size limit on multipart uploads before the body is parsed:
+    a declared Content-Length over the limit is refused without reading anything,
+    and the bytes actually received are counted so chunked or understated bodies
+    stop at the limit instead of being spooled in full. Both answer 413.
+    """
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES, path_limits: Optional[dict] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self.path_limits.get(scope["path"].rstrip("/"), self.max_bytes)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > max_bytes:
+            UPLOAD_REJECTIONS.inc("too_large")
+            await JSONResponse({"detail": _too_large(max_bytes)}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Raised inside form parsing; FastAPI passes HTTPExceptions through unchanged
+                    reject("too_large", 413, _too_large(max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def _is_multipart(scope) -> bool:
+    content_type = dict(scope["headers"]).get(b"content-type", b"")
+    return content_type.startswith(b"multipart/")
+
+async def read_upload(file: UploadFile) -> Tuple[io.BytesIO, str]:
+    """
+    Read an upload in chunks into a single BytesIO. Size is limited earlier by
+    UploadLimitMiddleware; this checks content only. The format is sniffed from
+    magic bytes (client content_type is not trusted) and image dimensions are
+    checked from the header as soon as it has arrived.
+    Returns the buffer positioned at 0 and the sniffed format.
+    """
+    buffer = io.BytesIO()
+    size = 0
+    fmt = None
+    dimensions_checked = False
+
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        buffer.write(chunk)
+
+        if fmt is None and size >= SNIFF_BYTES:
+            fmt = sniff_format(buffer.getbuffer()[:SNIFF_BYTES].tobytes())
+            if fmt is None:
+                reject("unsupported_format", 415, "File must be a JPEG, PNG or DICOM image")
+        if fmt is not None and not dimensions_checked and size <= HEADER_PROBE_BYTES:
+            dimensions_checked = check_dimensions(buffer, fmt, complete=False)
+
+    if size == 0:
+        reject("empty", 400, "Uploaded file is empty")
+    if fmt is None:
+        fmt = sniff_format(buffer.getvalue())
+        if fmt is None:
+            reject("unsupported_format", 415, "File must be a JPEG, PNG or DICOM image")
+    if not dimensions_checked:
+        check_dimensions(buffer, fmt, complete=True)
+
+    buffer.seek(0)
+    return buffer, fmt